@@ -0,0 +1,202 @@
+"""
+Aggregates of forecasts over buckets of hours, computed with NumPy.
+
+The periods of every requested forecast are loaded into one set of columns, packed periods from their forecast rows
+and relational periods with one query for up to MAX_IDS_PER_STATEMENT forecasts,
+and then aggregated for every forecast and bucket at once.
+Buckets are counted from local midnight of the first day of each forecast, 24 hour buckets are days.
+
+Precipitation probability is the share of a bucket's hours with precipitation forecast,
+yr.no's XML forecasts have no probabilities of their own.
+"""
+import json
+import operator
+
+from api.helper import MAX_IDS_PER_STATEMENT
+from api.models import Time
+from api.storage import packed_column
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MINUTES_PER_HOUR = 60
+MINUTES_PER_DAY = 24 * MINUTES_PER_HOUR
+
+# Buckets can be anything from one hour to ten days, about as far as yr.no forecasts reach
+MAX_BUCKET_HOURS = 240
+
+# The columns that are loaded, by (relation, field) of the period
+COLUMNS = (
+    ('start', (None, 'start')),
+    ('end', (None, 'end')),
+    ('temperature', ('temperature', 'value')),
+    ('precipitation', ('precipitation', 'value')),
+    ('precipitation_min', ('precipitation', 'min_value')),
+    ('precipitation_max', ('precipitation', 'max_value')),
+    ('wind_speed', ('wind_speed', 'mps')),
+)
+DATE_COLUMNS = ('start', 'end')
+
+
+def is_available() -> bool:
+    return numpy is not None
+
+
+def load_columns(forecasts) -> dict:
+    """
+    Loads the periods of forecasts into columns
+    Args:
+        forecasts(list): The forecasts
+
+    Returns(dict): A NumPy array per column, and 'forecast' with the forecast id of every period
+    """
+    read_packed = operator.itemgetter(*[packed_column(relation, name) for _, (relation, name) in COLUMNS])
+    packed = []
+    relational = []
+    for forecast in forecasts:
+        if forecast.periods is not None:
+            packed.extend((forecast.id,) + read_packed(row) for row in json.loads(forecast.periods))
+        else:
+            relational.append(forecast.id)
+
+    frames = [_columns_of_rows(packed)]
+    lookups = [name if relation is None else '{0}__{1}'.format(relation, name) for _, (relation, name) in COLUMNS]
+    for start in range(0, len(relational), MAX_IDS_PER_STATEMENT):
+        chunk = relational[start:start + MAX_IDS_PER_STATEMENT]
+        rows = Time.objects.filter(forecast_id__in=chunk).values_list('forecast_id', *lookups)
+        frames.append(_columns_of_rows(list(rows)))
+    return concatenate(frames)
+
+
+def columns_of_periods(forecast_id, periods) -> dict:
+    """
+    Columns of periods that are already read
+    Args:
+        forecast_id(int): The id of their forecast
+        periods(list): The periods, shaped like Time.to_dict()
+
+    Returns(dict): A NumPy array per column, like load_columns()
+    """
+    rows = []
+    for period in periods:
+        rows.append((forecast_id,) + tuple(period[name] if relation is None else period[relation][name]
+                                           for _, (relation, name) in COLUMNS))
+    return _columns_of_rows(rows)
+
+
+def _columns_of_rows(rows) -> dict:
+    values = list(zip(*rows)) or [()] * (len(COLUMNS) + 1)
+    columns = {'forecast': numpy.array(values[0], dtype='int64')}
+    for (column, _), column_values in zip(COLUMNS, values[1:]):
+        # Packed values are strings and relational values decimals, both convert
+        dtype = 'datetime64[m]' if column in DATE_COLUMNS else 'float64'
+        columns[column] = numpy.array(column_values, dtype=dtype)
+    return columns
+
+
+def concatenate(frames) -> dict:
+    """
+    Joins columns loaded separately
+    """
+    return {column: numpy.concatenate([frame[column] for frame in frames]) for column in frames[0]}
+
+
+def aggregate(columns: dict, bucket_hours: int, base: float) -> dict:
+    """
+    Aggregates the periods of every forecast by bucket
+    Args:
+        columns(dict): The periods, from load_columns()
+        bucket_hours(int): Hours in a bucket
+        base(float): The base temperature of the degree-hours
+
+    Returns(dict): A NumPy array per aggregate, with one value per forecast and bucket, ordered by forecast and start
+    """
+    if not len(columns['forecast']):
+        return {}
+    order = numpy.lexsort((columns['start'], columns['forecast']))
+    forecast = columns['forecast'][order]
+    start = columns['start'][order].astype('int64')
+    hours = (columns['end'][order].astype('int64') - start) / MINUTES_PER_HOUR
+    temperature = columns['temperature'][order]
+    precipitation = columns['precipitation'][order]
+
+    # Midnight of the first day of each forecast, repeated for each of its periods
+    firsts = numpy.flatnonzero(numpy.r_[True, forecast[1:] != forecast[:-1]])
+    counts = numpy.diff(numpy.r_[firsts, len(forecast)])
+    origin = numpy.repeat(start[firsts] // MINUTES_PER_DAY * MINUTES_PER_DAY, counts)
+
+    bucket_minutes = bucket_hours * MINUTES_PER_HOUR
+    bucket = (start - origin) // bucket_minutes
+    edges = numpy.flatnonzero(numpy.r_[True, (forecast[1:] != forecast[:-1]) | (bucket[1:] != bucket[:-1])])
+
+    def total(values):
+        return numpy.add.reduceat(values, edges)
+
+    bucket_start = origin[edges] + bucket[edges] * bucket_minutes
+    return {
+        'forecast': forecast[edges],
+        'start': bucket_start.astype('datetime64[m]'),
+        'end': (bucket_start + bucket_minutes).astype('datetime64[m]'),
+        'periods': numpy.diff(numpy.r_[edges, len(forecast)]),
+        'hours': total(hours),
+        'temperature_min': numpy.minimum.reduceat(temperature, edges),
+        'temperature_max': numpy.maximum.reduceat(temperature, edges),
+        'temperature_mean': total(temperature * hours) / total(hours),
+        'precipitation': total(precipitation),
+        'precipitation_min': total(columns['precipitation_min'][order]),
+        'precipitation_max': total(columns['precipitation_max'][order]),
+        'precipitation_probability': total(hours * (precipitation > 0)) / total(hours),
+        'wind_speed_max': numpy.maximum.reduceat(columns['wind_speed'][order], edges),
+        'heating_degree_hours': total(numpy.clip(base - temperature, 0, None) * hours),
+        'cooling_degree_hours': total(numpy.clip(temperature - base, 0, None) * hours),
+    }
+
+
+def buckets_by_forecast(aggregates: dict, base: float) -> dict:
+    """
+    Formats aggregates for the response
+    Args:
+        aggregates(dict): From aggregate()
+        base(float): The base temperature of the degree-hours
+
+    Returns(dict): The buckets of each forecast by forecast id, oldest first
+    """
+    if not aggregates:
+        return {}
+    values = {
+        name: numpy.round(column, 2).tolist() if column.dtype.kind == 'f' else column.tolist()
+        for name, column in aggregates.items() if name not in DATE_COLUMNS
+    }
+    values['start'] = numpy.datetime_as_string(aggregates['start'], unit='s').tolist()
+    values['end'] = numpy.datetime_as_string(aggregates['end'], unit='s').tolist()
+
+    buckets = {}
+    for i, forecast in enumerate(values['forecast']):
+        buckets.setdefault(forecast, []).append({
+            'start': values['start'][i],
+            'end': values['end'][i],
+            'periods': values['periods'][i],
+            'hours': values['hours'][i],
+            'temperature': {
+                'min': values['temperature_min'][i],
+                'max': values['temperature_max'][i],
+                'mean': values['temperature_mean'][i],
+            },
+            'precipitation': {
+                'total': values['precipitation'][i],
+                'min': values['precipitation_min'][i],
+                'max': values['precipitation_max'][i],
+                'probability': values['precipitation_probability'][i],
+            },
+            'wind_speed': {
+                'max': values['wind_speed_max'][i],
+            },
+            'degree_hours': {
+                'base': base,
+                'heating': values['heating_degree_hours'][i],
+                'cooling': values['cooling_degree_hours'][i],
+            },
+        })
+    return buckets
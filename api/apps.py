@@ -1,5 +1,31 @@
+import os
+import stat
+
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+def make_private_directory(path: str) -> None:
+    """
+    Creates a directory only the user running the api can read and write.
+    The file based response cache is pickled, and loading a file someone else wrote would run their code
+    Args:
+        path(str): The directory
+
+    Raises:
+        ImproperlyConfigured: If the path is not a directory of this user
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    status = os.lstat(path)
+    if not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid():
+        raise ImproperlyConfigured('{0} must be a directory owned by the user running the api'.format(path))
+    if stat.S_IMODE(status.st_mode) != 0o700:
+        os.chmod(path, 0o700)
 
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        make_private_directory(settings.VAR_DIR)
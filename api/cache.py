@@ -0,0 +1,257 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+# A serialized search response with its validators, last_modified in seconds since the epoch.
+# encoded maps content codings to the compressed body
+CachedResponse = namedtuple('CachedResponse', ['body', 'encoded', 'etag', 'last_modified', 'expires_at'])
+
+
+def cache_key(search, language, forecast_type, summaries=False) -> tuple:
+    """
+    The key a search is cached under
+    Args:
+        search(str): The searched location, with trailing slash
+        language(str): The language of the weather forecast
+        forecast_type(str): The forecast type (hourly/standard)
+        summaries(bool): If the response has day summaries
+
+    Returns(tuple): The key
+    """
+    if summaries:
+        return search, language, forecast_type, 'summaries'
+    return search, language, forecast_type
+
+
+class ResponseCache:
+    """
+    Thread safe in-process cache with an entry cap, least recently used eviction and a time to live per entry
+    """
+
+    def __init__(self, max_entries: int, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the cached value, or None if it is missing or has expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires = entry
+            if expires <= self.clock():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float) -> None:
+        """
+        Caches a value for ttl seconds, evicting the least recently used entries above the cap
+        """
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (value, self.clock() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                entries=len(self._entries),
+                max_entries=self.max_entries,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions
+            )
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SharedResponseCache:
+    """
+    Keeps responses in a Django cache, so that every worker process using that cache shares them.
+    Has the interface of ResponseCache. The entry cap and eviction are left to the cache backend,
+    and a cache that fails is logged and treated as a miss, the search is then answered from the database
+    """
+
+    def __init__(self, alias: str):
+        self.alias = alias
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        # Django opens the cache once per thread
+        return caches[self.alias]
+
+    @staticmethod
+    def shared_key(key) -> str:
+        """
+        Searches hold any character, and memcached only takes short ASCII keys without spaces
+        """
+        return 'response:' + hashlib.sha1('\x00'.join(key).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached value, or None if it is missing, has expired or the cache failed
+        """
+        try:
+            value = self.cache.get(self.shared_key(key))
+        except Exception:
+            logger.warning('Could not read %s from the %s cache', key, self.alias, exc_info=True)
+            value = None
+            with self._lock:
+                self.errors += 1
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float) -> None:
+        """
+        Caches a value for ttl seconds
+        """
+        if ttl <= 0:
+            return
+        try:
+            self.cache.set(self.shared_key(key), value, ttl)
+        except Exception:
+            logger.warning('Could not cache %s in the %s cache', key, self.alias, exc_info=True)
+            with self._lock:
+                self.errors += 1
+
+    def invalidate(self, key) -> None:
+        try:
+            self.cache.delete(self.shared_key(key))
+        except Exception:
+            # Other workers serve the older response until it expires
+            logger.error('Could not invalidate %s in the %s cache', key, self.alias, exc_info=True)
+            with self._lock:
+                self.errors += 1
+
+    def clear(self) -> None:
+        """
+        Clears the whole Django cache, so it should only hold responses
+        """
+        self.cache.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                errors=self.errors
+            )
+
+
+class NegativeCache:
+    """
+    Remembers searches yr.no failed to answer, so that they are not downloaded again until the failure expires.
+    Locations yr.no does not know and upstream errors are remembered for different lengths of time
+    """
+    NOT_FOUND = 'not_found'
+    UPSTREAM_ERROR = 'upstream_error'
+
+    def __init__(self, max_entries: int, clock=time.monotonic):
+        self._cache = ResponseCache(max_entries, clock)
+        self._lock = threading.Lock()
+        self.recorded = {self.NOT_FOUND: 0, self.UPSTREAM_ERROR: 0}
+        self.avoided = {self.NOT_FOUND: 0, self.UPSTREAM_ERROR: 0}
+
+    def get(self, key):
+        """
+        Returns(str): Why the search failed, NOT_FOUND or UPSTREAM_ERROR, or None if it has not failed lately
+        """
+        reason = self._cache.get(key)
+        if reason is not None:
+            with self._lock:
+                self.avoided[reason] += 1
+        return reason
+
+    def add(self, key, reason: str) -> None:
+        """
+        Remembers a failed search for NEGATIVE_CACHE_NOT_FOUND_SECONDS or NEGATIVE_CACHE_UPSTREAM_ERROR_SECONDS
+        """
+        if reason == self.NOT_FOUND:
+            ttl = settings.NEGATIVE_CACHE_NOT_FOUND_SECONDS
+        else:
+            ttl = settings.NEGATIVE_CACHE_UPSTREAM_ERROR_SECONDS
+        self._cache.set(key, reason, ttl)
+        with self._lock:
+            self.recorded[reason] += 1
+
+    def invalidate(self, key) -> None:
+        self._cache.invalidate(key)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns(dict): Entries, failures recorded and downloads avoided, per reason
+        """
+        with self._lock:
+            return dict(
+                entries=len(self._cache),
+                not_found=self.recorded[self.NOT_FOUND],
+                upstream_errors=self.recorded[self.UPSTREAM_ERROR],
+                avoided_not_found=self.avoided[self.NOT_FOUND],
+                avoided_upstream_errors=self.avoided[self.UPSTREAM_ERROR]
+            )
+
+    def __len__(self):
+        return len(self._cache)
+
+
+def make_response_cache():
+    """
+    Returns(ResponseCache|SharedResponseCache): The cache RESPONSE_SHARED_CACHE names, or one for this process
+    """
+    if settings.RESPONSE_SHARED_CACHE:
+        return SharedResponseCache(settings.RESPONSE_SHARED_CACHE)
+    return ResponseCache(settings.RESPONSE_CACHE_MAX_ENTRIES)
+
+
+# Serialized search responses, shared by all threads of the process, or by all processes with RESPONSE_SHARED_CACHE
+response_cache = make_response_cache()
+
+# Searches that recently failed upstream, shared by all threads of the process
+negative_cache = NegativeCache(settings.NEGATIVE_CACHE_MAX_ENTRIES)
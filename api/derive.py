@@ -0,0 +1,167 @@
+"""
+Standard forecasts derived from stored hourly forecasts.
+
+A standard forecast has one period per six hours, night (00-06), morning, afternoon and evening.
+When FORECAST_DERIVE_STANDARD is on, and a fresh hourly forecast of the location covers the next
+FORECAST_DERIVE_STANDARD_HOURS, standard searches are answered from it instead of downloading a standard forecast.
+The hourly forecast reaches about two days, a standard forecast about nine. The days after the hourly forecast
+are taken from the stored standard forecast, which may have expired up to FORECAST_DERIVE_STANDARD_TAIL_HOURS ago.
+Without one the standard forecast is downloaded, so that a derived forecast never reaches less far than a real one.
+meta.derived_until tells where the derived periods end. A derived response expires when the hourly forecast does,
+or earlier when its periods no longer cover FORECAST_DERIVE_STANDARD_HOURS.
+"""
+import collections
+import datetime
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+from py_yr.config.settings import FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY
+
+from api.helper import dominant_symbol
+from api.labels import render_forecast
+from api.models import Forecast
+from api.storage import read_periods
+
+PERIOD_HOURS = 6
+
+
+def derive_standard_periods(hourly: list) -> list:
+    """
+    Aggregates hourly periods into six hour periods. A period that has started is kept even if its first hours
+    have passed, the periods after it are only kept while all six hours are there
+    Args:
+        hourly(list): Hourly periods, shaped like Time.to_dict()
+
+    Returns(list): Six hour periods shaped like Time.to_dict(), newest first like read_periods()
+    """
+    blocks = collections.OrderedDict()
+    for period in sorted(hourly, key=lambda p: p['start']):
+        start = period['start']
+        block = start.replace(hour=start.hour // PERIOD_HOURS * PERIOD_HOURS, minute=0, second=0, microsecond=0)
+        blocks.setdefault(block, []).append(period)
+
+    derived = []
+    for index, (block, periods) in enumerate(blocks.items()):
+        if index > 0 and len(periods) < PERIOD_HOURS:
+            break
+        derived.append(aggregate_periods(block, periods))
+    derived.reverse()
+    return derived
+
+
+def aggregate_periods(block: datetime.datetime, periods: list) -> dict:
+    """
+    Aggregates the hours of one six hour period:
+    the mean temperature, the sum of the precipitation, the wind of the windiest hour and the most common symbol
+    Args:
+        block(datetime): Start of the six hour period
+        periods(list): Its hours, oldest first
+
+    Returns(dict): The period, shaped like Time.to_dict()
+    """
+    first = periods[0]
+    windiest = max(periods, key=lambda p: p['wind_speed']['mps'])
+    temperatures = [p['temperature']['value'] for p in periods]
+
+    return dict(
+        start=first['start'],
+        end=block + datetime.timedelta(hours=PERIOD_HOURS),
+        period=block.hour // PERIOD_HOURS,
+        precipitation=dict(
+            value=sum(p['precipitation']['value'] for p in periods),
+            min_value=sum(p['precipitation']['min_value'] for p in periods),
+            max_value=sum(p['precipitation']['max_value'] for p in periods)
+        ),
+        pressure=dict(first['pressure']),
+        symbol=dict(dominant_symbol(periods)),
+        temperature=dict(
+            unit=first['temperature']['unit'],
+            value=float(round(sum(temperatures) / len(temperatures)))
+        ),
+        wind_direction=dict(windiest['wind_direction']),
+        wind_speed=dict(windiest['wind_speed'])
+    )
+
+
+def derived_expires_at(forecast, derived_until: datetime.datetime) -> datetime.datetime:
+    """
+    When a standard forecast derived from an hourly forecast stops being fresh
+    Args:
+        forecast(Forecast): The hourly forecast
+        derived_until(datetime): End of the derived periods, in the local time of the location
+
+    Returns(datetime): The expiry time
+    """
+    covered = derived_until - datetime.timedelta(minutes=forecast.location.timezone.utcoffsetMinutes,
+                                                 hours=settings.FORECAST_DERIVE_STANDARD_HOURS)
+    if forecast.expires_at is None:
+        return covered
+    return min(forecast.expires_at, covered)
+
+
+def standard_tail(search, language, after: datetime.datetime, now: datetime.datetime = None) -> Optional[list]:
+    """
+    The periods of the stored standard forecast of a search that start after the derived periods end
+    Args:
+        search(str): The searched location, with trailing slash
+        language(str): The language of the weather forecast
+        after(datetime): End of the derived periods, in the local time of the location
+        now(datetime): The current time, defaults to now
+
+    Returns(list): The periods in the language, newest first, or None if there is no recent standard forecast
+                   or it can not be translated
+    """
+    try:
+        forecast = Forecast.objects \
+            .with_related() \
+            .for_place(search, FORECAST_TYPE_STANDARD) \
+            .fresh(now, max_stale=datetime.timedelta(hours=settings.FORECAST_DERIVE_STANDARD_TAIL_HOURS)) \
+            .latest('created')
+    except Forecast.DoesNotExist:
+        return None
+
+    tail = [period for period in read_periods(forecast) if period['start'] >= after]
+    rendered = render_forecast(forecast, tail, language)
+    return rendered[1] if rendered is not None else None
+
+
+def standard_from_hourly(search, language, now: datetime.datetime = None) -> Optional[Tuple[Forecast, dict, list]]:
+    """
+    Derives a standard forecast from the stored hourly forecast of a search
+    Args:
+        search(str): The searched location, with trailing slash
+        language(str): The language of the weather forecast
+        now(datetime): The current time, defaults to now
+
+    Returns(tuple): The hourly forecast, the standard forecast as Forecast.to_dict() and its periods,
+                    or None if there is no fresh hourly forecast covering FORECAST_DERIVE_STANDARD_HOURS,
+                    or no recent standard forecast for the days after it
+    """
+    if not settings.FORECAST_DERIVE_STANDARD:
+        return None
+    try:
+        forecast = Forecast.objects \
+            .with_related() \
+            .for_place(search, FORECAST_TYPE_HOURLY) \
+            .fresh(now) \
+            .latest('created')
+    except Forecast.DoesNotExist:
+        return None
+
+    periods = derive_standard_periods(read_periods(forecast))
+    if not periods or derived_expires_at(forecast, periods[0]['end']) <= (now or timezone.now()):
+        return None
+
+    derived_until = periods[0]['end']
+    tail = standard_tail(search, language, derived_until, now)
+    if tail is None:
+        return None
+
+    rendered = render_forecast(forecast, periods, language)
+    if rendered is None:
+        return None
+    meta, periods = rendered
+    meta['forecast_type'] = FORECAST_TYPE_STANDARD
+    meta['derived_until'] = derived_until
+    return forecast, meta, tail + periods
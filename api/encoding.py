@@ -0,0 +1,116 @@
+import gzip
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_django_encoder = DjangoJSONEncoder()
+
+
+def json_encoder() -> str:
+    """
+    The serializer dumps uses, 'orjson' when it is installed, unless RESPONSE_JSON_ENCODER is 'django'
+    """
+    if orjson is not None and settings.RESPONSE_JSON_ENCODER != 'django':
+        return 'orjson'
+    return 'django'
+
+
+def dumps(data) -> bytes:
+    """
+    Serializes a response to JSON with the serializer of json_encoder.
+    Both encode datetimes, decimals and lazy translations like DjangoJSONEncoder, but the bytes differ:
+    orjson leaves out the whitespace and writes non-ASCII characters as UTF-8 where json.dumps escapes them as \\uXXXX,
+    so nb and nn responses are not byte for byte the same across deployments. forecast_etag includes the serializer.
+    Args:
+        data: The response
+
+    Returns(bytes): The UTF-8 encoded JSON
+    """
+    if json_encoder() == 'orjson':
+        return orjson.dumps(data, default=_django_encoder.default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8')
+
+
+def json_response(body: bytes) -> HttpResponse:
+    """
+    Wraps an already serialized JSON body in a response
+    """
+    return HttpResponse(body, content_type='application/json')
+
+
+def available_encodings() -> list:
+    """
+    The content codings of RESPONSE_ENCODINGS that can be produced, in order of preference
+    """
+    return [encoding for encoding in settings.RESPONSE_ENCODINGS
+            if encoding == 'gzip' or (encoding == 'br' and brotli is not None)]
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """
+    Compresses a body with a content coding. Bodies are compressed once and served many times,
+    so both use a high level
+    Args:
+        body(bytes): The serialized response
+        encoding(str): 'gzip' or 'br'
+
+    Returns(bytes): The compressed body
+    """
+    if encoding == 'br':
+        return brotli.compress(body, quality=9)
+    return gzip.compress(body, compresslevel=9)
+
+
+def compress_all(body: bytes, encodings=None) -> dict:
+    """
+    Args:
+        body(bytes): The serialized response
+        encodings(list): The content codings to compress with, every available one by default
+
+    Returns(dict): The body compressed with each content coding
+    """
+    if encodings is None:
+        encodings = available_encodings()
+    return {encoding: compress(body, encoding) for encoding in encodings}
+
+
+def negotiate_encoding(accept_encoding: str, encodings: list):
+    """
+    Picks the content coding to send, the first of ours the client accepts
+    Args:
+        accept_encoding(str): The Accept-Encoding header of the request
+        encodings(list): The codings we can send, in order of preference
+
+    Returns(str): The content coding, or None to send the body as it is
+    """
+    accepted = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding] = quality
+
+    for encoding in encodings:
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
@@ -1,13 +1,30 @@
+import collections
 import datetime
 from time import mktime
 from typing import List, Tuple
 import math
 from py_yr.config.settings import LANGUAGE, FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone as django_timezone
 from django.utils.translation import ugettext as _
 from py_yr.yr import Yr
 
+from api.cache import response_cache, negative_cache, cache_key
+from api.labels import label_store, labels_of
+from api.metrics import SAVE, timed
 from api.models import Credit, Time, WindSpeed, WindDirection, Temperature, Symbol, Pressure, Precipitation, Forecast, \
     Location, TimeZone, Sun
+from api.storage import STORAGE_COMPACT, pack_periods
+
+# Models hanging off each Time row, in the order build_period_children returns them,
+# and the Time fields pointing to them
+PERIOD_CHILD_MODELS = (Precipitation, Pressure, Symbol, Temperature, WindDirection, WindSpeed)
+PERIOD_CHILD_FIELDS = ('precipitation', 'pressure', 'symbol', 'temperature', 'wind_direction', 'wind_speed')
+
+# Maximum number of ids in one IN (...) clause, sqlite allows 999 variables per statement
+MAX_IDS_PER_STATEMENT = 500
 
 DAYS = {
     'en': [
@@ -97,9 +114,12 @@ def validate_search_request(language, location, forecast_type) -> tuple:
         language_message)
 
 
+@timed(SAVE)
 def save_weather_data(yr_object: Yr) -> Tuple[Forecast, List[Time]]:
     """
-        Saves a Yr data object and returns the data
+        Saves a Yr data object and returns the data.
+        Everything is written in one transaction. The periods are either packed into the forecast row,
+        or written with one bulk insert per table, depending on FORECAST_STORAGE.
 
         Args:
             yr_object (Yr): An yr object containing weather data
@@ -107,116 +127,245 @@ def save_weather_data(yr_object: Yr) -> Tuple[Forecast, List[Time]]:
 
     data = yr_object.get_as_object()
 
-    # Location
-    timezone = TimeZone(
-        utcoffsetMinutes=data.location.timezone.utcoffsetMinutes,
-        zone=data.location.timezone.id
+    with transaction.atomic():
+        # Location
+        timezone = TimeZone(
+            utcoffsetMinutes=data.location.timezone.utcoffsetMinutes,
+            zone=data.location.timezone.id
+        )
+        timezone.save()
+
+        location = Location(
+            timezone=timezone,
+            name=data.location.name,
+            country=data.location.country,
+            type=data.location.type
+        )
+        location.save()
+
+        # Sun
+        sun = Sun(
+            rise=data.sun.rise,
+            set=data.sun.set
+        )
+        sun.save()
+
+        # Credit
+        credit = Credit(
+            url=data.credit.url,
+            text=data.credit.text
+        )
+        credit.save()
+
+        # Forecast
+        forecast = Forecast(
+            sun=sun,
+            credit=credit,
+            location=location,
+            search=yr_object.location,
+            forecast_type=yr_object.forecast_type,
+            language=yr_object.language,
+            expires_at=forecast_expires_at()
+        )
+
+        # Periods
+        periods = data.forecast.tabular.time
+        children = [build_period_children(t) for t in periods]
+        if settings.FORECAST_STORAGE == STORAGE_COMPACT:
+            times = [build_time(t, forecast, row) for t, row in zip(periods, children)]
+            forecast.periods = pack_periods(times)
+            forecast.save()
+        else:
+            forecast.save()
+            for index, model in enumerate(PERIOD_CHILD_MODELS):
+                bulk_create_with_ids(model, [row[index] for row in children])
+            times = [build_time(t, forecast, row) for t, row in zip(periods, children)]
+            Time.objects.bulk_create(times)
+
+    label_store.learn(forecast.language, labels_of(forecast.to_dict(), [t.to_dict() for t in times]))
+
+    # The cached responses of the search are older than the forecast just saved, in every language.
+    # So are standard responses derived from the hourly forecast
+    forecast_types = [yr_object.forecast_type]
+    if yr_object.forecast_type == FORECAST_TYPE_HOURLY and settings.FORECAST_DERIVE_STANDARD:
+        forecast_types.append(FORECAST_TYPE_STANDARD)
+    for language, _name in settings.LANGUAGES:
+        for forecast_type in forecast_types:
+            for summaries in (False, True):
+                response_cache.invalidate(cache_key(yr_object.location, language, forecast_type, summaries))
+    negative_cache.invalidate(cache_key(yr_object.location, yr_object.language, yr_object.forecast_type))
+    return forecast, times
+
+
+def forecast_expires_at(created: datetime.datetime = None) -> datetime.datetime:
+    """
+        Determines when a forecast stops being fresh
+
+        Args:
+            created (datetime): When the forecast was downloaded, defaults to now
+
+        Returns(datetime): The expiry time
+    """
+    if created is None:
+        created = django_timezone.now()
+    return created + datetime.timedelta(minutes=settings.FORECAST_CACHE_MINUTES)
+
+
+def build_time(t, forecast: Forecast, children: tuple) -> Time:
+    """
+        Builds the unsaved Time row of a single tabular period
+
+        Args:
+            t: A period from the tabular forecast of an yr object
+            forecast(Forecast): The forecast the period belongs to
+            children(tuple): The child rows of the period, from build_period_children
+
+        Returns(Time): The period
+    """
+    rain, pressure, symbol, temp, direction, speed = children
+    return Time(
+        start=t.from_,
+        end=t.to,
+        period=t.period,
+        forecast=forecast,
+        precipitation=rain,
+        symbol=symbol,
+        wind_direction=direction,
+        wind_speed=speed,
+        temperature=temp,
+        pressure=pressure
     )
-    timezone.save()
 
-    location = Location(
-        timezone=timezone,
-        name=data.location.name,
-        country=data.location.country,
-        type=data.location.type
+
+def build_period_children(t) -> tuple:
+    """
+        Builds the unsaved child rows of a single tabular period
+
+        Args:
+            t: A period from the tabular forecast of an yr object
+
+        Returns(tuple): One instance per model in PERIOD_CHILD_MODELS, in the same order
+    """
+    rain = Precipitation(
+        value=t.precipitation.value,
     )
-    location.save()
+    try:
+        rain.min_value = t.precipitation.min_value
+    except AttributeError:
+        pass
+    try:
+        rain.max_value = t.precipitation.max_value
+    except AttributeError:
+        pass
 
-    # Sun
-    sun = Sun(
-        rise=data.sun.rise,
-        set=data.sun.set
+    pressure = Pressure(
+        unit=t.pressure.unit,
+        value=t.pressure.value
     )
-    sun.save()
 
-    # Credit
-    credit = Credit(
-        url=data.credit.url,
-        text=data.credit.text
+    try:
+        var = t.symbol.var.split('/')[1]
+        var = var.split('.')[0]
+    except IndexError:
+        var = t.symbol.var
+
+    symbol = Symbol(
+        name=t.symbol.name,
+        var=var,
+        number=t.symbol.number
     )
-    credit.save()
-
-    # Forecast
-    forecast = Forecast(
-        sun=sun,
-        credit=credit,
-        location=location,
-        search=yr_object.location,
-        forecast_type=yr_object.forecast_type,
-        language=yr_object.language
+
+    temp = Temperature(
+        unit=t.temperature.unit,
+        value=t.temperature.value
     )
-    forecast.save()
 
-    # Periods
-    times = []
-    for t in data.forecast.tabular.time:
-        rain = Precipitation(
-            value=t.precipitation.value,
-        )
-        try:
-            rain.minValue = t.precipitation.min_value
-        except AttributeError:
-            pass
-        try:
-            rain.maxValue = t.precipitation.max_value
-        except AttributeError:
-            pass
-        rain.save()
-
-        pressure = Pressure(
-            unit=t.pressure.unit,
-            value=t.pressure.value
-        )
-        pressure.save()
+    direction = WindDirection(
+        degree=t.windDirection.deg,
+        code=t.windDirection.code,
+        name=t.windDirection.name
+    )
 
-        try:
-            temp = t.symbol.var.split('/')[1]
-            temp = temp.split('.')[0]
-        except IndexError:
-            temp = t.symbol.var
+    speed = WindSpeed(
+        mps=t.windSpeed.mps,
+        name=t.windSpeed.name
+    )
+    return rain, pressure, symbol, temp, direction, speed
 
-        symbol = Symbol(
-            name=t.symbol.name,
-            var=temp,
-            number=t.symbol.number
 
-        )
-        symbol.save()
+def bulk_create_with_ids(model, objects: list) -> list:
+    """
+        Inserts objects so that every object gets its primary key, and can be used as a foreign key afterwards.
+        Backends that return ids from a bulk insert (postgresql) get one bulk insert.
+        On sqlite the ids of a bulk insert are read back. That is only safe inside a transaction
+        that already has written to the database, sqlite then holds a database wide write lock
+        so no other rows can be inserted in between.
+        Other backends (mysql) can interleave concurrent inserts, so the objects are saved one by one.
 
-        temp = Temperature(
-            unit=t.temperature.unit,
-            value=t.temperature.value
-        )
-        temp.save()
+        Args:
+            model: The model class of the objects
+            objects(list): Unsaved instances of model
 
-        direction = WindDirection(
-            degree=t.windDirection.deg,
-            code=t.windDirection.code,
-            name=t.windDirection.name
-        )
-        direction.save()
+        Returns(list): The same instances, with primary keys set
+    """
+    if not objects:
+        return objects
 
-        speed = WindSpeed(
-            mps=t.windSpeed.mps,
-            name=t.windSpeed.name
-        )
-        speed.save()
-
-        time = Time(
-            start=t.from_,
-            end=t.to,
-            period=t.period,
-            forecast=forecast,
-            precipitation=rain,
-            symbol=symbol,
-            wind_direction=direction,
-            wind_speed=speed,
-            temperature=temp,
-            pressure=pressure
-        )
-        time.save()
-        times.append(time)
-    return forecast, times
+    if connection.features.can_return_ids_from_bulk_insert:
+        return model.objects.bulk_create(objects)
+
+    if connection.vendor != 'sqlite':
+        for obj in objects:
+            obj.save(force_insert=True)
+        return objects
+
+    last_id = model.objects.aggregate(last_id=Max('pk'))['last_id'] or 0
+    model.objects.bulk_create(objects)
+    ids = model.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)
+    for obj, pk in zip(objects, ids):
+        obj.pk = pk
+        obj._state.adding = False
+        obj._state.db = connection.alias
+    return objects
+
+
+def delete_ids(model, ids: list) -> int:
+    """
+        Deletes rows by primary key without loading them, a few hundred ids per statement
+
+        Args:
+            model: The model of the rows
+            ids(list): Primary keys
+
+        Returns(int): Number of rows deleted
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    deleted = 0
+    with connection.cursor() as cursor:
+        for start in range(0, len(ids), MAX_IDS_PER_STATEMENT):
+            chunk = ids[start:start + MAX_IDS_PER_STATEMENT]
+            cursor.execute('DELETE FROM {0} WHERE id IN ({1})'.format(table, ', '.join(['%s'] * len(chunk))), chunk)
+            deleted += cursor.rowcount
+    return deleted
+
+
+def delete_periods(forecast_ids: list) -> collections.Counter:
+    """
+        Deletes the relational period rows of forecasts, Time rows and the rows they point to
+
+        Args:
+            forecast_ids(list): Ids of the forecasts
+
+        Returns(Counter): Rows deleted per table
+    """
+    periods = list(Time.objects.filter(forecast_id__in=forecast_ids).values_list(
+        'id', *('{0}_id'.format(name) for name in PERIOD_CHILD_FIELDS)))
+
+    deleted = collections.Counter()
+    deleted[Time._meta.db_table] += delete_ids(Time, [row[0] for row in periods])
+    for index, model in enumerate(PERIOD_CHILD_MODELS, start=1):
+        deleted[model._meta.db_table] += delete_ids(model, [row[index] for row in periods])
+    return deleted
 
 
 def time_is_less_then_x_minutes_ago(created: datetime, minutes: datetime) -> bool:
@@ -249,57 +398,73 @@ def time_is_less_then_x_minutes_ago(created: datetime, minutes: datetime) -> boo
         return False
 
 
-def cleanup_response(forecasts, language, forecast_type) -> list:
+def group_by_day(periods, language, forecast_type, summaries=False) -> list:
     """
-        Cleans up the forecasts response.
-        Some forecasts goes seven days, from monday to monday, so we get double values on that day.
-        The actual day, then 7 days ahead.
-        Also assorts each forecast to a weekday
+        Groups the periods of a forecast by day, oldest first, in one pass.
+        Standard forecasts reach a week ahead, so the last day can be the same weekday as the first.
+        Days are named by weekday, so only the first of them is kept.
         Args:
-            forecasts(list): The list containing all of the forecasts.
+            periods(list): The periods, shaped like Time.to_dict(), in order either way
             language(str): The language of the weather forecast.
             forecast_type(str): The forecast type (hourly/standard)
+            summaries(bool): Add a summary of each day
 
-        Returns(list): List of the weather forecast
-
-        """
-
-    # Generates weekdays based on forecast list
-    weekdays = {}
-    for forecast in forecasts:
-        weekday = DAYS[language][forecast.get('start', '').weekday()]
-        try:
-            test_if_key_exists = weekdays[weekday]
-        except KeyError:
-            weekdays[weekday] = {
-                'weekday': weekday,
-                'forecast': []
-            }
-
-    # Add forecast to respective day
-    for forecast in forecasts:
-        weekday = DAYS[language][forecast.get('start', '').weekday()]
-        try:
-            weekdays[weekday]['forecast'].append(forecast)
-        except KeyError:
-            pass
-
-    # Cleans up if some day has more then 4 periods.
-    # Typically a if call week on a thursday the 4.
-    # Then the thursday will have 6 - 8 fields.
-    # With today's date (the 4.) and next week fields 4+7=11.
-    # We remove those next week with this method
-    if forecast_type is FORECAST_TYPE_STANDARD:
-        for i, key in enumerate(weekdays):
-            list_of_forecasts = weekdays[key]['forecast']
-            if len(list_of_forecasts) > 4:
-                # find the smallest date
-                lowest_date = datetime.datetime(2100, 12, 12).date()
-                for elm in list_of_forecasts:
-                    if elm.get('start', lowest_date).date() < lowest_date:
-                        lowest_date = elm.get('start', lowest_date).date()
-
-                # copy new with all those dates
-                weekdays[key]['forecast'] = [elm for elm in list_of_forecasts if elm.get('start', lowest_date).date() == lowest_date]
-
-    return [weekdays[key] for key in weekdays]
\ No newline at end of file
+        Returns(list): One dict per day, with its weekday, its periods and optionally its summary
+    """
+    names = DAYS[language]
+    if len(periods) > 1 and periods[0]['start'] > periods[-1]['start']:
+        periods = reversed(periods)
+
+    days = []
+    seen = set()
+    date = None
+    day = None
+    for period in periods:
+        if period['start'].date() != date:
+            date = period['start'].date()
+            weekday = date.weekday()
+            if forecast_type == FORECAST_TYPE_STANDARD and weekday in seen:
+                day = None
+            else:
+                seen.add(weekday)
+                day = {
+                    'weekday': names[weekday],
+                    'forecast': []
+                }
+                days.append(day)
+        if day is not None:
+            day['forecast'].append(period)
+
+    if summaries:
+        for day in days:
+            day['summary'] = summarize_day(day['forecast'])
+    return days
+
+
+def summarize_day(periods) -> dict:
+    """
+        Summarizes the periods of a day
+        Args:
+            periods(list): The periods of the day, shaped like Time.to_dict()
+
+        Returns(dict): The lowest and highest temperature, the total precipitation and the most common symbol
+    """
+    temperatures = [period['temperature']['value'] for period in periods]
+    return {
+        'temperature': {
+            'unit': periods[0]['temperature']['unit'],
+            'min': min(temperatures),
+            'max': max(temperatures)
+        },
+        'precipitation': sum(period['precipitation']['value'] for period in periods),
+        'symbol': dominant_symbol(periods)
+    }
+
+
+def dominant_symbol(periods) -> dict:
+    """
+        The most common symbol of some periods, ties go to the highest number, which is the worse weather
+    """
+    counts = collections.Counter(period['symbol']['number'] for period in periods)
+    number = max(counts, key=lambda n: (counts[n], n))
+    return next(period['symbol'] for period in periods if period['symbol']['number'] == number)
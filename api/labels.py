@@ -0,0 +1,205 @@
+"""
+Labels of forecasts in every language.
+
+Forecasts are stored once per location and forecast type, in the language they were downloaded in.
+Everything else yr.no translates is a label: symbol names by symbol number, wind direction names by code,
+wind speed names by Beaufort force, and the names of the location and its credit by search.
+Every download teaches the labels of its language, and stored forecasts are translated to the requested language
+when they are rendered. Forecasts with a label that has never been seen in the requested language are downloaded again.
+"""
+import bisect
+import decimal
+import threading
+from typing import Optional, Tuple
+
+from django.db import IntegrityError, transaction
+
+from api.models import Label
+
+SYMBOL = 'symbol'
+WIND_DIRECTION = 'wind_direction'
+WIND_SPEED = 'wind_speed'
+LOCATION_NAME = 'location_name'
+LOCATION_TYPE = 'location_type'
+COUNTRY = 'country'
+CREDIT_URL = 'credit_url'
+CREDIT_TEXT = 'credit_text'
+
+# The lowest wind speed in m/s of Beaufort force 1 to 12, yr.no names wind speeds by their force
+BEAUFORT_SCALE = [decimal.Decimal(mps) for mps in
+                  ('0.3', '1.6', '3.4', '5.5', '8.0', '10.8', '13.9', '17.2', '20.8', '24.5', '28.5', '32.7')]
+
+
+def speed_key(mps) -> str:
+    """
+    The Beaufort force of a wind speed. Every speed of a force has the same name,
+    so a forecast with speeds that have not been seen before can still be translated
+    """
+    return str(bisect.bisect_right(BEAUFORT_SCALE, decimal.Decimal(str(mps))))
+
+
+def labels_of(meta: dict, periods: list) -> dict:
+    """
+    Finds the labels of a forecast
+    Args:
+        meta(dict): The forecast, as Forecast.to_dict()
+        periods(list): Its periods, as Time.to_dict()
+
+    Returns(dict): The text of each label in the language of the forecast, by (kind, key)
+    """
+    search = meta['search']
+    found = {
+        (LOCATION_NAME, search): meta['location']['name'],
+        (LOCATION_TYPE, search): meta['location']['type'],
+        (COUNTRY, search): meta['location']['country'],
+        (CREDIT_URL, search): meta['credit']['url'],
+        (CREDIT_TEXT, search): meta['credit']['text'],
+    }
+    for period in periods:
+        found[(SYMBOL, str(period['symbol']['number']))] = period['symbol']['name']
+        found[(WIND_DIRECTION, period['wind_direction']['code'] or '')] = period['wind_direction']['name']
+        found[(WIND_SPEED, speed_key(period['wind_speed']['mps']))] = period['wind_speed']['name']
+    return found
+
+
+class LabelStore:
+    """
+    The Label table, with every label this process has read or learned kept in memory
+    """
+
+    def __init__(self):
+        self._labels = {}
+        self._lock = threading.Lock()
+
+    def learn(self, language: str, found: dict) -> None:
+        """
+        Stores the labels of a downloaded forecast. Labels that are already known are not written again
+        Args:
+            language(str): The language of the forecast
+            found(dict): Its labels, from labels_of()
+        """
+        with self._lock:
+            known = self._labels.setdefault(language, {})
+            new = {label: text for label, text in found.items() if known.get(label) != text}
+        if not new:
+            return
+
+        # Another process may store some of the same labels at the same time, which rolls back the whole block.
+        # The labels are then read again, and only the ones still missing are written
+        for _attempt in range(3):
+            stored = {
+                (label.kind, label.key): label
+                for label in Label.objects.filter(language=language, key__in={key for _, key in new})
+            }
+            try:
+                with transaction.atomic():
+                    Label.objects.bulk_create([
+                        Label(kind=kind, key=key, language=language, text=text)
+                        for (kind, key), text in new.items() if (kind, key) not in stored
+                    ])
+                    for label, text in new.items():
+                        if label in stored and stored[label].text != text:
+                            Label.objects.filter(pk=stored[label].pk).update(text=text)
+                break
+            except IntegrityError:
+                continue
+        else:
+            # Not remembered, so the next download of the language writes them again
+            return
+
+        with self._lock:
+            self._labels[language].update(new)
+
+    def get_many(self, language: str, labels) -> dict:
+        """
+        Looks labels up in memory, and the ones that are not there in the database
+        Args:
+            language(str): The language
+            labels: (kind, key) of every label
+
+        Returns(dict): The text of the labels that are known, by (kind, key)
+        """
+        with self._lock:
+            known = self._labels.setdefault(language, {})
+            result = {label: known[label] for label in labels if label in known}
+        missing = [label for label in labels if label not in result]
+        if not missing:
+            return result
+
+        wanted = set(missing)
+        stored = {}
+        for label in Label.objects.filter(language=language, key__in={key for _, key in missing}):
+            if (label.kind, label.key) in wanted:
+                stored[(label.kind, label.key)] = label.text
+        with self._lock:
+            self._labels[language].update(stored)
+        result.update(stored)
+        return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._labels.clear()
+
+
+# Labels of every language, shared by all threads of the process
+label_store = LabelStore()
+
+
+def translate(meta: dict, periods: list, language: str) -> Optional[Tuple[dict, list]]:
+    """
+    Translates a forecast to another language
+    Args:
+        meta(dict): The forecast, as Forecast.to_dict()
+        periods(list): Its periods, as Time.to_dict()
+        language(str): The language to translate to
+
+    Returns(tuple): The translated forecast and periods, or None if a label is not known in the language
+    """
+    found = labels_of(meta, periods)
+    labels = label_store.get_many(language, list(found))
+    if len(labels) < len(found):
+        return None
+
+    search = meta['search']
+    meta = dict(
+        meta,
+        location=dict(
+            meta['location'],
+            name=labels[(LOCATION_NAME, search)],
+            type=labels[(LOCATION_TYPE, search)],
+            country=labels[(COUNTRY, search)]
+        ),
+        credit=dict(
+            meta['credit'],
+            url=labels[(CREDIT_URL, search)],
+            text=labels[(CREDIT_TEXT, search)]
+        ),
+        language=language
+    )
+    periods = [
+        dict(
+            period,
+            symbol=dict(period['symbol'], name=labels[(SYMBOL, str(period['symbol']['number']))]),
+            wind_direction=dict(period['wind_direction'],
+                                name=labels[(WIND_DIRECTION, period['wind_direction']['code'] or '')]),
+            wind_speed=dict(period['wind_speed'], name=labels[(WIND_SPEED, speed_key(period['wind_speed']['mps']))])
+        )
+        for period in periods
+    ]
+    return meta, periods
+
+
+def render_forecast(forecast, periods: list, language: str) -> Optional[Tuple[dict, list]]:
+    """
+    A stored forecast and its periods in the requested language
+    Args:
+        forecast(Forecast): The forecast
+        periods(list): Its periods, as Time.to_dict()
+        language(str): The requested language
+
+    Returns(tuple): The forecast as Forecast.to_dict() and its periods, or None if it can not be translated
+    """
+    meta = forecast.to_dict()
+    if forecast.language == language:
+        return meta, periods
+    return translate(meta, periods, language)
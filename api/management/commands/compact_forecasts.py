@@ -0,0 +1,44 @@
+import collections
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.helper import delete_periods
+from api.models import Forecast, Time
+from api.storage import pack_periods
+
+
+class Command(BaseCommand):
+    help = 'Moves the periods of forecasts stored as Time rows into the compact layout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20, help='Number of forecasts converted per transaction')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        forecast_ids = list(Forecast.objects.filter(periods__isnull=True).values_list('id', flat=True))
+        deleted = collections.Counter()
+        for start in range(0, len(forecast_ids), options['batch_size']):
+            deleted.update(compact_forecasts(forecast_ids[start:start + options['batch_size']]))
+
+        self.stdout.write('Compacted {0} forecasts, deleted {1} rows'.format(
+            len(forecast_ids), sum(deleted.values())))
+
+
+def compact_forecasts(forecast_ids: list) -> collections.Counter:
+    """
+    Packs the periods of forecasts into Forecast.periods and deletes their relational rows, in one transaction
+    Args:
+        forecast_ids(list): Ids of forecasts stored in the relational layout
+
+    Returns(Counter): Rows deleted per table
+    """
+    times = collections.defaultdict(list)
+    with transaction.atomic():
+        for time in Time.objects.with_related().filter(forecast_id__in=forecast_ids):
+            times[time.forecast_id].append(time)
+        for forecast_id in forecast_ids:
+            Forecast.objects.filter(pk=forecast_id).update(periods=pack_periods(times[forecast_id]))
+        return delete_periods(forecast_ids)
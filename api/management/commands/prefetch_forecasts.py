@@ -0,0 +1,145 @@
+import collections
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, close_old_connections
+from django.db.models import Max
+from django.utils import timezone
+
+from api.helper import MAX_IDS_PER_STATEMENT
+from api.models import Forecast, SearchCount
+from api.popularity import current_hour, most_requested
+from api.upstream import refresh_forecast
+
+
+class UpstreamBudget:
+    """
+    Allows at most per_minute downloads in any sliding minute
+    """
+
+    def __init__(self, per_minute: int, clock=time.monotonic):
+        self.per_minute = per_minute
+        self.clock = clock
+        self._spent = collections.deque()
+
+    def take(self, wanted: int) -> int:
+        """
+        Spends up to wanted downloads
+        Returns(int): Number of downloads allowed right now
+        """
+        now = self.clock()
+        while self._spent and self._spent[0] <= now - 60:
+            self._spent.popleft()
+        allowed = max(0, min(wanted, self.per_minute - len(self._spent)))
+        self._spent.extend([now] * allowed)
+        return allowed
+
+
+class Command(BaseCommand):
+    help = 'Refreshes the most popular forecasts just before they expire'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=settings.PREFETCH_TOP,
+                            help='Number of popular searches to keep fresh')
+        parser.add_argument('--history', type=int, default=settings.PREFETCH_HISTORY_HOURS,
+                            help='Hours of searches to rank popularity by')
+        parser.add_argument('--lead', type=int, default=settings.PREFETCH_LEAD_SECONDS,
+                            help='Refresh forecasts expiring within this many seconds')
+        parser.add_argument('--workers', type=int, default=settings.PREFETCH_WORKERS,
+                            help='Number of concurrent downloads')
+        parser.add_argument('--budget', type=int, default=settings.PREFETCH_BUDGET_PER_MINUTE,
+                            help='Maximum number of downloads per minute')
+        parser.add_argument('--interval', type=int, default=settings.PREFETCH_INTERVAL_SECONDS,
+                            help='Seconds between cycles')
+        parser.add_argument('--once', action='store_true', help='Run a single cycle and exit')
+
+    def handle(self, *args, **options):
+        budget = UpstreamBudget(options['budget'])
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                started = time.monotonic()
+                try:
+                    report = self.cycle(pool, budget, options)
+                except Exception as e:
+                    # E.g. the database went away, the next cycle tries again
+                    self.stderr.write('{0:%Y-%m-%d %H:%M:%S} cycle failed: {1!r}'.format(datetime.datetime.now(), e))
+                else:
+                    self.stdout.write('{0:%Y-%m-%d %H:%M:%S} refreshed {refreshed}, skipped {skipped}, '
+                                      'failed {failed}'.format(datetime.datetime.now(), **report))
+                if options['once']:
+                    return
+                time.sleep(max(0.0, options['interval'] - (time.monotonic() - started)))
+
+    def cycle(self, pool, budget, options) -> dict:
+        """
+        Refreshes the popular searches that are about to expire
+        Returns(dict): Number of searches refreshed, skipped and failed
+        """
+        close_old_connections()
+        now = timezone.now()
+        since = now - datetime.timedelta(hours=options['history'])
+        # Counts older than the ranking window are never read again
+        SearchCount.objects.filter(hour__lt=current_hour(since)).delete()
+        popular = popular_searches(since, options['top'])
+        due = [search for search in popular
+               if search['expires_at'] is None
+               or search['expires_at'] <= now + datetime.timedelta(seconds=options['lead'])]
+        due = due[:budget.take(len(due))]
+
+        results = list(pool.map(self.refresh, due))
+        return dict(
+            refreshed=results.count(True),
+            skipped=len(popular) - len(due),
+            failed=results.count(False)
+        )
+
+    def refresh(self, search: dict) -> bool:
+        try:
+            return refresh_forecast(search['search'], search['language'], search['forecast_type'],
+                                    force=True) is not None
+        except Exception as e:
+            self.stderr.write('Refreshing {search} ({language}, {forecast_type}) failed: {error}'.format(
+                error=e, **search))
+            return False
+        finally:
+            connection.close()
+
+
+def popular_searches(since: datetime.datetime, top: int) -> list:
+    """
+    Ranks places by how many times they were searched since a point in time, in any language.
+    Counting searches rather than stored forecasts keeps the ranking from following the prefetcher's own downloads.
+    Places that have never been stored are left out, they are downloaded when they are searched
+    Args:
+        since(datetime): Start of the ranking window
+        top(int): Number of places to return
+
+    Returns(list): Dicts with search, forecast_type, requests, and the language and expires_at of the latest stored
+                   forecast, most popular first
+    """
+    ranked = most_requested(since, top)
+    searches = sorted({row['search'] for row in ranked})
+    forecast_types = sorted({row['forecast_type'] for row in ranked})
+
+    # The id of the latest forecast of every place, then only those rows
+    ids = []
+    for start in range(0, len(searches), MAX_IDS_PER_STATEMENT):
+        ids.extend(Forecast.objects
+                   .filter(search__in=searches[start:start + MAX_IDS_PER_STATEMENT], forecast_type__in=forecast_types)
+                   .order_by()
+                   .values('search', 'forecast_type')
+                   .annotate(latest_id=Max('id'))
+                   .values_list('latest_id', flat=True))
+    latest = {}
+    for start in range(0, len(ids), MAX_IDS_PER_STATEMENT):
+        stored = Forecast.objects \
+            .filter(id__in=ids[start:start + MAX_IDS_PER_STATEMENT]) \
+            .values_list('search', 'forecast_type', 'language', 'expires_at')
+        for search, forecast_type, language, expires_at in stored:
+            latest[(search, forecast_type)] = dict(language=language, expires_at=expires_at)
+
+    return [dict(row, **latest[(row['search'], row['forecast_type'])])
+            for row in ranked if (row['search'], row['forecast_type']) in latest]
@@ -0,0 +1,141 @@
+import collections
+import datetime
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.helper import PERIOD_CHILD_MODELS, MAX_IDS_PER_STATEMENT, delete_ids, delete_periods
+from api.models import Forecast, Time, Location, TimeZone, Sun, Credit
+
+
+class Command(BaseCommand):
+    help = 'Deletes old forecasts with their periods, keeping the latest per search and every recent one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', type=int, default=settings.PRUNE_KEEP_FORECASTS,
+                            help='Number of forecasts to keep per search, language and forecast type')
+        parser.add_argument('--keep-hours', type=int, default=settings.PRUNE_KEEP_HOURS,
+                            help='Keep every forecast newer than this many hours')
+        parser.add_argument('--batch-size', type=int, default=settings.PRUNE_BATCH_SIZE,
+                            help='Number of forecasts deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between batches, to let other writers in')
+        parser.add_argument('--orphans', action='store_true',
+                            help='Also delete rows no forecast points to, e.g. left behind by an interrupted save')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+
+    def handle(self, *args, **options):
+        if options['keep'] < 1:
+            raise CommandError('--keep must be at least 1, the latest forecast is still being served')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        cutoff = timezone.now() - datetime.timedelta(hours=options['keep_hours'])
+        expired = prunable_forecasts(options['keep'], cutoff)
+        if options['dry_run']:
+            self.stdout.write('Would delete {0} forecasts'.format(len(expired)))
+            return
+
+        free_bytes = database_free_bytes()
+        deleted = collections.Counter()
+        for start in range(0, len(expired), options['batch_size']):
+            deleted.update(delete_forecasts(expired[start:start + options['batch_size']]))
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        if options['orphans']:
+            for model in [Time] + list(PERIOD_CHILD_MODELS) + [Location, TimeZone, Sun, Credit]:
+                deleted.update(delete_orphans(model, MAX_IDS_PER_STATEMENT))
+
+        for table in sorted(deleted):
+            self.stdout.write('{0}: {1} rows'.format(table, deleted[table]))
+        self.stdout.write('Deleted {0} rows'.format(sum(deleted.values())))
+        if free_bytes is not None:
+            self.stdout.write('Reclaimed {0} bytes'.format(database_free_bytes() - free_bytes))
+
+
+def prunable_forecasts(keep: int, cutoff: datetime.datetime) -> list:
+    """
+    Finds the forecasts that are neither among the latest per search, language and forecast type, nor recent
+    Args:
+        keep(int): Number of forecasts to keep per search, language and forecast type
+        cutoff(datetime): Forecasts created after this are kept
+
+    Returns(list): Ids of the forecasts
+    """
+    searches = Forecast.objects \
+        .filter(created__lt=cutoff) \
+        .values('search', 'language', 'forecast_type') \
+        .order_by() \
+        .distinct()
+
+    ids = []
+    for search in searches:
+        older = Forecast.objects \
+            .for_search(search['search'], search['language'], search['forecast_type']) \
+            .order_by('-created') \
+            .values_list('id', 'created')[keep:]
+        ids.extend(pk for pk, created in older if created < cutoff)
+    return ids
+
+
+def delete_forecasts(forecast_ids: list) -> collections.Counter:
+    """
+    Deletes forecasts with every row belonging to them, in one transaction
+    Args:
+        forecast_ids(list): Ids of the forecasts
+
+    Returns(Counter): Rows deleted per table
+    """
+    with transaction.atomic():
+        forecasts = list(Forecast.objects.filter(id__in=forecast_ids).values_list(
+            'location_id', 'location__timezone', 'sun_id', 'credit_id'))
+
+        deleted = delete_periods(forecast_ids)
+        deleted[Forecast._meta.db_table] += delete_ids(Forecast, forecast_ids)
+        for index, model in enumerate((Location, TimeZone, Sun, Credit)):
+            deleted[model._meta.db_table] += delete_ids(model, [row[index] for row in forecasts])
+    return deleted
+
+
+def delete_orphans(model, limit: int) -> collections.Counter:
+    """
+    Deletes rows nothing points to any more, e.g. left behind by an interrupted save.
+    Time rows are orphans when their forecast is gone.
+    Args:
+        model: The model to clean up
+        limit(int): Maximum number of rows to delete per transaction
+
+    Returns(Counter): Rows deleted for the model's table
+    """
+    if model is Time:
+        orphans = Time.objects.exclude(forecast_id__in=Forecast.objects.values('id'))
+    else:
+        orphans = model.objects.all()
+        for relation in model._meta.related_objects:
+            orphans = orphans.exclude(id__in=relation.related_model.objects.values(relation.field.attname))
+
+    deleted = collections.Counter()
+    while True:
+        with transaction.atomic():
+            count = delete_ids(model, list(orphans.values_list('id', flat=True)[:limit]))
+        if not count:
+            return deleted
+        deleted[model._meta.db_table] += count
+
+
+def database_free_bytes():
+    """
+    Bytes the database has freed for reuse, or None if the backend can't tell.
+    The file itself only shrinks after a VACUUM.
+    """
+    if connection.vendor != 'sqlite':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA freelist_count')
+        free_pages = cursor.fetchone()[0]
+        cursor.execute('PRAGMA page_size')
+        return free_pages * cursor.fetchone()[0]
@@ -0,0 +1,100 @@
+import collections
+import io
+import json
+import os
+import pstats
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from api.apps import make_private_directory
+from api.profiling import stored_profiles
+
+SORT_KEYS = ('tottime', 'cumulative', 'calls')
+
+
+class Command(BaseCommand):
+    help = 'Lists the hottest functions across the profiles stored by the profiling middleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', default=settings.PROFILING_DIRECTORY,
+                            help='Where the profiles are stored')
+        parser.add_argument('--sort', choices=SORT_KEYS, default='tottime',
+                            help='Order of the functions: own time, time including callees or number of calls')
+        parser.add_argument('--limit', type=int, default=25, help='Number of functions to list')
+        parser.add_argument('--view', help='Only summarise the profiles of this view')
+        parser.add_argument('--cache', help='Only summarise searches answered this way, e.g. hit, stored or miss')
+
+    def handle(self, *args, **options):
+        # Profiles are loaded, so they must come from a directory only this user can write
+        if os.path.isdir(options['directory']):
+            try:
+                make_private_directory(options['directory'])
+            except ImproperlyConfigured as e:
+                raise CommandError(str(e))
+
+        profiles = []
+        for path in stored_profiles(options['directory']):
+            info = read_info(path)
+            if options['view'] and info.get('view') != options['view']:
+                continue
+            if options['cache'] and info.get('cache') != options['cache']:
+                continue
+            profiles.append((path, info))
+        if not profiles:
+            raise CommandError('No profiles in {0}'.format(options['directory']))
+
+        for line in summarize_requests([info for _, info in profiles]):
+            self.stdout.write(line)
+        self.stdout.write('')
+
+        # pstats prints piece by piece, and self.stdout would end every piece with a newline
+        out = io.StringIO()
+        stats = pstats.Stats(*[path + '.prof' for path, _ in profiles], stream=out)
+        stats.strip_dirs().sort_stats(options['sort']).print_stats(options['limit'])
+        self.stdout.write(out.getvalue())
+
+
+def read_info(path: str) -> dict:
+    """
+    Returns(dict): What was recorded about the request of a profile, empty if it is missing or unreadable
+    """
+    try:
+        with open(path + '.json') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def summarize_requests(infos: list) -> list:
+    """
+    Summarises the requests that were profiled
+    Args:
+        infos(list): What was recorded about each request
+
+    Returns(list): Lines with the number of requests per view and cache outcome, and where their time went
+    """
+    seconds = sorted(info.get('seconds', 0) for info in infos)
+    lines = [
+        'Profiles: {0}'.format(len(infos)),
+        'Request: mean {0:.1f} ms, p95 {1:.1f} ms, max {2:.1f} ms'.format(
+            sum(seconds) / len(seconds) * 1000,
+            seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))] * 1000,
+            seconds[-1] * 1000),
+    ]
+
+    views = collections.Counter(info.get('view') or '-' for info in infos)
+    lines.append('Views: ' + ', '.join('{0} {1}'.format(view, count) for view, count in views.most_common()))
+    outcomes = collections.Counter(info.get('cache') or '-' for info in infos)
+    lines.append('Cache: ' + ', '.join('{0} {1}'.format(outcome, count) for outcome, count in outcomes.most_common()))
+
+    phases = collections.Counter()
+    for info in infos:
+        phases.update(info.get('phases') or {})
+    if phases:
+        lines.append('Phases, mean per request: ' + ', '.join(
+            '{0} {1:.1f} ms'.format(phase, total / len(infos) * 1000) for phase, total in phases.most_common()))
+    queries = sum(info.get('queries', 0) for info in infos)
+    lines.append('Queries, mean per request: {0:.1f}'.format(queries / len(infos)))
+    return lines
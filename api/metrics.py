@@ -0,0 +1,237 @@
+"""
+Per-request timings and process wide metrics.
+
+MetricsMiddleware starts a RequestMetrics for every request. The hot paths time themselves with timed(),
+which adds to the request running on the thread, if any, and to the histogram of the phase.
+Database queries are counted and timed by the middleware, which wraps the cursors of the connection. Every request gets a Server-Timing header with its phases,
+and /api/metrics shows the histograms and counters of the process in the Prometheus text format.
+"""
+import bisect
+import contextlib
+import threading
+import time
+
+from django.conf import settings
+
+DB = 'db'
+UPSTREAM = 'upstream'
+SAVE = 'save'
+SERIALIZE = 'serialize'
+PHASES = (DB, UPSTREAM, SAVE, SERIALIZE)
+
+# How a search was answered
+CACHE_HIT = 'hit'
+CACHE_STORED = 'stored'
+CACHE_STALE = 'stale'
+CACHE_MISS = 'miss'
+
+_current = threading.local()
+
+
+class Histogram:
+    """
+    Counts observations into cumulative buckets, like a Prometheus histogram
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> tuple:
+        """
+        Returns(tuple): The cumulative count of every bucket with +Inf last, the sum and the count
+        """
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative = []
+        running = 0
+        for bucket_count in counts:
+            running += bucket_count
+            cumulative.append(running)
+        return list(zip(self.buckets + (float('inf'),), cumulative)), total, count
+
+
+class Registry:
+    """
+    The metrics of the process, by name and labels
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, labels=(), buckets=None) -> Histogram:
+        key = (name, tuple(labels))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets or settings.METRICS_BUCKETS)
+            return self.histograms[key]
+
+    def increment(self, name, labels=(), amount=1) -> None:
+        key = (name, tuple(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def items(self) -> tuple:
+        """
+        Returns(tuple): The histograms and the counters, sorted by name and labels
+        """
+        with self._lock:
+            return sorted(self.histograms.items()), sorted(self.counters.items())
+
+    def clear(self) -> None:
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+registry = Registry()
+
+
+class RequestMetrics:
+    """
+    Where the time of one request went
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.queries = 0
+        self.query_seconds = 0
+        self.cache = None
+
+    def add(self, phase, seconds) -> None:
+        self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+    def add_query(self, seconds) -> None:
+        self.queries += 1
+        self.query_seconds += seconds
+
+    def server_timing(self, total: float) -> str:
+        """
+        Returns(str): The Server-Timing header, with durations in milliseconds
+        """
+        entries = []
+        for phase in PHASES:
+            if phase in self.phases:
+                entry = '{0};dur={1:.1f}'.format(phase, self.phases[phase] * 1000)
+                if phase == DB:
+                    entry += ';desc="{0} queries"'.format(self.queries)
+                entries.append(entry)
+        if self.cache is not None:
+            entries.append('cache;desc="{0}"'.format(self.cache))
+        entries.append('total;dur={0:.1f}'.format(total * 1000))
+        return ', '.join(entries)
+
+
+def current():
+    """
+    Returns(RequestMetrics): The request running on this thread, None outside requests
+    """
+    return getattr(_current, 'request', None)
+
+
+def start_request() -> RequestMetrics:
+    _current.request = RequestMetrics()
+    return _current.request
+
+
+def finish_request() -> None:
+    _current.request = None
+
+
+def observe(phase, seconds) -> None:
+    """
+    Records the duration of a phase, in the request running on this thread and in the histogram of the phase
+    """
+    if not settings.METRICS_ENABLED:
+        return
+    request = current()
+    if request is not None:
+        request.add(phase, seconds)
+    registry.histogram('weather_api_phase_seconds', (('phase', phase),)).observe(seconds)
+
+
+@contextlib.contextmanager
+def timed(phase):
+    """
+    Times the block as a phase, see observe()
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(phase, time.perf_counter() - started)
+
+
+def record_cache(outcome) -> None:
+    """
+    Records how a search was answered, see the CACHE_ constants
+    """
+    if not settings.METRICS_ENABLED:
+        return
+    request = current()
+    if request is not None:
+        request.cache = outcome
+    registry.increment('weather_api_search_cache_total', (('outcome', outcome),))
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, str(value).replace('"', '\\"')) for name, value in labels) + '}'
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(counters: dict = None, gauges: dict = None) -> str:
+    """
+    Formats the metrics in the Prometheus text format
+    Args:
+        counters(dict): Counters kept elsewhere to show as well, by (name, labels)
+        gauges(dict): Current values to show as well, by (name, labels)
+
+    Returns(str): The metrics
+    """
+    lines = []
+    histograms, registered = registry.items()
+    counters = registered + sorted((counters or {}).items())
+
+    typed = set()
+    for (name, labels), histogram in histograms:
+        if name not in typed:
+            lines.append('# TYPE {0} histogram'.format(name))
+            typed.add(name)
+        buckets, total, count = histogram.snapshot()
+        for bound, cumulative in buckets:
+            bucket_labels = labels + (('le', _format_value(bound)),)
+            lines.append('{0}_bucket{1} {2}'.format(name, _format_labels(bucket_labels), cumulative))
+        lines.append('{0}_sum{1} {2}'.format(name, _format_labels(labels), _format_value(float(total))))
+        lines.append('{0}_count{1} {2}'.format(name, _format_labels(labels), count))
+
+    for (name, labels), value in counters:
+        if name not in typed:
+            lines.append('# TYPE {0} counter'.format(name))
+            typed.add(name)
+        lines.append('{0}{1} {2}'.format(name, _format_labels(labels), _format_value(value)))
+
+    for (name, labels), value in sorted((gauges or {}).items()):
+        if name not in typed:
+            lines.append('# TYPE {0} gauge'.format(name))
+            typed.add(name)
+        lines.append('{0}{1} {2}'.format(name, _format_labels(labels), _format_value(value)))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,135 @@
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from api.metrics import DB, current, observe, registry, start_request, finish_request
+from api.profiling import should_profile, profile_call, save_profile
+
+logger = logging.getLogger(__name__)
+
+# Queries per request
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+
+class TimedCursor:
+    """
+    Wraps a cursor of the connection to count and time its queries into a request. Unlike the debug cursor
+    it does not format or log the SQL, so it can stay on outside DEBUG
+    """
+
+    def __init__(self, cursor, metrics):
+        self.cursor = cursor
+        self.metrics = metrics
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.cursor.__exit__(exc_type, exc_value, traceback)
+
+    def execute(self, sql, params=None):
+        started = time.perf_counter()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.metrics.add_query(time.perf_counter() - started)
+
+    def executemany(self, sql, param_list):
+        started = time.perf_counter()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.metrics.add_query(time.perf_counter() - started)
+
+
+class MetricsMiddleware:
+    """
+    Times every request, counts its database queries, adds a Server-Timing header
+    and records the request in the metrics of the process
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        metrics = start_request()
+        # Cursors of the connection of this thread are wrapped while the request runs.
+        # CaptureQueriesContext and DEBUG still get their debug cursor inside the wrapper
+        shadowed = connection.__dict__.get('cursor')
+        cursor = connection.cursor
+        connection.cursor = lambda: TimedCursor(cursor(), metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            if shadowed is None:
+                del connection.cursor
+            else:
+                connection.cursor = shadowed
+            if metrics.queries:
+                observe(DB, metrics.query_seconds)
+            finish_request()
+
+        total = time.perf_counter() - metrics.started
+
+        view = request.resolver_match.url_name if request.resolver_match is not None else ''
+        registry.histogram('weather_api_request_seconds', (('view', view),)).observe(total)
+        registry.histogram('weather_api_request_queries', (('view', view),), QUERY_BUCKETS).observe(metrics.queries)
+        registry.increment('weather_api_requests_total', (('view', view), ('status', response.status_code)))
+        response['Server-Timing'] = metrics.server_timing(total)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Runs a sample of the views under cProfile and stores the profiles, see api.profiling.
+    Comes after MetricsMiddleware, so that the timings of the request are stored with its profile
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = request.resolver_match.url_name if request.resolver_match is not None else ''
+        if not should_profile(request, view):
+            return None
+
+        started = time.time()
+        metrics = current()
+        first_query = (metrics.queries, metrics.query_seconds) if metrics is not None else (0, 0)
+        response, profile, seconds = profile_call(view_func, request, *view_args, **view_kwargs)
+        last_query = (metrics.queries, metrics.query_seconds) if metrics is not None else (0, 0)
+        info = {
+            'view': view,
+            'path': request.path,
+            'params': request.GET.dict(),
+            'status': response.status_code,
+            'started': started,
+            'seconds': seconds,
+            'phases': metrics.phases if metrics is not None else {},
+            'cache': metrics.cache if metrics is not None else None,
+            'queries': last_query[0] - first_query[0],
+            'query_seconds': last_query[1] - first_query[1],
+        }
+        try:
+            path = save_profile(profile, info)
+        except OSError:
+            # The request is answered all the same
+            logger.exception('Could not store the profile of %s', request.path)
+        else:
+            response['X-Profile'] = os.path.basename(path)
+        return response
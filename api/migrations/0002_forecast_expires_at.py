@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def set_expires_at(apps, schema_editor):
+    Forecast = apps.get_model('api', 'Forecast')
+    Forecast.objects.filter(expires_at__isnull=True).update(expires_at=F('created') + datetime.timedelta(minutes=10))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forecast',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='forecast',
+            index_together=set([('search', 'language', 'forecast_type', 'created')]),
+        ),
+        migrations.RunPython(set_expires_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_forecast_expires_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forecast',
+            name='periods',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_forecast_periods'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Label',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('key', models.CharField(max_length=255)),
+                ('language', models.CharField(max_length=20)),
+                ('text', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='label',
+            unique_together=set([('kind', 'key', 'language')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='forecast',
+            index_together=set([('search', 'language', 'forecast_type', 'created'),
+                                ('search', 'forecast_type', 'created')]),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_label'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('search', models.CharField(max_length=255)),
+                ('forecast_type', models.CharField(max_length=12)),
+                ('hour', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchcount',
+            unique_together=set([('search', 'forecast_type', 'hour')]),
+        ),
+    ]
@@ -1,4 +1,45 @@
+import datetime
+
 from django.db import models
+from django.utils import timezone
+
+
+class ForecastQuerySet(models.QuerySet):
+    def with_related(self):
+        """
+        Fetches everything Forecast.to_dict() needs in the same query
+        """
+        return self.select_related('location__timezone', 'credit', 'sun')
+
+    def for_search(self, search, language, forecast_type):
+        return self.filter(search=search, language=language, forecast_type=forecast_type)
+
+    def for_place(self, search, forecast_type):
+        """
+        Forecasts of a search in any language, they are translated when rendered
+        """
+        return self.filter(search=search, forecast_type=forecast_type)
+
+    def fresh(self, now=None, max_stale: datetime.timedelta = None):
+        """
+        Forecasts that have not expired yet, or expired less than max_stale ago
+        """
+        now = now or timezone.now()
+        if max_stale is not None:
+            now -= max_stale
+        return self.filter(expires_at__gt=now)
+
+
+class TimeQuerySet(models.QuerySet):
+    def with_related(self):
+        """
+        Fetches everything Time.to_dict() needs in the same query
+        """
+        return self.select_related('precipitation', 'pressure', 'symbol', 'temperature', 'wind_direction',
+                                   'wind_speed')
+
+    def for_forecast(self, forecast):
+        return self.with_related().filter(forecast=forecast)
 
 
 class Forecast(models.Model):
@@ -7,11 +48,23 @@ class Forecast(models.Model):
     credit = models.ForeignKey('Credit')
     sun = models.ForeignKey('Sun')
     created = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(null=True, db_index=True)
     search = models.CharField(max_length=255)
     language = models.CharField(max_length=20)
+    # Every period packed into one column, see api.storage. Null when the periods are stored as Time rows
+    periods = models.TextField(null=True, blank=True)
+
+    objects = ForecastQuerySet.as_manager()
 
     class Meta:
         get_latest_by = 'created'
+        index_together = [
+            ('search', 'language', 'forecast_type', 'created'),
+            ('search', 'forecast_type', 'created'),
+        ]
+
+    def is_stale(self, now=None) -> bool:
+        return self.expires_at is not None and self.expires_at <= (now or timezone.now())
 
     def to_dict(self):
         return dict(
@@ -36,6 +89,8 @@ class Time(models.Model):
     wind_speed = models.ForeignKey('WindSpeed')
     forecast = models.ForeignKey('Forecast')
 
+    objects = TimeQuerySet.as_manager()
+
     class Meta:
         ordering = ['-start']
 
@@ -171,3 +226,33 @@ class Sun(models.Model):
             rise=self.rise,
             set=self.set
         )
+
+
+class Label(models.Model):
+    """
+    The text of a language dependent part of a forecast in one language, see api.labels
+    """
+    kind = models.CharField(max_length=20)
+    key = models.CharField(max_length=255)
+    language = models.CharField(max_length=20)
+    text = models.CharField(max_length=255)
+
+    class Meta:
+        unique_together = [
+            ('kind', 'key', 'language'),
+        ]
+
+
+class SearchCount(models.Model):
+    """
+    Requests for a place and forecast type in one hour, in every language, see api.popularity
+    """
+    search = models.CharField(max_length=255)
+    forecast_type = models.CharField(max_length=12)
+    hour = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [
+            ('search', 'forecast_type', 'hour'),
+        ]
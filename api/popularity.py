@@ -0,0 +1,116 @@
+"""
+How often each place is searched.
+
+Every search is counted in memory by (search, forecast type), in every language, since a forecast is stored once for
+all of them. A background thread adds the counts to the SearchCount row of the hour every POPULARITY_FLUSH_SECONDS,
+so that the prefetch_forecasts command, which runs in its own process, can rank places by request volume.
+"""
+import collections
+import logging
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from api.models import SearchCount
+
+logger = logging.getLogger(__name__)
+
+
+def current_hour(now=None):
+    return (now or timezone.now()).replace(minute=0, second=0, microsecond=0)
+
+
+class RequestCounter:
+    """
+    Thread safe counts of the searches of this process. A background thread writes them to the database
+    every POPULARITY_FLUSH_SECONDS, so that no search waits for the writes
+    """
+
+    def __init__(self):
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._flusher = None
+
+    def record(self, search: str, forecast_type: str) -> None:
+        """
+        Counts a search, and starts the thread that writes the counts on the first one
+        """
+        with self._lock:
+            self._counts[(search, forecast_type)] += 1
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_periodically, name='popularity', daemon=True)
+                self._flusher.start()
+
+    def _flush_periodically(self) -> None:
+        while not self._stopped.wait(settings.POPULARITY_FLUSH_SECONDS):
+            try:
+                self.flush()
+            except Exception:
+                # The counts of the interval are lost, searches are answered all the same
+                logger.exception('Could not write the search counts')
+            finally:
+                connection.close()
+
+    def flush(self) -> int:
+        """
+        Adds the counts to the rows of the current hour
+        Returns(int): The number of searches written
+        """
+        with self._lock:
+            counts, self._counts = self._counts, collections.Counter()
+        hour = current_hour()
+        for (search, forecast_type), count in counts.items():
+            add_count(search, forecast_type, hour, count)
+        return sum(counts.values())
+
+    def clear(self) -> None:
+        """
+        Forgets the counts
+        """
+        with self._lock:
+            self._counts.clear()
+
+    def stop(self, timeout: float = None) -> None:
+        """
+        Stops the thread that writes the counts, the counts not yet written are kept
+        """
+        self._stopped.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout)
+
+
+def add_count(search: str, forecast_type: str, hour, count: int) -> None:
+    """
+    Adds to the count of a search in an hour, creating its row the first time
+    """
+    rows = SearchCount.objects.filter(search=search, forecast_type=forecast_type, hour=hour)
+    if rows.update(count=F('count') + count):
+        return
+    try:
+        with transaction.atomic():
+            SearchCount.objects.create(search=search, forecast_type=forecast_type, hour=hour, count=count)
+    except IntegrityError:
+        # Another process created the row first
+        rows.update(count=F('count') + count)
+
+
+def most_requested(since, top: int) -> list:
+    """
+    Ranks places by their searches since a point in time
+    Returns(list): Dicts with search, forecast_type and requests, most requested first
+    """
+    return list(
+        SearchCount.objects
+        .filter(hour__gte=current_hour(since))
+        .values('search', 'forecast_type')
+        .annotate(requests=Sum('count'))
+        .order_by('-requests')[:top]
+    )
+
+
+# Searches of this process, shared by all its threads
+request_counter = RequestCounter()
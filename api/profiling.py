@@ -0,0 +1,115 @@
+"""
+Opt-in profiling of production requests.
+
+With PROFILING_ENABLED, a PROFILING_SAMPLE_RATE share of the requests to the views in PROFILING_VIEWS is run under
+cProfile, and so is every request carrying the PROFILING_SECRET in an X-Profile header. Each profile is written to
+PROFILING_DIRECTORY as a .prof file, which pstats and snakeviz read, next to a .json file with the request and where
+its time went. Only the newest PROFILING_MAX_PROFILES are kept.
+``python manage.py summarize_profiles`` lists the hottest functions across the profiles.
+"""
+import cProfile
+import datetime
+import hmac
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+from api.apps import make_private_directory
+
+HEADER = 'HTTP_X_PROFILE'
+
+_rotate_lock = threading.Lock()
+
+# Orders the profiles this process saves within the same microsecond
+_sequence = itertools.count()
+
+
+def should_profile(request, view_name, rng=random) -> bool:
+    """
+    Decides if a request is profiled
+    Args:
+        request(HttpRequest): The request
+        view_name(str): The url name of its view
+        rng: Draws the sample
+
+    Returns(bool): If it should be profiled
+    """
+    if not settings.PROFILING_ENABLED:
+        return False
+    secret = settings.PROFILING_SECRET
+    if secret and hmac.compare_digest(request.META.get(HEADER, '').encode(), secret.encode()):
+        return True
+    return view_name in settings.PROFILING_VIEWS and rng.random() < settings.PROFILING_SAMPLE_RATE
+
+
+def profile_call(func, *args, **kwargs) -> tuple:
+    """
+    Runs func under cProfile
+    Returns(tuple): The result of func, the profile and the wall clock seconds it took
+    """
+    profile = cProfile.Profile()
+    started = time.perf_counter()
+    try:
+        result = profile.runcall(func, *args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - started
+    return result, profile, seconds
+
+
+def save_profile(profile, info: dict, directory: str = None) -> str:
+    """
+    Writes a profile and what is known about its request, then deletes the oldest profiles over the limit
+    Args:
+        profile(cProfile.Profile): The profile
+        info(dict): The request and its timings, written as JSON
+        directory(str): Where to write, PROFILING_DIRECTORY by default
+
+    Returns(str): The path of the profile, without extension
+    """
+    directory = directory or settings.PROFILING_DIRECTORY
+    make_private_directory(directory)
+    # Names have a fixed width and sort by time in UTC, to the microsecond, so the oldest are deleted first
+    # even when the clocks are turned back
+    name = '{0}-{1:06d}-{2}'.format(datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%S.%f'),
+                                    next(_sequence) % 1000000, uuid.uuid4().hex[:8])
+    path = os.path.join(directory, name)
+    profile.dump_stats(path + '.prof')
+    with open(path + '.json', 'w') as f:
+        json.dump(info, f, indent=2, sort_keys=True)
+    rotate(directory, settings.PROFILING_MAX_PROFILES)
+    return path
+
+
+def rotate(directory: str, keep: int) -> int:
+    """
+    Deletes all but the newest profiles of a directory
+    Returns(int): The number of profiles deleted
+    """
+    with _rotate_lock:
+        names = sorted(name[:-len('.prof')] for name in os.listdir(directory) if name.endswith('.prof'))
+        deleted = 0
+        for name in names[:max(0, len(names) - keep)]:
+            for extension in ('.prof', '.json'):
+                try:
+                    os.remove(os.path.join(directory, name + extension))
+                except FileNotFoundError:
+                    pass
+            deleted += 1
+        return deleted
+
+
+def stored_profiles(directory: str = None) -> list:
+    """
+    Returns(list): The paths of the stored profiles, without extension, oldest first
+    """
+    directory = directory or settings.PROFILING_DIRECTORY
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name[:-len('.prof')])
+            for name in sorted(os.listdir(directory)) if name.endswith('.prof')]
@@ -0,0 +1,137 @@
+"""
+Storage layouts for the periods of a forecast.
+
+relational: one Time row per period, with one row per value in the Precipitation, Pressure, Symbol,
+            Temperature, WindDirection and WindSpeed tables.
+compact:    every period of a forecast packed into Forecast.periods, a JSON array with one array of fixed fields
+            per period. Values are normalised exactly like a database round trip does, so reading them back gives the
+            same output as Time.to_dict() on the relational rows.
+"""
+import decimal
+import json
+from typing import List
+
+from django.db import models
+from django.utils.dateparse import parse_datetime
+
+from api.models import Time, Precipitation, Pressure, Symbol, Temperature, WindDirection, WindSpeed
+
+STORAGE_RELATIONAL = 'relational'
+STORAGE_COMPACT = 'compact'
+
+# The fields of a packed period, in order, grouped by the Time relation they belong to
+PERIOD_LAYOUT = (
+    (None, Time, ('start', 'end', 'period')),
+    ('precipitation', Precipitation, ('value', 'min_value', 'max_value')),
+    ('pressure', Pressure, ('unit', 'value')),
+    ('symbol', Symbol, ('name', 'number', 'var')),
+    ('temperature', Temperature, ('unit', 'value')),
+    ('wind_direction', WindDirection, ('degree', 'name', 'code')),
+    ('wind_speed', WindSpeed, ('mps', 'name')),
+)
+
+
+def _encoder(field):
+    if isinstance(field, models.DecimalField):
+        return lambda value: None if value is None else field.format_number(field.to_python(value))
+    if isinstance(field, models.DateTimeField):
+        return lambda value: None if value is None else field.to_python(value).isoformat()
+    return field.to_python
+
+
+def _decoder(field):
+    if isinstance(field, models.DecimalField):
+        return lambda value: None if value is None else decimal.Decimal(value)
+    if isinstance(field, models.DateTimeField):
+        return lambda value: None if value is None else parse_datetime(value)
+    return None
+
+
+_COLUMNS = [(relation, name, model._meta.get_field(name))
+            for relation, model, names in PERIOD_LAYOUT for name in names]
+_ENCODERS = [(relation, name, _encoder(field)) for relation, name, field in _COLUMNS]
+_DECODERS = [_decoder(field) for relation, name, field in _COLUMNS]
+
+
+def packed_column(relation, name) -> int:
+    """
+    Position of a field in a packed period
+    Args:
+        relation(str): The Time relation of the field, None for the fields of Time itself
+        name(str): The field
+
+    Returns(int): The index of the field in each packed period
+    """
+    return [(column_relation, column_name) for column_relation, column_name, _ in _COLUMNS].index((relation, name))
+
+
+def pack_periods(times: List[Time]) -> str:
+    """
+    Packs periods into the compact layout
+    Args:
+        times(list): Time instances with their related values, saved or not
+
+    Returns(str): The packed periods, ordered like Time rows are read from the database
+    """
+    rows = []
+    for time in sorted(times, key=lambda t: t.start, reverse=True):
+        row = []
+        for relation, name, encode in _ENCODERS:
+            owner = time if relation is None else getattr(time, relation)
+            row.append(encode(getattr(owner, name)))
+        rows.append(row)
+    return json.dumps(rows, separators=(',', ':'))
+
+
+def unpack_periods(packed: str) -> list:
+    """
+    Unpacks periods packed with pack_periods
+    Args:
+        packed(str): The packed periods
+
+    Returns(list): One dict per period, shaped like Time.to_dict()
+    """
+    periods = []
+    for row in json.loads(packed):
+        values = [value if decode is None else decode(value) for decode, value in zip(_DECODERS, row)]
+        period = dict(start=values[0], end=values[1], period=values[2])
+        index = 3
+        for relation, model, names in PERIOD_LAYOUT[1:]:
+            period[relation] = dict(zip(names, values[index:index + len(names)]))
+            index += len(names)
+        periods.append(period)
+    return periods
+
+
+def read_periods(forecast) -> list:
+    """
+    Reads the periods of a forecast, whichever layout it was stored in
+    Args:
+        forecast(Forecast): The forecast
+
+    Returns(list): One dict per period, shaped like Time.to_dict()
+    """
+    if forecast.periods is not None:
+        return unpack_periods(forecast.periods)
+    return [time.to_dict() for time in Time.objects.for_forecast(forecast)]
+
+
+def read_periods_of(forecasts) -> dict:
+    """
+    Reads the periods of many forecasts, with one query for all relational forecasts
+    Args:
+        forecasts(list): The forecasts
+
+    Returns(dict): The periods of each forecast by forecast id, shaped like Time.to_dict()
+    """
+    periods = {forecast.id: [] for forecast in forecasts}
+    relational = []
+    for forecast in forecasts:
+        if forecast.periods is not None:
+            periods[forecast.id] = unpack_periods(forecast.periods)
+        else:
+            relational.append(forecast.id)
+    if relational:
+        for time in Time.objects.with_related().filter(forecast_id__in=relational):
+            periods[time.forecast_id].append(time.to_dict())
+    return periods
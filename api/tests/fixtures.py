@@ -0,0 +1,126 @@
+import datetime
+from types import SimpleNamespace
+
+from py_yr.config.settings import FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY
+
+
+# What yr.no translates, in the languages of the fake forecasts
+LABELS = {
+    'en': dict(symbol='Partly cloudy', wind_direction='South-southeast', wind_speed='Light breeze', type='City',
+               country='Norway', url='http://www.yr.no/place/Norway/Hordaland/Bergen/Bergen/',
+               text='Weather forecast from Yr, delivered by the Norwegian Meteorological Institute and NRK'),
+    'nb': dict(symbol='Delvis skyet', wind_direction='Sør-sørøst', wind_speed='Svak vind', type='By',
+               country='Norge', url='http://www.yr.no/sted/Norge/Hordaland/Bergen/Bergen/',
+               text='Værvarsel fra Yr levert av Meteorologisk institutt og NRK'),
+    'nn': dict(symbol='Delvis skya', wind_direction='Sør-søraust', wind_speed='Svak vind', type='By',
+               country='Noreg', url='http://www.yr.no/stad/Noreg/Hordaland/Bergen/Bergen/',
+               text='Vêrvarsel frå Yr levert av Meteorologisk institutt og NRK'),
+}
+
+
+class FakeYr:
+    """
+    Stands in for py_yr's Yr after a successful download, so that data can be saved without hitting yr.no
+    """
+
+    def __init__(self, location, language, forecast_type, data):
+        self.location = location
+        self.language = language
+        self.forecast_type = forecast_type
+        self.source_data = data
+
+    def download(self):
+        pass
+
+    def get_as_object(self):
+        return self.source_data
+
+
+def fake_period(start: datetime.datetime, hours: int, index: int, language: str = 'en') -> SimpleNamespace:
+    """
+    Builds a tabular period shaped like the ones py_yr returns
+    Args:
+        start(datetime): Start of the period
+        hours(int): Length of the period in hours
+        index(int): Running number of the period, used to vary the values
+        language(str): The language of the names
+
+    Returns(SimpleNamespace): The period
+    """
+    return SimpleNamespace(
+        from_=start,
+        to=start + datetime.timedelta(hours=hours),
+        period=start.hour // 6 if hours == 6 else None,
+        precipitation=SimpleNamespace(value=index % 3 * 0.4, min_value=0.0, max_value=index % 3 * 0.8),
+        pressure=SimpleNamespace(unit='hPa', value=1000 + index % 30),
+        symbol=SimpleNamespace(name=LABELS[language]['symbol'], var='mf/03d.{0}'.format(index % 100), number=3),
+        temperature=SimpleNamespace(unit='celsius', value=index % 15 - 3),
+        windDirection=SimpleNamespace(deg=index * 10 % 360, code='SSE', name=LABELS[language]['wind_direction']),
+        windSpeed=SimpleNamespace(mps=index % 12 * 0.7, name=LABELS[language]['wind_speed']),
+    )
+
+
+def fake_yr(location='norge/hordaland/bergen/bergen/', language='en', forecast_type=FORECAST_TYPE_STANDARD,
+            periods=None, start=None) -> FakeYr:
+    """
+    Builds a downloaded forecast with synthetic periods
+    Args:
+        location(str): The searched location
+        language(str): The language of the forecast
+        forecast_type(str): The forecast type (hourly/standard)
+        periods(int): Number of periods, defaults to the size of a real forecast of the type
+        start(datetime): Start of the first period, defaults to the current hour
+
+    Returns(FakeYr): The forecast
+    """
+    hours = 1 if forecast_type == FORECAST_TYPE_HOURLY else 6
+    if periods is None:
+        periods = 48 if forecast_type == FORECAST_TYPE_HOURLY else 36
+    if start is None:
+        start = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+        if hours == 6:
+            start = start.replace(hour=start.hour // 6 * 6)
+
+    data = SimpleNamespace(
+        location=SimpleNamespace(
+            name='Bergen',
+            type=LABELS[language]['type'],
+            country=LABELS[language]['country'],
+            timezone=SimpleNamespace(id='Europe/Oslo', utcoffsetMinutes=60),
+        ),
+        sun=SimpleNamespace(rise=start.replace(hour=8), set=start.replace(hour=16)),
+        credit=SimpleNamespace(url=LABELS[language]['url'], text=LABELS[language]['text']),
+        forecast=SimpleNamespace(tabular=SimpleNamespace(time=[
+            fake_period(start + datetime.timedelta(hours=i * hours), hours, i, language) for i in range(periods)
+        ])),
+    )
+    return FakeYr(location, language, forecast_type, data)
+
+
+def fake_period_dicts(start: datetime.datetime, hours: int, count: int) -> list:
+    """
+    Builds periods shaped like Time.to_dict(), without saving them
+    Args:
+        start(datetime): Start of the first period
+        hours(int): Length of each period in hours
+        count(int): Number of periods
+
+    Returns(list): The periods, oldest first
+    """
+    periods = []
+    for i in range(count):
+        period = fake_period(start + datetime.timedelta(hours=i * hours), hours, i)
+        periods.append(dict(
+            start=period.from_,
+            end=period.to,
+            period=period.period,
+            precipitation=dict(value=period.precipitation.value, min_value=period.precipitation.min_value,
+                               max_value=period.precipitation.max_value),
+            pressure=dict(unit=period.pressure.unit, value=period.pressure.value),
+            symbol=dict(name=period.symbol.name, number=period.symbol.number, var=period.symbol.var),
+            temperature=dict(unit=period.temperature.unit, value=period.temperature.value),
+            wind_direction=dict(degree=period.windDirection.deg, name=period.windDirection.name,
+                                code=period.windDirection.code),
+            wind_speed=dict(mps=period.windSpeed.mps, name=period.windSpeed.name)
+        ))
+    return periods
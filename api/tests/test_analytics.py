@@ -0,0 +1,133 @@
+import datetime
+import json
+import unittest
+from unittest import mock
+
+from django.shortcuts import reverse
+from django.test import TestCase, Client, override_settings
+from py_yr.config.settings import FORECAST_TYPE_HOURLY
+
+from api import analytics
+from api.analytics import load_columns, aggregate, buckets_by_forecast, columns_of_periods
+from api.cache import response_cache
+from api.helper import save_weather_data
+from api.models import Forecast
+from api.storage import STORAGE_COMPACT, read_periods
+from api.tests.fixtures import fake_yr
+
+
+@unittest.skipIf(analytics.numpy is None, 'NumPy is not installed')
+class TestAggregate(TestCase):
+    def setUp(self):
+        # 14:00 on a monday, so the first day has ten hours
+        self.start = datetime.datetime(2017, 1, 2, 14, 0)
+        saved, _ = save_weather_data(fake_yr(forecast_type=FORECAST_TYPE_HOURLY, periods=48, start=self.start))
+        self.forecast = Forecast.objects.get(pk=saved.pk)
+        self.periods = read_periods(self.forecast)
+
+    def buckets(self, bucket_hours=24, base=18.0):
+        return buckets_by_forecast(aggregate(load_columns([self.forecast]), bucket_hours, base), base)[self.forecast.id]
+
+    def test_days(self):
+        days = self.buckets()
+
+        self.assertEqual([(day['start'], day['periods']) for day in days],
+                         [('2017-01-02T00:00:00', 10), ('2017-01-03T00:00:00', 24), ('2017-01-04T00:00:00', 14)])
+        first = [p for p in self.periods if p['start'].date() == self.start.date()]
+        temperatures = [p['temperature']['value'] for p in first]
+        self.assertEqual(days[0]['hours'], 10)
+        self.assertEqual(days[0]['temperature']['min'], min(temperatures))
+        self.assertEqual(days[0]['temperature']['max'], max(temperatures))
+        self.assertAlmostEqual(days[0]['temperature']['mean'], sum(temperatures) / len(temperatures), delta=0.01)
+        precipitation = sum(p['precipitation']['value'] for p in first)
+        self.assertAlmostEqual(days[0]['precipitation']['total'], float(precipitation))
+        wet = len([p for p in first if p['precipitation']['value'] > 0])
+        self.assertAlmostEqual(days[0]['precipitation']['probability'], round(wet / len(first), 2))
+        self.assertEqual(days[0]['wind_speed']['max'], float(max(p['wind_speed']['mps'] for p in first)))
+        self.assertEqual(days[0]['degree_hours']['heating'], sum(18.0 - t for t in temperatures))
+        self.assertEqual(days[0]['degree_hours']['cooling'], 0)
+
+    def test_buckets(self):
+        buckets = self.buckets(bucket_hours=6)
+
+        self.assertEqual(buckets[0]['start'], '2017-01-02T12:00:00')
+        self.assertEqual(buckets[0]['periods'], 4)
+        self.assertTrue(all(bucket['periods'] == 6 for bucket in buckets[1:-1]))
+        self.assertEqual(sum(bucket['periods'] for bucket in buckets), 48)
+
+    def test_layouts_agree(self):
+        with self.settings(FORECAST_STORAGE=STORAGE_COMPACT):
+            saved, _ = save_weather_data(fake_yr(forecast_type=FORECAST_TYPE_HOURLY, periods=48, start=self.start))
+        compact = Forecast.objects.get(pk=saved.pk)
+
+        buckets = buckets_by_forecast(aggregate(load_columns([self.forecast, compact]), 24, 18.0), 18.0)
+        self.assertEqual(buckets[compact.id], buckets[self.forecast.id])
+        read = aggregate(columns_of_periods(self.forecast.id, self.periods), 24, 18.0)
+        self.assertEqual(buckets_by_forecast(read, 18.0)[self.forecast.id], buckets[self.forecast.id])
+
+    def test_loads_relational_periods_with_one_query(self):
+        other, _ = save_weather_data(fake_yr('norge/oslo/oslo/oslo/', forecast_type=FORECAST_TYPE_HOURLY))
+        with self.assertNumQueries(1):
+            columns = load_columns([self.forecast, other])
+        self.assertEqual(len(columns['forecast']), 96)
+
+
+@unittest.skipIf(analytics.numpy is None, 'NumPy is not installed')
+class TestAnalyticsView(TestCase):
+    def setUp(self):
+        self.client = Client()
+        response_cache.clear()
+        self.locations = ['norge/hordaland/bergen/bergen', 'norge/oslo/oslo/oslo']
+        for location in self.locations:
+            save_weather_data(fake_yr(location + '/', forecast_type=FORECAST_TYPE_HOURLY))
+
+    def analytics(self, **params):
+        response = self.client.get(reverse('analytics'), dict({
+            'location': self.locations,
+            'language': 'en',
+            'forecastType': FORECAST_TYPE_HOURLY
+        }, **params))
+        return json.loads(str(response.content, encoding='utf8'))
+
+    def test_results(self):
+        content = self.analytics(location=self.locations + ['norge/hordaland/bergen/bergen/bergen'])
+
+        results = content['data']['results']
+        self.assertEqual([result['location'] for result in results],
+                         self.locations + ['norge/hordaland/bergen/bergen/bergen'])
+        self.assertTrue(all(result['success'] for result in results[:2]))
+        self.assertFalse(results[2]['success'])
+        self.assertEqual(sum(bucket['periods'] for bucket in results[0]['data']['buckets']), 48)
+        self.assertEqual(results[0]['data']['bucketHours'], 24)
+
+    def test_bucket_and_base(self):
+        content = self.analytics(bucket=12, base=-100)
+
+        buckets = content['data']['results'][0]['data']['buckets']
+        self.assertTrue(all(bucket['hours'] <= 12 for bucket in buckets))
+        self.assertTrue(all(bucket['degree_hours']['heating'] == 0 for bucket in buckets))
+
+    def test_invalid_bucket(self):
+        for bucket in ('0', '241', 'day'):
+            content = self.analytics(bucket=bucket)
+            self.assertFalse(content['success'])
+
+    @override_settings(ANALYTICS_MAX_DOWNLOADS=1)
+    @mock.patch('api.views.refresh_forecast', return_value=None)
+    def test_downloads_are_capped(self, refresh_forecast):
+        missing = ['norge/rogaland/stavanger/stavanger', 'norge/troms/tromsø/tromsø']
+        content = self.analytics(location=self.locations + missing)
+
+        refresh_forecast.assert_called_once_with(missing[0] + '/', 'en', FORECAST_TYPE_HOURLY)
+        results = content['data']['results']
+        self.assertTrue(all(result['success'] for result in results[:2]))
+        self.assertFalse(results[3]['success'])
+        self.assertEqual(results[3]['message'],
+                         'The forecast has not been downloaded yet, search for it or try again later')
+
+    @override_settings(ANALYTICS_MAX_LOCATIONS=1)
+    def test_too_many_locations(self):
+        content = self.analytics()
+
+        self.assertFalse(content['success'])
+        self.assertIn('1', content['message'])
@@ -0,0 +1,41 @@
+import os
+import shutil
+import stat
+import tempfile
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+
+from api.apps import make_private_directory
+
+
+class TestMakePrivateDirectory(SimpleTestCase):
+    def setUp(self):
+        self.parent = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.parent)
+        self.path = os.path.join(self.parent, 'var')
+
+    def mode(self):
+        return stat.S_IMODE(os.stat(self.path).st_mode)
+
+    def test_creates_private_directory(self):
+        make_private_directory(self.path)
+        self.assertEqual(self.mode(), 0o700)
+
+    def test_makes_existing_directory_private(self):
+        os.mkdir(self.path, 0o777)
+        os.chmod(self.path, 0o777)
+        make_private_directory(self.path)
+        self.assertEqual(self.mode(), 0o700)
+
+    def test_refuses_directory_of_another_user(self):
+        os.mkdir(self.path)
+        with mock.patch('os.getuid', return_value=os.getuid() + 1):
+            self.assertRaises(ImproperlyConfigured, make_private_directory, self.path)
+
+    def test_refuses_symlink(self):
+        target = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, target)
+        os.symlink(target, self.path)
+        self.assertRaises(ImproperlyConfigured, make_private_directory, self.path)
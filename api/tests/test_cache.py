@@ -0,0 +1,168 @@
+from unittest import mock
+
+from django.shortcuts import reverse
+from django.test import SimpleTestCase, TestCase, Client, override_settings
+from py_yr.config.settings import FORECAST_TYPE_STANDARD
+
+from api.cache import ResponseCache, SharedResponseCache, NegativeCache, cache_key
+from api.helper import save_weather_data
+from api.tests.fixtures import fake_yr
+
+SHARED_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'responses': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-responses'},
+}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResponseCache(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = ResponseCache(max_entries=2, clock=self.clock)
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get('bergen'))
+        self.cache.set('bergen', {'success': True}, 60)
+        self.assertEqual(self.cache.get('bergen'), {'success': True})
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_expires(self):
+        self.cache.set('bergen', 'forecast', 60)
+        self.clock.now = 59
+        self.assertEqual(self.cache.get('bergen'), 'forecast')
+        self.clock.now = 60
+        self.assertIsNone(self.cache.get('bergen'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set('bergen', 'bergen', 60)
+        self.cache.set('oslo', 'oslo', 60)
+        self.cache.get('bergen')
+        self.cache.set('tromso', 'tromso', 60)
+
+        self.assertIsNone(self.cache.get('oslo'))
+        self.assertEqual(self.cache.get('bergen'), 'bergen')
+        self.assertEqual(self.cache.get('tromso'), 'tromso')
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_invalidate(self):
+        self.cache.set('bergen', 'forecast', 60)
+        self.cache.invalidate('bergen')
+        self.assertIsNone(self.cache.get('bergen'))
+
+    def test_disabled(self):
+        cache = ResponseCache(max_entries=0, clock=self.clock)
+        cache.set('bergen', 'forecast', 60)
+        self.assertIsNone(cache.get('bergen'))
+
+    def test_non_positive_ttl_is_not_cached(self):
+        self.cache.set('bergen', 'forecast', 0)
+        self.assertIsNone(self.cache.get('bergen'))
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class TestSharedResponseCache(SimpleTestCase):
+    def setUp(self):
+        self.cache = SharedResponseCache('responses')
+        self.cache.clear()
+
+    def test_shared_between_instances(self):
+        key = cache_key('norge/hordaland/bergen/bergen/', 'nb', 'standard')
+        self.assertIsNone(self.cache.get(key))
+        self.cache.set(key, {'success': True}, 60)
+
+        # Another worker process
+        other = SharedResponseCache('responses')
+        self.assertEqual(other.get(key), {'success': True})
+        other.invalidate(key)
+        self.assertIsNone(self.cache.get(key))
+
+        self.assertEqual(self.cache.stats(), dict(hits=0, misses=2, errors=0))
+        self.assertEqual(other.stats()['hits'], 1)
+
+    def test_keys(self):
+        key = cache_key('norge/akershus/bærum/sandvika/', 'nb', 'standard')
+        shared_key = SharedResponseCache.shared_key(key)
+        self.assertRegex(shared_key, r'^response:[0-9a-f]{40}$')
+        self.assertNotEqual(shared_key, SharedResponseCache.shared_key(key + ('summaries',)))
+
+    def test_non_positive_ttl_is_not_cached(self):
+        self.cache.set(('bergen',), 'forecast', 0)
+        self.assertIsNone(self.cache.get(('bergen',)))
+
+    def test_failing_cache_is_a_miss(self):
+        with mock.patch('django.core.cache.backends.locmem.LocMemCache.get', side_effect=ConnectionError):
+            self.assertIsNone(self.cache.get(('bergen',)))
+        self.assertEqual(self.cache.stats()['errors'], 1)
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class TestSharedResponseCacheSearch(TestCase):
+    def setUp(self):
+        self.location = 'norge/hordaland/bergen/bergen'
+        self.client = Client()
+        self.cache = SharedResponseCache('responses')
+        self.cache.clear()
+        for name in ('api.views.response_cache', 'api.helper.response_cache'):
+            patch = mock.patch(name, self.cache)
+            patch.start()
+            self.addCleanup(patch.stop)
+        save_weather_data(fake_yr(self.location + '/'))
+
+    def search(self):
+        return self.client.get(reverse('search'), {
+            'location': self.location,
+            'language': 'en',
+            'forecastType': FORECAST_TYPE_STANDARD
+        })
+
+    def test_new_forecast_replaces_shared_response(self):
+        first = self.search()
+        cached = self.search()
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(cached['ETag'], first['ETag'])
+
+        save_weather_data(fake_yr(self.location + '/'))
+        self.assertIsNone(self.cache.get(cache_key(self.location + '/', 'en', FORECAST_TYPE_STANDARD)))
+        self.assertNotEqual(self.search()['ETag'], first['ETag'])
+
+
+@override_settings(NEGATIVE_CACHE_NOT_FOUND_SECONDS=300, NEGATIVE_CACHE_UPSTREAM_ERROR_SECONDS=30)
+class TestNegativeCache(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = NegativeCache(max_entries=10, clock=self.clock)
+
+    def test_reasons_expire_separately(self):
+        self.cache.add('atlantis', NegativeCache.NOT_FOUND)
+        self.cache.add('bergen', NegativeCache.UPSTREAM_ERROR)
+
+        self.clock.now = 29
+        self.assertEqual(self.cache.get('atlantis'), NegativeCache.NOT_FOUND)
+        self.assertEqual(self.cache.get('bergen'), NegativeCache.UPSTREAM_ERROR)
+        self.clock.now = 30
+        self.assertIsNone(self.cache.get('bergen'))
+        self.clock.now = 300
+        self.assertIsNone(self.cache.get('atlantis'))
+
+    def test_stats(self):
+        self.cache.add('atlantis', NegativeCache.NOT_FOUND)
+        self.cache.get('atlantis')
+        self.cache.get('atlantis')
+        self.cache.get('oslo')
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['not_found'], 1)
+        self.assertEqual(stats['avoided_not_found'], 2)
+        self.assertEqual(stats['avoided_upstream_errors'], 0)
@@ -0,0 +1,171 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, SimpleTestCase
+from py_yr.config.settings import FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY
+
+from api.helper import save_weather_data, PERIOD_CHILD_MODELS
+from api.management.commands.prefetch_forecasts import UpstreamBudget, popular_searches
+from api.models import Forecast, Time, Location, TimeZone, Sun, Credit, Precipitation
+from api.popularity import add_count, current_hour
+from api.tests.fixtures import fake_yr
+
+
+class TestUpstreamBudget(SimpleTestCase):
+    def test_budget_per_minute(self):
+        now = [0.0]
+        budget = UpstreamBudget(per_minute=10, clock=lambda: now[0])
+
+        self.assertEqual(budget.take(4), 4)
+        self.assertEqual(budget.take(10), 6)
+        self.assertEqual(budget.take(1), 0)
+        now[0] = 60.0
+        self.assertEqual(budget.take(20), 10)
+
+
+class TestPrefetchForecasts(TestCase):
+    def setUp(self):
+        self.bergen, _ = save_weather_data(fake_yr('norge/hordaland/bergen/bergen/', periods=1))
+        self.oslo, _ = save_weather_data(fake_yr('norge/oslo/oslo/oslo/', periods=1))
+        self.searched('norge/hordaland/bergen/bergen/', 2)
+        self.searched('norge/oslo/oslo/oslo/', 1)
+
+    def searched(self, search, count):
+        add_count(search, FORECAST_TYPE_STANDARD, current_hour(), count)
+
+    def prefetch(self, *args):
+        out = StringIO()
+        call_command('prefetch_forecasts', '--once', *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    @mock.patch('api.management.commands.prefetch_forecasts.refresh_forecast')
+    def test_refreshes_forecasts_about_to_expire(self, refresh_forecast):
+        Forecast.objects.filter(pk=self.bergen.pk).update(
+            expires_at=datetime.datetime.now() + datetime.timedelta(seconds=30))
+
+        output = self.prefetch('--lead', '60')
+
+        refresh_forecast.assert_called_once_with('norge/hordaland/bergen/bergen/', 'en', FORECAST_TYPE_STANDARD,
+                                                 force=True)
+        self.assertIn('refreshed 1, skipped 1, failed 0', output)
+
+    @mock.patch('api.management.commands.prefetch_forecasts.refresh_forecast', side_effect=IOError('yr is down'))
+    def test_reports_failures(self, refresh_forecast):
+        Forecast.objects.update(expires_at=datetime.datetime.now())
+
+        output = self.prefetch()
+
+        self.assertEqual(refresh_forecast.call_count, 2)
+        self.assertIn('refreshed 0, skipped 0, failed 2', output)
+
+    @mock.patch('api.management.commands.prefetch_forecasts.refresh_forecast')
+    def test_respects_budget(self, refresh_forecast):
+        Forecast.objects.update(expires_at=datetime.datetime.now())
+
+        output = self.prefetch('--budget', '1')
+
+        self.assertEqual(refresh_forecast.call_count, 1)
+        self.assertIn('refreshed 1, skipped 1, failed 0', output)
+
+
+    @mock.patch('api.management.commands.prefetch_forecasts.refresh_forecast')
+    def test_ranks_by_searches(self, refresh_forecast):
+        Forecast.objects.update(expires_at=datetime.datetime.now())
+        # Downloads, e.g. the prefetcher's own, do not make a place popular
+        for _ in range(3):
+            save_weather_data(fake_yr('norge/hordaland/bergen/bergen/', periods=1))
+        Forecast.objects.update(expires_at=datetime.datetime.now())
+        self.searched('norge/oslo/oslo/oslo/', 5)
+
+        self.prefetch('--top', '1')
+
+        refresh_forecast.assert_called_once_with('norge/oslo/oslo/oslo/', 'en', FORECAST_TYPE_STANDARD, force=True)
+
+    @mock.patch('api.management.commands.prefetch_forecasts.refresh_forecast')
+    def test_refreshes_place_once_in_every_language(self, refresh_forecast):
+        save_weather_data(fake_yr('norge/hordaland/bergen/bergen/', 'nb', periods=1))
+        Forecast.objects.update(expires_at=datetime.datetime.now())
+
+        output = self.prefetch()
+
+        self.assertEqual(refresh_forecast.call_count, 2)
+        refresh_forecast.assert_any_call('norge/hordaland/bergen/bergen/', 'nb', FORECAST_TYPE_STANDARD, force=True)
+        self.assertIn('refreshed 2, skipped 0, failed 0', output)
+
+    def test_popular_searches_read_latest_forecasts(self):
+        for language in ('nb', 'nn', 'nb'):
+            save_weather_data(fake_yr('norge/hordaland/bergen/bergen/', language, periods=1))
+        save_weather_data(fake_yr('norge/hordaland/bergen/bergen/', 'nn', FORECAST_TYPE_HOURLY, periods=1))
+
+        # Ranking, the ids of the latest forecasts and their rows, however many forecasts are stored
+        with self.assertNumQueries(3):
+            popular = popular_searches(datetime.datetime.now() - datetime.timedelta(hours=1), 10)
+
+        self.assertEqual([(row['search'], row['language'], row['requests']) for row in popular], [
+            ('norge/hordaland/bergen/bergen/', 'nb', 2),
+            ('norge/oslo/oslo/oslo/', 'en', 1),
+        ])
+
+    @mock.patch('api.management.commands.prefetch_forecasts.popular_searches', side_effect=IOError('database is gone'))
+    def test_reports_failing_cycle(self, popular_searches):
+        err = StringIO()
+        call_command('prefetch_forecasts', '--once', stdout=StringIO(), stderr=err)
+
+        self.assertIn('cycle failed', err.getvalue())
+
+
+class TestPruneForecasts(TestCase):
+    def setUp(self):
+        self.search = 'norge/hordaland/bergen/bergen/'
+        self.forecasts = [save_weather_data(fake_yr(self.search, periods=4))[0] for _ in range(3)]
+        self.other, _ = save_weather_data(fake_yr('norge/oslo/oslo/oslo/', periods=4))
+
+    def age(self, forecast, hours):
+        Forecast.objects.filter(pk=forecast.pk).update(
+            created=datetime.datetime.now() - datetime.timedelta(hours=hours))
+
+    def prune(self, *args):
+        out = StringIO()
+        call_command('prune_forecasts', *args, stdout=out)
+        return out.getvalue()
+
+    def test_keeps_latest_and_recent_forecasts(self):
+        self.age(self.forecasts[0], 48)
+        self.age(self.forecasts[1], 36)
+        self.age(self.other, 48)
+
+        self.prune('--keep', '1', '--keep-hours', '24')
+
+        self.assertEqual(set(Forecast.objects.values_list('id', flat=True)),
+                         {self.forecasts[2].pk, self.other.pk})
+
+    def test_deletes_periods_and_their_values(self):
+        for forecast in self.forecasts[:2]:
+            self.age(forecast, 48)
+
+        output = self.prune('--keep', '1', '--batch-size', '1')
+
+        self.assertEqual(Time.objects.count(), 8)
+        for model in PERIOD_CHILD_MODELS:
+            self.assertEqual(model.objects.count(), 8)
+        for model in (Location, TimeZone, Sun, Credit):
+            self.assertEqual(model.objects.count(), 2)
+        self.assertIn('Deleted {0} rows'.format(2 * (4 * 7 + 5)), output)
+
+    def test_dry_run(self):
+        for forecast in self.forecasts[:2]:
+            self.age(forecast, 48)
+
+        output = self.prune('--dry-run')
+
+        self.assertIn('Would delete 2 forecasts', output)
+        self.assertEqual(Forecast.objects.count(), 4)
+
+    def test_orphans(self):
+        Precipitation.objects.create(value=1)
+
+        self.prune('--orphans')
+
+        self.assertEqual(Precipitation.objects.count(), 16)
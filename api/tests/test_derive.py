@@ -0,0 +1,147 @@
+import datetime
+import decimal
+import json
+from unittest import mock
+
+from django.shortcuts import reverse
+from django.test import TestCase, Client, override_settings
+from py_yr.config.settings import FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY
+
+from api.cache import response_cache
+from api.derive import derive_standard_periods, derived_expires_at
+from api.helper import save_weather_data
+from api.labels import label_store
+from api.models import Forecast
+from api.storage import read_periods
+from api.tests.fixtures import fake_yr
+
+
+class TestDeriveStandardPeriods(TestCase):
+    def setUp(self):
+        self.start = datetime.datetime(2017, 1, 2, 14, 0)
+        forecast, _ = save_weather_data(fake_yr(forecast_type=FORECAST_TYPE_HOURLY, periods=20, start=self.start))
+        self.hourly = read_periods(forecast)
+
+    def test_periods(self):
+        derived = derive_standard_periods(self.hourly)
+
+        # 14-18 has started, 18-24 and 00-06 are whole, 06-10 is not
+        self.assertEqual([(p['start'].hour, p['end'].hour, p['period']) for p in reversed(derived)],
+                         [(14, 18, 2), (18, 0, 3), (0, 6, 0)])
+
+    def test_aggregates(self):
+        night = derive_standard_periods(self.hourly)[0]
+        night_start = datetime.datetime(2017, 1, 3, 0)
+        hours = [p for p in self.hourly if night_start <= p['start'] < night_start + datetime.timedelta(hours=6)]
+
+        self.assertEqual(night['precipitation']['value'], sum(p['precipitation']['value'] for p in hours))
+        self.assertEqual(night['precipitation']['max_value'], sum(p['precipitation']['max_value'] for p in hours))
+        windiest = max(hours, key=lambda p: p['wind_speed']['mps'])
+        self.assertEqual(night['wind_speed'], windiest['wind_speed'])
+        self.assertEqual(night['wind_direction'], windiest['wind_direction'])
+        self.assertEqual(night['symbol']['number'], 3)
+        self.assertEqual(night['temperature']['value'],
+                         round(sum(p['temperature']['value'] for p in hours) / len(hours)))
+        self.assertIsInstance(night['pressure']['value'], decimal.Decimal)
+
+
+@override_settings(FORECAST_DERIVE_STANDARD=True, FORECAST_DERIVE_STANDARD_HOURS=36,
+                   FORECAST_DERIVE_STANDARD_TAIL_HOURS=6)
+class TestDerivedStandardSearch(TestCase):
+    def setUp(self):
+        self.location = 'norge/hordaland/bergen/bergen'
+        self.client = Client()
+        response_cache.clear()
+        label_store.clear()
+
+    def search(self):
+        response = self.client.get(reverse('search'), {
+            'location': self.location,
+            'language': 'en',
+            'forecastType': FORECAST_TYPE_STANDARD
+        })
+        return json.loads(str(response.content, encoding='utf8'))
+
+    def save_expired_standard(self, hours):
+        forecast, _ = save_weather_data(fake_yr(self.location + '/', 'en', FORECAST_TYPE_STANDARD))
+        Forecast.objects.filter(pk=forecast.pk).update(
+            expires_at=datetime.datetime.now() - datetime.timedelta(hours=hours))
+
+    @mock.patch('api.views.refresh_forecast')
+    def test_standard_from_hourly(self, refresh_forecast):
+        self.save_expired_standard(hours=1)
+        save_weather_data(fake_yr(self.location + '/', 'en', FORECAST_TYPE_HOURLY))
+
+        data = self.search()
+        self.assertFalse(refresh_forecast.called)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['data']['meta']['forecast_type'], FORECAST_TYPE_STANDARD)
+        derived_until = data['data']['meta']['derived_until']
+        periods = [period for day in data['data']['forecasts'] for period in day['forecast']]
+        self.assertTrue(all(period['period'] is not None for period in periods))
+        # The periods after the hourly forecast come from the standard forecast, as far ahead as a downloaded one
+        self.assertTrue(any(period['start'] >= derived_until for period in periods))
+        self.assertTrue(any(period['start'] < derived_until for period in periods))
+
+    @mock.patch('api.views.refresh_forecast')
+    def test_derived_validators(self, refresh_forecast):
+        self.save_expired_standard(hours=1)
+        hourly, _ = save_weather_data(fake_yr(self.location + '/', 'en', FORECAST_TYPE_HOURLY))
+        params = {'location': self.location, 'language': 'en'}
+
+        standard = self.client.get(reverse('search'), dict(params, forecastType=FORECAST_TYPE_STANDARD))
+        hourly_response = self.client.get(reverse('search'), dict(params, forecastType=FORECAST_TYPE_HOURLY))
+        self.assertFalse(refresh_forecast.called)
+        self.assertNotEqual(standard['ETag'], hourly_response['ETag'])
+
+        derived_until = json.loads(str(standard.content, encoding='utf8'))['data']['meta']['derived_until']
+        self.assertIn(derived_until[:13].replace('-', '').replace(':', ''), standard['ETag'])
+
+    def test_derived_expiry(self):
+        hourly, _ = save_weather_data(fake_yr(self.location + '/', 'en', FORECAST_TYPE_HOURLY))
+        hourly = Forecast.objects.with_related().get(pk=hourly.pk)
+        far = hourly.expires_at + datetime.timedelta(days=3)
+        self.assertEqual(derived_expires_at(hourly, far), hourly.expires_at)
+
+        # Periods are in the local time of the location, UTC+1 in the fixture
+        near = hourly.expires_at + datetime.timedelta(hours=36)
+        self.assertEqual(derived_expires_at(hourly, near), hourly.expires_at - datetime.timedelta(hours=1))
+
+    @mock.patch('api.views.refresh_forecast')
+    def test_new_hourly_forecast_replaces_cached_derived(self, refresh_forecast):
+        self.save_expired_standard(hours=1)
+        save_weather_data(fake_yr(self.location + '/', 'en', FORECAST_TYPE_HOURLY))
+        first = self.search()
+        save_weather_data(fake_yr(self.location + '/', 'en', FORECAST_TYPE_HOURLY))
+
+        self.assertNotEqual(self.search()['data']['meta']['created'], first['data']['meta']['created'])
+
+    @mock.patch('api.views.refresh_forecast', return_value=None)
+    def test_without_standard_forecast(self, refresh_forecast):
+        save_weather_data(fake_yr(self.location + '/', 'en', FORECAST_TYPE_HOURLY))
+
+        self.search()
+        refresh_forecast.assert_called_once_with(self.location + '/', 'en', FORECAST_TYPE_STANDARD)
+
+    @mock.patch('api.views.refresh_forecast', return_value=None)
+    def test_standard_forecast_too_old(self, refresh_forecast):
+        self.save_expired_standard(hours=7)
+        save_weather_data(fake_yr(self.location + '/', 'en', FORECAST_TYPE_HOURLY))
+
+        self.search()
+        refresh_forecast.assert_called_once_with(self.location + '/', 'en', FORECAST_TYPE_STANDARD)
+
+    @mock.patch('api.views.refresh_forecast', return_value=None)
+    def test_hourly_too_short(self, refresh_forecast):
+        save_weather_data(fake_yr(self.location + '/', 'en', FORECAST_TYPE_HOURLY, periods=12))
+
+        self.search()
+        refresh_forecast.assert_called_once_with(self.location + '/', 'en', FORECAST_TYPE_STANDARD)
+
+    @override_settings(FORECAST_DERIVE_STANDARD=False)
+    @mock.patch('api.views.refresh_forecast', return_value=None)
+    def test_disabled(self, refresh_forecast):
+        save_weather_data(fake_yr(self.location + '/', 'en', FORECAST_TYPE_HOURLY))
+
+        self.search()
+        self.assertTrue(refresh_forecast.called)
@@ -0,0 +1,75 @@
+import datetime
+import decimal
+import gzip
+import json
+import unittest
+
+from django.http import JsonResponse
+from django.test import SimpleTestCase, override_settings
+
+from api import encoding
+from api.encoding import dumps, json_response, compress, compress_all, negotiate_encoding
+
+
+class TestEncoding(SimpleTestCase):
+    def setUp(self):
+        self.data = {
+            'success': True,
+            'data': {
+                'meta': {'created': datetime.datetime(2017, 1, 2, 12, 30, 15, 123456), 'stale': False},
+                'forecasts': [{'weekday': 'Monday', 'forecast': [{'value': decimal.Decimal('1.20'), 'period': None}]}],
+            },
+            'message': 'Må spesifisere et sted',
+        }
+
+    @override_settings(RESPONSE_JSON_ENCODER='django')
+    def test_django_encoder_matches_json_response(self):
+        self.assertEqual(dumps(self.data), JsonResponse(self.data).content)
+
+    @unittest.skipIf(encoding.orjson is None, 'orjson is not installed')
+    @override_settings(RESPONSE_JSON_ENCODER='auto')
+    def test_orjson_encodes_like_django(self):
+        self.assertEqual(json.loads(dumps(self.data).decode('utf-8')),
+                         json.loads(JsonResponse(self.data).content.decode('utf-8')))
+
+    @unittest.skipIf(encoding.orjson is None, 'orjson is not installed')
+    def test_orjson_does_not_escape_non_ascii(self):
+        with override_settings(RESPONSE_JSON_ENCODER='auto'):
+            self.assertIn('Må'.encode('utf-8'), dumps(self.data))
+        with override_settings(RESPONSE_JSON_ENCODER='django'):
+            self.assertIn(b'M\\u00e5', dumps(self.data))
+
+    def test_json_response(self):
+        response = json_response(b'{}')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.content, b'{}')
+
+
+class TestCompression(SimpleTestCase):
+    def test_negotiate_preference(self):
+        self.assertEqual(negotiate_encoding('gzip, deflate, br', ['br', 'gzip']), 'br')
+        self.assertEqual(negotiate_encoding('gzip, deflate', ['br', 'gzip']), 'gzip')
+        self.assertEqual(negotiate_encoding('*', ['br', 'gzip']), 'br')
+
+    def test_negotiate_identity(self):
+        self.assertIsNone(negotiate_encoding('', ['br', 'gzip']))
+        self.assertIsNone(negotiate_encoding('deflate', ['br', 'gzip']))
+        self.assertIsNone(negotiate_encoding('gzip', []))
+
+    def test_negotiate_quality(self):
+        self.assertEqual(negotiate_encoding('br;q=0, gzip;q=0.5', ['br', 'gzip']), 'gzip')
+        self.assertIsNone(negotiate_encoding('*;q=0', ['br', 'gzip']))
+        self.assertEqual(negotiate_encoding('*, br;q=0', ['br', 'gzip']), 'gzip')
+
+    def test_gzip(self):
+        body = b'{"success": true}' * 100
+        self.assertEqual(gzip.decompress(compress(body, 'gzip')), body)
+
+    @override_settings(RESPONSE_ENCODINGS=['gzip'])
+    def test_compress_all(self):
+        self.assertEqual(list(compress_all(b'{}')), ['gzip'])
+
+    @unittest.skipIf(encoding.brotli is None, 'brotli is not installed')
+    def test_brotli(self):
+        body = b'{"success": true}' * 100
+        self.assertEqual(encoding.brotli.decompress(compress(body, 'br')), body)
@@ -0,0 +1,126 @@
+import datetime
+import decimal
+import json
+from unittest import mock
+
+from django.db import IntegrityError
+from django.db.models.query import QuerySet
+from django.shortcuts import reverse
+from django.test import TestCase, Client
+from py_yr.config.settings import FORECAST_TYPE_HOURLY
+
+from api.cache import response_cache, negative_cache
+from api.helper import save_weather_data
+from api.labels import label_store, speed_key, SYMBOL
+from api.models import Forecast, Label
+from api.tests.fixtures import fake_yr
+from api.upstream import refresh_forecast
+
+
+class TestLabels(TestCase):
+    def setUp(self):
+        self.search = 'norge/hordaland/bergen/bergen/'
+        self.start = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+        self.client = Client()
+        label_store.clear()
+        response_cache.clear()
+        negative_cache.clear()
+
+    def save(self, language):
+        return save_weather_data(fake_yr(self.search, language, FORECAST_TYPE_HOURLY, start=self.start))[0]
+
+    def get(self, language):
+        response = self.client.get(reverse('search'), {
+            'location': self.search[:-1],
+            'language': language,
+            'forecastType': FORECAST_TYPE_HOURLY
+        })
+        data = json.loads(str(response.content, encoding='utf8'))
+        del data['data']['meta']['created']
+        del data['data']['lastModified']
+        return data
+
+    def test_translated_forecast_matches_downloaded_forecast(self):
+        self.save('nb')
+        downloaded = self.get('nb')
+        Forecast.objects.filter(language='nb').delete()
+        self.save('en')
+        response_cache.clear()
+        label_store.clear()
+
+        with mock.patch('api.views.refresh_forecast') as refresh_forecast:
+            translated = self.get('nb')
+
+        self.assertFalse(refresh_forecast.called)
+        self.assertEqual(translated, downloaded)
+        self.assertEqual(translated['data']['meta']['location']['country'], 'Norge')
+
+    def test_unknown_labels_are_downloaded(self):
+        self.save('en')
+
+        def download(search, language, forecast_type):
+            forecast, times = save_weather_data(fake_yr(search, language, forecast_type, start=self.start))
+            return forecast, [t.to_dict() for t in times]
+
+        with mock.patch('api.views.refresh_forecast', side_effect=download) as refresh_forecast:
+            downloaded = self.get('nn')
+        refresh_forecast.assert_called_once_with(self.search, 'nn', FORECAST_TYPE_HOURLY)
+        self.assertEqual(downloaded['data']['meta']['language'], 'nn')
+
+    def test_conflicting_labels_are_written_again(self):
+        bulk_create = QuerySet.bulk_create
+        calls = []
+
+        def conflict(queryset, objs, *args, **kwargs):
+            calls.append(objs)
+            if len(calls) == 1:
+                # Another process stored one of the labels first
+                raise IntegrityError('UNIQUE constraint failed')
+            return bulk_create(queryset, objs, *args, **kwargs)
+
+        found = {(SYMBOL, '1'): 'Clear sky', (SYMBOL, '2'): 'Fair'}
+        with mock.patch.object(QuerySet, 'bulk_create', autospec=True, side_effect=conflict):
+            label_store.learn('en', found)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(set(Label.objects.filter(language='en').values_list('kind', 'key', 'text')),
+                         {(SYMBOL, '1', 'Clear sky'), (SYMBOL, '2', 'Fair')})
+
+    @mock.patch('api.upstream.download')
+    def test_fresh_forecast_in_another_language_is_not_downloaded(self, download):
+        self.save('en')
+        self.save('nb')
+
+        forecast, periods = refresh_forecast(self.search, 'en', FORECAST_TYPE_HOURLY)
+        self.assertFalse(download.called)
+        self.assertEqual(forecast.language, 'nb')
+
+    def test_known_labels_are_not_written_again(self):
+        self.save('en')
+        count = Label.objects.filter(language='en').count()
+        label_store.clear()
+        self.save('en')
+
+        self.assertTrue(count)
+        self.assertEqual(Label.objects.filter(language='en').count(), count)
+
+    def test_speed_key(self):
+        self.assertEqual(speed_key(3 * 0.7), speed_key(decimal.Decimal('2.10')))
+        self.assertEqual(speed_key(0), '0')
+        self.assertEqual(speed_key(1.6), speed_key(decimal.Decimal('3.30')))
+        self.assertNotEqual(speed_key(3.3), speed_key(3.4))
+        self.assertEqual(speed_key(40), '12')
+
+    def test_new_wind_speeds_are_translated(self):
+        self.save('nb')
+        Forecast.objects.all().delete()
+        # The same forces as the forecast in nb, but none of the same speeds
+        yr = fake_yr(self.search, 'en', FORECAST_TYPE_HOURLY, start=self.start)
+        for period in yr.source_data.forecast.tabular.time:
+            period.windSpeed.mps += 0.05
+        save_weather_data(yr)
+        response_cache.clear()
+
+        with mock.patch('api.views.refresh_forecast') as refresh_forecast:
+            translated = self.get('nb')
+        self.assertFalse(refresh_forecast.called)
+        self.assertTrue(translated['success'])
@@ -0,0 +1,119 @@
+from unittest import mock
+
+from django.db import connection
+from django.shortcuts import reverse
+from django.test import SimpleTestCase, TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from py_yr.config.settings import FORECAST_TYPE_STANDARD
+
+from api.cache import response_cache
+from api.helper import save_weather_data
+from api.metrics import Histogram, registry, render, timed, start_request, finish_request, SAVE
+from api.popularity import request_counter
+from api.tests.fixtures import fake_yr
+
+
+class TestHistogram(SimpleTestCase):
+    def test_buckets_are_cumulative(self):
+        histogram = Histogram([0.1, 1])
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+
+        buckets, total, count = histogram.snapshot()
+        self.assertEqual(buckets, [(0.1, 2), (1, 3), (float('inf'), 4)])
+        self.assertAlmostEqual(total, 3.65)
+        self.assertEqual(count, 4)
+
+    def test_render(self):
+        registry.clear()
+        registry.histogram('test_seconds', (('phase', 'db'),), [0.5]).observe(0.25)
+        registry.increment('test_total', (('view', 'search'),))
+
+        text = render(gauges={('test_entries', ()): 3})
+        self.assertIn('# TYPE test_seconds histogram\n', text)
+        self.assertIn('test_seconds_bucket{phase="db",le="0.5"} 1\n', text)
+        self.assertIn('test_seconds_bucket{phase="db",le="+Inf"} 1\n', text)
+        self.assertIn('test_seconds_count{phase="db"} 1\n', text)
+        self.assertIn('# TYPE test_total counter\ntest_total{view="search"} 1\n', text)
+        self.assertIn('# TYPE test_entries gauge\ntest_entries 3\n', text)
+
+    def test_timed_adds_to_the_request(self):
+        registry.clear()
+        request = start_request()
+        try:
+            with timed(SAVE):
+                pass
+            with timed(SAVE):
+                pass
+        finally:
+            finish_request()
+
+        self.assertIn(SAVE, request.phases)
+        self.assertEqual(registry.histogram('weather_api_phase_seconds', (('phase', SAVE),)).snapshot()[2], 2)
+
+
+class TestMetricsMiddleware(TestCase):
+    def setUp(self):
+        self.location = 'norge/hordaland/bergen/bergen'
+        self.client = Client()
+        response_cache.clear()
+        request_counter.clear()
+        registry.clear()
+        save_weather_data(fake_yr(self.location + '/'))
+
+    def search(self):
+        return self.client.get(reverse('search'), {
+            'location': self.location,
+            'language': 'en',
+            'forecastType': FORECAST_TYPE_STANDARD
+        })
+
+    def test_server_timing(self):
+        stored = self.search()['Server-Timing']
+        cached = self.search()['Server-Timing']
+
+        self.assertRegex(stored, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('serialize;dur=', stored)
+        self.assertIn('cache;desc="stored"', stored)
+        self.assertIn('cache;desc="hit"', cached)
+        self.assertNotIn('db;', cached)
+        self.assertRegex(cached, r'total;dur=[\d.]+$')
+
+    def test_metrics_endpoint(self):
+        self.search()
+        self.search()
+
+        response = self.client.get(reverse('metrics'))
+        text = str(response.content, encoding='utf8')
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('weather_api_search_cache_total{outcome="hit"} 1\n', text)
+        self.assertIn('weather_api_search_cache_total{outcome="stored"} 1\n', text)
+        self.assertIn('weather_api_requests_total{view="search",status="200"} 2\n', text)
+        self.assertIn('weather_api_request_seconds_count{view="search"} 2\n', text)
+        self.assertIn('weather_api_phase_seconds_count{phase="serialize"} 1\n', text)
+        self.assertIn('weather_api_cache_hits_total{cache="response"}', text)
+        self.assertIn('weather_api_upstream_breaker_state{state="closed"} 1\n', text)
+
+    def test_queries_are_still_captured(self):
+        # Counting queries in the middleware does not hide them from CaptureQueriesContext
+        with CaptureQueriesContext(connection) as stored:
+            self.search()
+        with CaptureQueriesContext(connection) as cached:
+            self.search()
+
+        self.assertGreater(len(stored), 0)
+        self.assertEqual(len(cached), 0)
+
+    def test_queries_are_not_logged(self):
+        # Outside DEBUG the queries are timed without the debug cursor, which formats and keeps every query
+        with mock.patch.object(connection, 'make_debug_cursor', wraps=connection.make_debug_cursor) as debug_cursor:
+            timing = self.search()['Server-Timing']
+
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertFalse(debug_cursor.called)
+        self.assertNotIn('cursor', connection.__dict__)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        self.assertFalse(self.search().has_header('Server-Timing'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
@@ -0,0 +1,76 @@
+import time
+
+from django.shortcuts import reverse
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from py_yr.config.settings import FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY
+
+from api.helper import save_weather_data
+from api.models import SearchCount
+from api.popularity import RequestCounter, request_counter, most_requested, current_hour
+from api.tests.fixtures import fake_yr
+
+
+def counts() -> dict:
+    return {(row.search, row.forecast_type): row.count for row in SearchCount.objects.all()}
+
+
+class TestRequestCounter(TestCase):
+    def setUp(self):
+        self.bergen = 'norge/hordaland/bergen/bergen/'
+        self.oslo = 'norge/oslo/oslo/oslo/'
+        self.counter = RequestCounter()
+        self.addCleanup(self.counter.stop)
+
+    def test_searches_do_not_write(self):
+        with self.assertNumQueries(0):
+            self.counter.record(self.bergen, FORECAST_TYPE_STANDARD)
+            self.counter.record(self.bergen, FORECAST_TYPE_STANDARD)
+            self.counter.record(self.oslo, FORECAST_TYPE_HOURLY)
+
+        self.assertEqual(self.counter.flush(), 3)
+        self.assertEqual(counts(), {
+            (self.bergen, FORECAST_TYPE_STANDARD): 2,
+            (self.oslo, FORECAST_TYPE_HOURLY): 1
+        })
+
+    def test_flushes_add_up(self):
+        for _ in range(3):
+            self.counter.record(self.bergen, FORECAST_TYPE_STANDARD)
+            self.counter.flush()
+
+        self.assertEqual(SearchCount.objects.count(), 1)
+        self.assertEqual(counts(), {(self.bergen, FORECAST_TYPE_STANDARD): 3})
+
+    def test_most_requested(self):
+        self.counter.record(self.bergen, FORECAST_TYPE_STANDARD)
+        for _ in range(2):
+            self.counter.record(self.oslo, FORECAST_TYPE_STANDARD)
+        self.counter.flush()
+
+        ranked = most_requested(current_hour(), 1)
+        self.assertEqual(ranked, [{'search': self.oslo, 'forecast_type': FORECAST_TYPE_STANDARD, 'requests': 2}])
+
+    def test_searches_are_counted(self):
+        save_weather_data(fake_yr(self.bergen))
+        request_counter.clear()
+        client = Client()
+        for forecast_type in (FORECAST_TYPE_STANDARD, FORECAST_TYPE_STANDARD, 'invalid'):
+            client.get(reverse('search'), {'location': self.bergen[:-1], 'language': 'en',
+                                           'forecastType': forecast_type})
+        request_counter.flush()
+
+        # Invalid searches are not counted
+        self.assertEqual(counts(), {(self.bergen, FORECAST_TYPE_STANDARD): 2})
+
+
+@override_settings(POPULARITY_FLUSH_SECONDS=0.05)
+class TestRequestCounterThread(TransactionTestCase):
+    def test_writes_in_background(self):
+        counter = RequestCounter()
+        self.addCleanup(counter.stop, 5)
+        counter.record('norge/oslo/oslo/oslo/', FORECAST_TYPE_STANDARD)
+
+        deadline = time.monotonic() + 5
+        while not SearchCount.objects.exists() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(counts(), {('norge/oslo/oslo/oslo/', FORECAST_TYPE_STANDARD): 1})
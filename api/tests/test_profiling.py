@@ -0,0 +1,154 @@
+import cProfile
+import datetime
+import json
+import os
+import shutil
+import stat
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.shortcuts import reverse
+from django.test import SimpleTestCase, TestCase, Client, RequestFactory, override_settings
+from py_yr.config.settings import FORECAST_TYPE_STANDARD
+
+from api.cache import response_cache
+from api.helper import save_weather_data
+from api.profiling import should_profile, profile_call, save_profile, stored_profiles
+from api.tests.fixtures import fake_yr
+
+
+class FixedRandom:
+    def __init__(self, value):
+        self.value = value
+
+    def random(self):
+        return self.value
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=0.1, PROFILING_VIEWS=['search'],
+                   PROFILING_SECRET='secret')
+class TestShouldProfile(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_sample_rate(self):
+        request = self.factory.get('/api/search')
+        self.assertTrue(should_profile(request, 'search', FixedRandom(0.05)))
+        self.assertFalse(should_profile(request, 'search', FixedRandom(0.5)))
+        self.assertFalse(should_profile(request, 'metrics', FixedRandom(0.05)))
+
+    def test_secret_header(self):
+        self.assertTrue(should_profile(self.factory.get('/api/metrics', HTTP_X_PROFILE='secret'), 'metrics',
+                                       FixedRandom(1)))
+        self.assertFalse(should_profile(self.factory.get('/api/search', HTTP_X_PROFILE='guess'), 'search',
+                                        FixedRandom(1)))
+
+    @override_settings(PROFILING_SECRET='')
+    def test_empty_secret_never_matches(self):
+        self.assertFalse(should_profile(self.factory.get('/api/search', HTTP_X_PROFILE=''), 'search', FixedRandom(1)))
+
+    @override_settings(PROFILING_ENABLED=False)
+    def test_disabled(self):
+        request = self.factory.get('/api/search', HTTP_X_PROFILE='secret')
+        self.assertFalse(should_profile(request, 'search', FixedRandom(0)))
+
+
+class TestSaveProfile(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    @override_settings(PROFILING_MAX_PROFILES=3)
+    def test_keeps_the_newest(self):
+        paths = []
+        for i in range(5):
+            _, profile, _ = profile_call(sum, range(10))
+            paths.append(save_profile(profile, {'seconds': i}, self.directory))
+
+        stored = stored_profiles(self.directory)
+        self.assertEqual(len(stored), 3)
+        self.assertEqual(len(os.listdir(self.directory)), 6)
+        self.assertNotIn(paths[0], stored)
+        self.assertIn(paths[-1], stored)
+
+    def test_private_directory_and_utc_names(self):
+        directory = os.path.join(self.directory, 'profiles')
+        _, profile, _ = profile_call(sum, range(10))
+        path = save_profile(profile, {}, directory)
+
+        self.assertEqual(stat.S_IMODE(os.stat(directory).st_mode), 0o700)
+        written = datetime.datetime.strptime(os.path.basename(path)[:15], '%Y%m%dT%H%M%S')
+        self.assertLess(abs(written - datetime.datetime.utcnow()), datetime.timedelta(minutes=1))
+
+    def test_profile_call(self):
+        result, profile, seconds = profile_call(sorted, [3, 1, 2])
+        self.assertEqual(result, [1, 2, 3])
+        self.assertIsInstance(profile, cProfile.Profile)
+        self.assertGreaterEqual(seconds, 0)
+
+
+class TestProfilingMiddleware(TestCase):
+    def setUp(self):
+        self.location = 'norge/hordaland/bergen/bergen'
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.client = Client()
+        response_cache.clear()
+        save_weather_data(fake_yr(self.location + '/'))
+
+    def search(self, **extra):
+        return self.client.get(reverse('search'), {
+            'location': self.location,
+            'language': 'en',
+            'forecastType': FORECAST_TYPE_STANDARD
+        }, **extra)
+
+    def test_stores_profile_with_request(self):
+        with self.settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1, PROFILING_DIRECTORY=self.directory):
+            response = self.search()
+
+        self.assertEqual(response.status_code, 200)
+        stored = stored_profiles(self.directory)
+        self.assertEqual(len(stored), 1)
+        self.assertEqual(os.path.basename(stored[0]), response['X-Profile'])
+        with open(stored[0] + '.json') as f:
+            info = json.load(f)
+        self.assertEqual(info['view'], 'search')
+        self.assertEqual(info['params']['location'], self.location)
+        self.assertEqual(info['cache'], 'stored')
+        self.assertIn('serialize', info['phases'])
+        self.assertGreater(info['queries'], 0)
+
+    def test_secret_header(self):
+        with self.settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=0, PROFILING_SECRET='secret',
+                           PROFILING_DIRECTORY=self.directory):
+            self.assertFalse(self.search().has_header('X-Profile'))
+            self.assertTrue(self.search(HTTP_X_PROFILE='secret').has_header('X-Profile'))
+        self.assertEqual(len(stored_profiles(self.directory)), 1)
+
+    def test_disabled(self):
+        with self.settings(PROFILING_ENABLED=False, PROFILING_DIRECTORY=self.directory):
+            self.assertFalse(self.search().has_header('X-Profile'))
+        self.assertEqual(stored_profiles(self.directory), [])
+
+    def test_summarize_profiles(self):
+        with self.settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1, PROFILING_DIRECTORY=self.directory):
+            self.search()
+            self.search()
+
+        out = StringIO()
+        call_command('summarize_profiles', '--directory', self.directory, '--limit', '5', stdout=out)
+        output = out.getvalue()
+        self.assertIn('Profiles: 2', output)
+        self.assertIn('Cache: ', output)
+        self.assertIn('stored 1', output)
+        self.assertIn('hit 1', output)
+        self.assertIn('function calls', output)
+
+    def test_summarize_refuses_directory_of_another_user(self):
+        with mock.patch('os.getuid', return_value=os.getuid() + 1):
+            self.assertRaises(CommandError, call_command, 'summarize_profiles', '--directory', self.directory,
+                              stdout=StringIO())
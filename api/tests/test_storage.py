@@ -0,0 +1,73 @@
+import datetime
+import json
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.shortcuts import reverse
+from django.test import TestCase, Client, override_settings
+from py_yr.config.settings import FORECAST_TYPE_HOURLY
+
+from api.cache import response_cache
+from api.helper import save_weather_data
+from api.models import Forecast, Time, Precipitation
+from api.storage import pack_periods, unpack_periods, read_periods, STORAGE_COMPACT
+from api.tests.fixtures import fake_yr
+
+
+class TestCompactStorage(TestCase):
+    def setUp(self):
+        self.start = datetime.datetime(2017, 1, 2, 13, 0)
+        self.search = 'norge/hordaland/bergen/bergen/'
+
+    def save(self, search=None):
+        return save_weather_data(fake_yr(search or self.search, 'en', FORECAST_TYPE_HOURLY, start=self.start))[0]
+
+    def test_round_trip_matches_relational_rows(self):
+        forecast = self.save()
+        relational = [time.to_dict() for time in Time.objects.for_forecast(forecast)]
+
+        compact = unpack_periods(pack_periods(list(Time.objects.for_forecast(forecast))))
+
+        self.assertEqual(compact, relational)
+        self.assertEqual(json.dumps(compact, cls=DjangoJSONEncoder), json.dumps(relational, cls=DjangoJSONEncoder))
+
+    @override_settings(FORECAST_STORAGE=STORAGE_COMPACT)
+    def test_save_compact(self):
+        forecast = self.save()
+
+        self.assertIsNotNone(forecast.periods)
+        self.assertEqual(Time.objects.count(), 0)
+        self.assertEqual(Precipitation.objects.count(), 0)
+
+    def test_read_periods_is_identical_for_both_layouts(self):
+        relational = read_periods(self.save())
+        with self.settings(FORECAST_STORAGE=STORAGE_COMPACT):
+            compact = read_periods(Forecast.objects.get(pk=self.save('norge/oslo/oslo/oslo/').pk))
+
+        self.assertEqual(json.dumps(compact, cls=DjangoJSONEncoder), json.dumps(relational, cls=DjangoJSONEncoder))
+
+    @override_settings(FORECAST_STORAGE=STORAGE_COMPACT)
+    def test_cached_compact_search_is_one_query(self):
+        response_cache.clear()
+        self.save()
+
+        with self.assertNumQueries(1):
+            response = Client().get(reverse('search'), {
+                'location': self.search[:-1],
+                'language': 'en',
+                'forecastType': FORECAST_TYPE_HOURLY
+            })
+        data = json.loads(str(response.content, encoding='utf8'))
+        self.assertEqual(sum(len(day['forecast']) for day in data['data']['forecasts']), 48)
+
+    def test_compact_forecasts_command(self):
+        forecast = self.save()
+        relational = read_periods(forecast)
+
+        call_command('compact_forecasts', stdout=StringIO())
+
+        forecast.refresh_from_db()
+        self.assertEqual(read_periods(forecast), relational)
+        self.assertEqual(Time.objects.count(), 0)
+        self.assertEqual(Precipitation.objects.count(), 0)
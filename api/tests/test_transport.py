@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase, override_settings
+from py_yr.config.settings import FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY
+
+from api.transport import Transport, UpstreamError, download, forecast_url
+from benchmarks.fake_yr import FakeYr, recorded
+
+TROMSO = '<?xml version="1.0" encoding="utf-8"?>\n<weatherdata><location><name>Tromsø</name></location></weatherdata>'
+
+
+class TestTransport(SimpleTestCase):
+    def setUp(self):
+        self.upstream = FakeYr().start()
+        self.addCleanup(self.upstream.stop)
+        self.url = self.upstream.url + '/place/norge/forecast.xml'
+        self.sleeps = []
+        self.transport = Transport(pool_size=2, connect_timeout=1, read_timeout=1, retries=2, backoff=0.1,
+                                   sleep=self.sleeps.append)
+
+    def test_connections_are_reused(self):
+        for _ in range(3):
+            self.assertEqual(self.transport.get(self.url).content, recorded('forecast.xml'))
+
+        stats = self.transport.stats()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['reused'], 2)
+
+    def test_gateway_errors_are_retried(self):
+        self.upstream.statuses = [503, 502]
+
+        self.assertEqual(self.transport.get(self.url).status_code, 200)
+        self.assertEqual(self.transport.stats()['retries'], 2)
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertTrue(0 <= self.sleeps[1] <= 0.2)
+
+    def test_gives_up(self):
+        self.upstream.statuses = [503, 503, 503]
+
+        with self.assertRaises(UpstreamError):
+            self.transport.get(self.url)
+        self.assertEqual(self.transport.stats()['failures'], 1)
+
+    def test_other_errors_are_not_retried(self):
+        self.upstream.statuses = [404]
+
+        self.assertEqual(self.transport.get(self.url).status_code, 404)
+        self.assertEqual(self.transport.stats()['retries'], 0)
+
+    def test_connection_errors(self):
+        self.upstream.stop()
+
+        with self.assertRaises(UpstreamError):
+            self.transport.get(self.url)
+        self.assertEqual(self.transport.stats()['requests'], 3)
+
+
+class TestDownload(SimpleTestCase):
+    def download(self, content_type):
+        yr = SimpleNamespace(location='norge/troms/tromsø/tromsø/', language='nb',
+                             forecast_type=FORECAST_TYPE_STANDARD, source_data=None)
+        with FakeYr(documents={'forecast.xml': TROMSO.encode('utf-8')}, content_type=content_type) as upstream, \
+                override_settings(UPSTREAM_BASE_URL=upstream.url + '/'):
+            download(yr)
+        return yr.source_data
+
+    def test_document_without_charset_is_decoded_as_declared(self):
+        # Like yr.no, which sends text/xml without a charset
+        self.assertEqual(self.download('text/xml'), TROMSO)
+
+    def test_charset_of_the_response(self):
+        self.assertEqual(self.download('text/xml; charset=utf-8'), TROMSO)
+
+
+@override_settings(UPSTREAM_BASE_URL='https://www.yr.no/')
+class TestForecastUrl(SimpleTestCase):
+    def test_standard(self):
+        self.assertEqual(forecast_url('norge/hordaland/bergen/bergen/', 'nb', FORECAST_TYPE_STANDARD),
+                         'https://www.yr.no/sted/norge/hordaland/bergen/bergen/forecast.xml')
+
+    def test_hourly(self):
+        self.assertEqual(forecast_url('norge/troms/tromsø/tromsø/', 'en', FORECAST_TYPE_HOURLY),
+                         'https://www.yr.no/place/norge/troms/troms%C3%B8/troms%C3%B8/forecast_hour_by_hour.xml')
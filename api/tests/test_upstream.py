@@ -0,0 +1,212 @@
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from py_yr.config.settings import FORECAST_TYPE_STANDARD
+
+from api.cache import negative_cache
+from api.helper import save_weather_data
+from api.tests.fixtures import fake_yr
+from api.transport import UpstreamError
+from api.tests.test_cache import FakeClock
+from api.upstream import SingleFlight, FlightTimeout, refresh_forecast, refresh_in_background, CircuitBreaker, \
+    CircuitOpen, UpstreamBusy
+
+
+class TestSingleFlight(SimpleTestCase):
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def slow_download(self):
+        self.calls += 1
+        self.release.wait(5)
+        return 'forecast'
+
+    def start_leader(self, func):
+        def lead():
+            try:
+                self.flight.do('bergen', func)
+            except ValueError:
+                pass
+
+        leader = threading.Thread(target=lead)
+        leader.start()
+        while not self.flight.in_flight('bergen'):
+            pass
+        return leader
+
+    def test_concurrent_calls_share_one_result(self):
+        leader = self.start_leader(self.slow_download)
+        results = []
+        followers = [threading.Thread(target=lambda: results.append(self.flight.do('bergen', self.slow_download, 5)))
+                     for _ in range(5)]
+        for follower in followers:
+            follower.start()
+        while self.flight.coalesced < 5:
+            pass
+        self.release.set()
+        for thread in [leader] + followers:
+            thread.join()
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, ['forecast'] * 5)
+        self.assertFalse(self.flight.in_flight('bergen'))
+
+    def test_waiting_times_out(self):
+        leader = self.start_leader(self.slow_download)
+        self.assertRaises(FlightTimeout, self.flight.do, 'bergen', self.slow_download, 0.01)
+        self.release.set()
+        leader.join()
+
+    def test_error_is_shared(self):
+        def failing_download():
+            self.release.wait(5)
+            raise ValueError('upstream failed')
+
+        leader = self.start_leader(failing_download)
+        errors = []
+
+        def follow():
+            try:
+                self.flight.do('bergen', failing_download, 5)
+            except ValueError as e:
+                errors.append(e)
+
+        follower = threading.Thread(target=follow)
+        follower.start()
+        while self.flight.coalesced < 1:
+            pass
+        self.release.set()
+        leader.join()
+        follower.join()
+        self.assertEqual(len(errors), 1)
+
+    def test_different_keys_run_separately(self):
+        self.assertEqual(self.flight.do('bergen', lambda: 'bergen'), 'bergen')
+        self.assertEqual(self.flight.do('oslo', lambda: 'oslo'), 'oslo')
+
+
+@mock.patch('api.upstream.download')
+@mock.patch('api.upstream.Yr', side_effect=lambda search, language, forecast_type: SimpleNamespace(
+    location=search, language=language, forecast_type=forecast_type, source_data=None))
+class TestNegativeCaching(TestCase):
+    def setUp(self):
+        self.search = 'norge/hordaland/bergn/bergn/'
+        negative_cache.clear()
+
+    def test_unknown_location_is_downloaded_once(self, yr, download):
+        self.assertIsNone(refresh_forecast(self.search, 'en', FORECAST_TYPE_STANDARD))
+        self.assertIsNone(refresh_forecast(self.search, 'en', FORECAST_TYPE_STANDARD))
+
+        self.assertEqual(yr.call_count, 1)
+        self.assertEqual(download.call_count, 1)
+
+    def test_upstream_error_is_remembered(self, yr, download):
+        download.side_effect = UpstreamError('yr.no returned 503')
+
+        self.assertRaises(UpstreamError, refresh_forecast, self.search, 'en', FORECAST_TYPE_STANDARD)
+        self.assertRaises(UpstreamError, refresh_forecast, self.search, 'en', FORECAST_TYPE_STANDARD)
+        self.assertEqual(download.call_count, 1)
+        self.assertFalse(refresh_in_background(self.search, 'en', FORECAST_TYPE_STANDARD))
+
+    def test_forced_refresh_downloads(self, yr, download):
+        refresh_forecast(self.search, 'en', FORECAST_TYPE_STANDARD)
+        refresh_forecast(self.search, 'en', FORECAST_TYPE_STANDARD, force=True)
+        self.assertEqual(download.call_count, 2)
+
+    def test_saved_forecast_clears_failure(self, yr, download):
+        refresh_forecast(self.search, 'en', FORECAST_TYPE_STANDARD)
+        self.assertIsNotNone(negative_cache.get((self.search, 'en', FORECAST_TYPE_STANDARD)))
+
+        save_weather_data(fake_yr(self.search, 'en', FORECAST_TYPE_STANDARD))
+        self.assertIsNone(negative_cache.get((self.search, 'en', FORECAST_TYPE_STANDARD)))
+
+
+class TestCircuitBreaker(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(failure_threshold=3, slow_seconds=5, reset_seconds=30, clock=self.clock)
+
+    def fail(self, times=1):
+        for _ in range(times):
+            call = self.breaker.allow()
+            self.assertIsNotNone(call)
+            self.breaker.record(call, False, 0.1)
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail(2)
+        self.breaker.record(self.breaker.allow(), True, 0.1)
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.fail()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertIsNone(self.breaker.allow())
+        self.assertEqual(self.breaker.stats()['rejected'], 1)
+
+    def test_slow_calls_count_as_failures(self):
+        for _ in range(3):
+            self.breaker.record(self.breaker.allow(), True, 6)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_half_open_trial_closes(self):
+        self.fail(3)
+        self.clock.now = 30
+
+        trial = self.breaker.allow()
+        self.assertIsNotNone(trial)
+        # Only one trial at a time
+        self.assertIsNone(self.breaker.allow())
+        self.breaker.record(trial, True, 0.1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertIsNotNone(self.breaker.allow())
+
+    def test_failed_trial_opens_again(self):
+        self.fail(3)
+        self.clock.now = 30
+        self.fail()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.clock.now = 59
+        self.assertIsNone(self.breaker.allow())
+        self.assertEqual(self.breaker.stats()['opened'], 2)
+
+    def test_calls_from_before_the_trial_do_not_end_it(self):
+        slow = self.breaker.allow()
+        self.fail(3)
+        self.clock.now = 30
+        trial = self.breaker.allow()
+
+        # A download started before the circuit opened fails while the trial is running
+        self.breaker.record(slow, False, 40)
+        self.clock.now = 90
+        # The trial has not finished, so no second one goes through
+        self.assertIsNone(self.breaker.allow())
+        self.breaker.record(trial, True, 0.1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+
+@mock.patch('api.upstream.download')
+class TestLoadShedding(TestCase):
+    def setUp(self):
+        self.search = 'norge/hordaland/bergen/bergen/'
+        negative_cache.clear()
+
+    def test_open_circuit_does_not_download(self, download):
+        breaker = CircuitBreaker(failure_threshold=1, slow_seconds=5, reset_seconds=30)
+        breaker.record(breaker.allow(), False, 0)
+        with mock.patch('api.upstream.breaker', breaker):
+            self.assertRaises(CircuitOpen, refresh_forecast, self.search, 'en', FORECAST_TYPE_STANDARD)
+        self.assertFalse(download.called)
+        # Rejected downloads are not failures of the search
+        self.assertIsNone(negative_cache.get((self.search, 'en', FORECAST_TYPE_STANDARD)))
+
+    def test_downloads_beyond_the_cap_are_refused(self, download):
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        with mock.patch('api.upstream.download_slots', slots):
+            self.assertRaises(UpstreamBusy, refresh_forecast, self.search, 'en', FORECAST_TYPE_STANDARD)
+        self.assertFalse(download.called)
@@ -1,14 +1,25 @@
+import datetime
+import gzip
 import json
+import threading
+import unittest
+from unittest import mock
 
 from django.test import Client
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils.translation import activate
 
 from django.shortcuts import reverse
 
-from py_yr.config.settings import FORECAST_TYPE_STANDARD
+from py_yr.config.settings import FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY
 
-from api.helper import is_valid_location
+from api import encoding
+from api.cache import response_cache
+from api.helper import is_valid_location, save_weather_data
+from api.models import Forecast
+from api.popularity import request_counter
+from api.tests.fixtures import fake_yr
+from api.upstream import CircuitOpen, UpstreamBusy
 
 
 class TestView(TestCase):
@@ -92,3 +103,375 @@ class TestView(TestCase):
         self.assertIsNone(data['data']['meta'])
         self.assertIsNone(data['data']['forecasts'])
         self.assertFalse(data['success'])
+
+
+class TestCachedView(TestCase):
+    def setUp(self):
+        self.location = 'norge/hordaland/bergen/bergen'
+        self.language = 'en'
+        self.client = Client()
+        response_cache.clear()
+        request_counter.clear()
+
+    def search(self, forecast_type):
+        return self.client.get(reverse('search'), {
+            'location': self.location,
+            'language': self.language,
+            'forecastType': forecast_type
+        })
+
+    def test_cached_standard_search_query_count(self):
+        save_weather_data(fake_yr(self.location + '/', self.language, FORECAST_TYPE_STANDARD))
+
+        # The forecast with its location, credit and sun, then every period with its values
+        with self.assertNumQueries(2):
+            response = self.search(FORECAST_TYPE_STANDARD)
+
+        data = json.loads(str(response.content, encoding='utf8'))
+        self.assertTrue(data['success'])
+        self.assertTrue(data['data']['forecasts'])
+
+    def test_cached_hourly_search_query_count(self):
+        save_weather_data(fake_yr(self.location + '/', self.language, FORECAST_TYPE_HOURLY))
+
+        with self.assertNumQueries(2):
+            response = self.search(FORECAST_TYPE_HOURLY)
+
+        data = json.loads(str(response.content, encoding='utf8'))
+        self.assertTrue(data['success'])
+        self.assertEqual(sum(len(day['forecast']) for day in data['data']['forecasts']), 48)
+
+    def test_repeated_search_is_served_from_memory(self):
+        save_weather_data(fake_yr(self.location + '/', self.language, FORECAST_TYPE_STANDARD))
+        first = self.search(FORECAST_TYPE_STANDARD)
+
+        with self.assertNumQueries(0):
+            second = self.search(FORECAST_TYPE_STANDARD)
+        self.assertEqual(first.content, second.content)
+
+    def test_summaries_are_cached_separately(self):
+        save_weather_data(fake_yr(self.location + '/', self.language, FORECAST_TYPE_STANDARD))
+        plain = self.search(FORECAST_TYPE_STANDARD)
+        summarized = self.client.get(reverse('search'), {
+            'location': self.location,
+            'language': self.language,
+            'forecastType': FORECAST_TYPE_STANDARD,
+            'summary': 'true'
+        })
+
+        days = json.loads(str(summarized.content, encoding='utf8'))['data']['forecasts']
+        self.assertTrue(all('summary' in day for day in days))
+        self.assertNotEqual(summarized['ETag'], plain['ETag'])
+        self.assertNotIn(b'summary', self.search(FORECAST_TYPE_STANDARD).content)
+
+    def test_saving_invalidates_cached_response(self):
+        save_weather_data(fake_yr(self.location + '/', self.language, FORECAST_TYPE_STANDARD))
+        self.search(FORECAST_TYPE_STANDARD)
+        save_weather_data(fake_yr(self.location + '/', self.language, FORECAST_TYPE_STANDARD))
+
+        with self.assertNumQueries(2):
+            self.search(FORECAST_TYPE_STANDARD)
+
+
+class TestConditionalView(TestCase):
+    def setUp(self):
+        self.location = 'norge/hordaland/bergen/bergen'
+        self.client = Client()
+        response_cache.clear()
+        request_counter.clear()
+        save_weather_data(fake_yr(self.location + '/', 'en', FORECAST_TYPE_STANDARD))
+
+    def search(self, **headers):
+        return self.client.get(reverse('search'), {
+            'location': self.location,
+            'language': 'en',
+            'forecastType': FORECAST_TYPE_STANDARD
+        }, **headers)
+
+    def test_validators(self):
+        response = self.search()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.assertIn('max-age=', response['Cache-Control'])
+
+    def test_if_none_match(self):
+        etag = self.search()['ETag']
+
+        response = self.search(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+    def test_if_modified_since(self):
+        last_modified = self.search()['Last-Modified']
+
+        response = self.search(HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_changed_etag(self):
+        response = self.search(HTTP_IF_NONE_MATCH='"0-0"')
+        self.assertEqual(response.status_code, 200)
+
+    @unittest.skipIf(encoding.orjson is None, 'orjson is not installed')
+    def test_etag_names_the_serializer(self):
+        with override_settings(RESPONSE_JSON_ENCODER='auto'):
+            orjson_etag = self.search()['ETag']
+        response_cache.clear()
+        with override_settings(RESPONSE_JSON_ENCODER='django'):
+            response = self.search(HTTP_IF_NONE_MATCH=orjson_etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], orjson_etag)
+
+    def test_not_modified_skips_periods(self):
+        etag = self.search()['ETag']
+        response_cache.clear()
+
+        # Only the forecast is looked up, its periods are never read
+        with self.assertNumQueries(1):
+            response = self.search(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(RESPONSE_ENCODINGS=['gzip'])
+    def test_gzip_variant(self):
+        plain = self.search()
+        response = self.search(HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertNotEqual(response['ETag'], plain['ETag'])
+
+        not_modified = self.search(HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_invalid_search_has_no_validators(self):
+        response = self.client.get(reverse('search'), {
+            'location': self.location,
+            'language': 'xx',
+            'forecastType': FORECAST_TYPE_STANDARD
+        })
+        self.assertFalse(response.has_header('ETag'))
+
+
+class TestBatchView(TestCase):
+    def setUp(self):
+        self.bergen = 'norge/hordaland/bergen/bergen'
+        self.oslo = 'norge/oslo/oslo/oslo'
+        self.client = Client()
+        response_cache.clear()
+        request_counter.clear()
+
+    def search(self, locations, forecast_type=FORECAST_TYPE_STANDARD):
+        response = self.client.get(reverse('search_batch'), {
+            'location': locations,
+            'language': 'en',
+            'forecastType': forecast_type
+        })
+        return json.loads(str(response.content, encoding='utf8'))
+
+    def test_stored_forecasts(self):
+        save_weather_data(fake_yr(self.bergen + '/', 'en', FORECAST_TYPE_STANDARD))
+        save_weather_data(fake_yr(self.oslo + '/', 'en', FORECAST_TYPE_STANDARD))
+
+        # One query for the forecasts and one for all their periods
+        with self.assertNumQueries(2):
+            data = self.search([self.oslo, self.bergen])
+
+        self.assertTrue(data['success'])
+        results = data['data']['results']
+        self.assertEqual([result['location'] for result in results], [self.oslo, self.bergen])
+        self.assertTrue(all(result['response']['success'] for result in results))
+        self.assertEqual(results[0]['response']['data']['meta']['search'], self.oslo + '/')
+
+    def test_matches_search(self):
+        save_weather_data(fake_yr(self.bergen + '/', 'en', FORECAST_TYPE_HOURLY))
+        single = self.client.get(reverse('search'), {
+            'location': self.bergen,
+            'language': 'en',
+            'forecastType': FORECAST_TYPE_HOURLY
+        })
+
+        data = self.search([self.bergen], FORECAST_TYPE_HOURLY)
+        self.assertEqual(data['data']['results'][0]['response'], json.loads(str(single.content, encoding='utf8')))
+
+    def test_cached_responses(self):
+        save_weather_data(fake_yr(self.bergen + '/', 'en', FORECAST_TYPE_STANDARD))
+        self.search([self.bergen])
+
+        with self.assertNumQueries(0):
+            data = self.search([self.bergen])
+        self.assertTrue(data['data']['results'][0]['response']['success'])
+
+    @mock.patch('api.views.refresh_in_background')
+    def test_stale_forecasts_are_not_compressed(self, refresh_in_background):
+        forecast, _ = save_weather_data(fake_yr(self.bergen + '/', 'en', FORECAST_TYPE_STANDARD))
+        Forecast.objects.filter(pk=forecast.pk).update(
+            expires_at=datetime.datetime.now() - datetime.timedelta(minutes=5))
+
+        with override_settings(FORECAST_STALE_WHILE_REVALIDATE=True, FORECAST_MAX_STALE_MINUTES=60), \
+                mock.patch('api.encoding.compress', wraps=encoding.compress) as compress:
+            data = self.search([self.bergen])
+        self.assertTrue(data['data']['results'][0]['response']['data']['meta']['stale'])
+        self.assertFalse(compress.called)
+
+    @mock.patch('api.views.refresh_forecast')
+    def test_invalid_location(self, refresh_forecast):
+        save_weather_data(fake_yr(self.bergen + '/', 'en', FORECAST_TYPE_STANDARD))
+
+        data = self.search([self.bergen, 'norge'])
+        results = data['data']['results']
+        self.assertTrue(results[0]['response']['success'])
+        self.assertFalse(results[1]['response']['success'])
+        self.assertFalse(refresh_forecast.called)
+
+    @mock.patch('api.views.refresh_forecast')
+    def test_missing_forecasts_are_downloaded_concurrently(self, refresh_forecast):
+        locations = ['norge/oslo/oslo/oslo', 'norge/rogaland/stavanger/stavanger', 'norge/troms/tromsø/tromsø']
+        # Every download waits until all of them have started
+        started = threading.Barrier(len(locations), timeout=5)
+
+        def download(search, language, forecast_type):
+            started.wait()
+            return None
+        refresh_forecast.side_effect = download
+
+        data = self.search(locations)
+        self.assertEqual(refresh_forecast.call_count, 3)
+        self.assertFalse(any(result['response']['success'] for result in data['data']['results']))
+
+    @override_settings(SEARCH_BATCH_MAX_LOCATIONS=1)
+    def test_too_many_locations(self):
+        data = self.search([self.bergen, self.oslo])
+        self.assertFalse(data['success'])
+        self.assertEqual(data['message'], 'At most 1 locations can be searched at once')
+
+    def test_no_locations(self):
+        data = self.search([])
+        self.assertFalse(data['success'])
+
+
+@override_settings(FORECAST_STALE_WHILE_REVALIDATE=True, FORECAST_MAX_STALE_MINUTES=60)
+class TestStaleWhileRevalidate(TestCase):
+    def setUp(self):
+        self.location = 'norge/hordaland/bergen/bergen'
+        self.client = Client()
+        response_cache.clear()
+        request_counter.clear()
+        self.forecast, _ = save_weather_data(fake_yr(self.location + '/', 'en', FORECAST_TYPE_STANDARD))
+
+    def expire(self, minutes):
+        Forecast.objects.filter(pk=self.forecast.pk).update(
+            expires_at=datetime.datetime.now() - datetime.timedelta(minutes=minutes))
+
+    def search(self):
+        response = self.client.get(reverse('search'), {
+            'location': self.location,
+            'language': 'en',
+            'forecastType': FORECAST_TYPE_STANDARD
+        })
+        return json.loads(str(response.content, encoding='utf8'))
+
+    @mock.patch('api.views.refresh_in_background')
+    @mock.patch('api.views.refresh_forecast')
+    def test_fresh_forecast_is_not_stale(self, refresh_forecast, refresh_in_background):
+        data = self.search()
+        self.assertFalse(data['data']['meta']['stale'])
+        refresh_forecast.assert_not_called()
+        refresh_in_background.assert_not_called()
+
+    @mock.patch('api.views.refresh_in_background')
+    @mock.patch('api.views.refresh_forecast')
+    def test_stale_forecast_is_served_and_refreshed(self, refresh_forecast, refresh_in_background):
+        self.expire(minutes=5)
+        data = self.search()
+
+        self.assertTrue(data['success'])
+        self.assertTrue(data['data']['meta']['stale'])
+        refresh_forecast.assert_not_called()
+        refresh_in_background.assert_called_once_with(self.location + '/', 'en', FORECAST_TYPE_STANDARD)
+
+    @override_settings(RESPONSE_ENCODINGS=['gzip'])
+    @mock.patch('api.views.refresh_in_background')
+    def test_stale_forecast_is_compressed_only_as_sent(self, refresh_in_background):
+        self.expire(minutes=5)
+        params = {'location': self.location, 'language': 'en', 'forecastType': FORECAST_TYPE_STANDARD}
+
+        with mock.patch('api.encoding.compress', wraps=encoding.compress) as compress:
+            self.client.get(reverse('search'), params)
+            self.assertFalse(compress.called)
+
+            response = self.client.get(reverse('search'), params, HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(compress.call_count, 1)
+
+    @mock.patch('api.views.refresh_in_background')
+    def test_not_modified_stale_forecast_is_refreshed(self, refresh_in_background):
+        params = {'location': self.location, 'language': 'en', 'forecastType': FORECAST_TYPE_STANDARD}
+        fresh_etag = self.client.get(reverse('search'), params)['ETag']
+        self.expire(minutes=5)
+        response_cache.clear()
+
+        # The body now says stale, so the client's copy is out of date
+        stale = self.client.get(reverse('search'), params, HTTP_IF_NONE_MATCH=fresh_etag)
+        self.assertEqual(stale.status_code, 200)
+        self.assertNotEqual(stale['ETag'], fresh_etag)
+
+        refresh_in_background.reset_mock()
+        not_modified = self.client.get(reverse('search'), params, HTTP_IF_NONE_MATCH=stale['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        refresh_in_background.assert_called_once_with(self.location + '/', 'en', FORECAST_TYPE_STANDARD)
+
+    @mock.patch('api.views.refresh_in_background')
+    @mock.patch('api.views.refresh_forecast', return_value=None)
+    def test_too_stale_forecast_blocks_on_download(self, refresh_forecast, refresh_in_background):
+        self.expire(minutes=61)
+        data = self.search()
+
+        self.assertFalse(data['success'])
+        refresh_forecast.assert_called_once_with(self.location + '/', 'en', FORECAST_TYPE_STANDARD)
+        refresh_in_background.assert_not_called()
+
+    @override_settings(FORECAST_STALE_WHILE_REVALIDATE=False)
+    @mock.patch('api.views.refresh_in_background')
+    @mock.patch('api.views.refresh_forecast', return_value=None)
+    def test_disabled(self, refresh_forecast, refresh_in_background):
+        self.expire(minutes=5)
+        self.search()
+
+        refresh_forecast.assert_called_once_with(self.location + '/', 'en', FORECAST_TYPE_STANDARD)
+        refresh_in_background.assert_not_called()
+
+
+class TestUpstreamFailure(TestCase):
+    def setUp(self):
+        self.location = 'norge/hordaland/bergen/bergen'
+        self.client = Client()
+        response_cache.clear()
+        request_counter.clear()
+
+    def search(self):
+        response = self.client.get(reverse('search'), {
+            'location': self.location,
+            'language': 'en',
+            'forecastType': FORECAST_TYPE_STANDARD
+        })
+        return json.loads(str(response.content, encoding='utf8'))
+
+    @mock.patch('api.views.refresh_forecast', side_effect=CircuitOpen('yr.no is failing'))
+    def test_last_stored_forecast_is_served(self, refresh_forecast):
+        forecast, _ = save_weather_data(fake_yr(self.location + '/', 'en', FORECAST_TYPE_STANDARD))
+        Forecast.objects.filter(pk=forecast.pk).update(
+            expires_at=datetime.datetime.now() - datetime.timedelta(days=1))
+
+        data = self.search()
+        self.assertTrue(data['success'])
+        self.assertTrue(data['data']['meta']['stale'])
+        self.assertTrue(refresh_forecast.called)
+
+    @mock.patch('api.views.refresh_forecast', side_effect=UpstreamBusy('too many downloads'))
+    def test_nothing_stored(self, refresh_forecast):
+        data = self.search()
+        self.assertFalse(data['success'])
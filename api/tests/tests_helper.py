@@ -1,13 +1,18 @@
 import datetime
+from unittest import mock
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 # Create your tests here.
 from py_yr.config.settings import FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY
 
-from api.helper import is_valid_location, is_valid_language, is_valid_forecast_type, time_is_less_then_x_minutes_ago
+from api.helper import is_valid_location, is_valid_language, is_valid_forecast_type, time_is_less_then_x_minutes_ago, \
+    save_weather_data, forecast_expires_at, group_by_day
 from api.models import TimeZone, Location, Sun, Credit, Forecast, Precipitation, Pressure, Symbol, Temperature, \
     WindDirection, WindSpeed, Time
+from api.tests.fixtures import fake_yr, fake_period_dicts
 
 
 class TestHelperValidation(TestCase):
@@ -260,6 +265,70 @@ class TestHelperSaving(TestCase):
         self.assertFalse(len(times) is 0)
 
 
+class TestHelperBulkSave(TestCase):
+    def test_save_weather_data(self):
+        forecast, times = save_weather_data(fake_yr(forecast_type=FORECAST_TYPE_HOURLY, periods=48))
+
+        self.assertEqual(Forecast.objects.count(), 1)
+        self.assertEqual(len(times), 48)
+        for model in (Time, Precipitation, Pressure, Symbol, Temperature, WindDirection, WindSpeed):
+            self.assertEqual(model.objects.count(), 48)
+
+    def test_save_weather_data_wires_foreign_keys(self):
+        yr = fake_yr(periods=12)
+        save_weather_data(yr)
+
+        expected = {p.from_: p for p in yr.get_as_object().forecast.tabular.time}
+        for time in Time.objects.all():
+            period = expected[time.start]
+            self.assertEqual(time.temperature.value, period.temperature.value)
+            self.assertEqual(time.pressure.value, period.pressure.value)
+            self.assertEqual(float(time.wind_speed.mps), round(period.windSpeed.mps, 2))
+            self.assertEqual(time.symbol.var, period.symbol.var.split('/')[1].split('.')[0])
+
+    def test_save_weather_data_query_count_is_constant(self):
+        with CaptureQueriesContext(connection) as few:
+            save_weather_data(fake_yr(periods=2))
+        with CaptureQueriesContext(connection) as many:
+            save_weather_data(fake_yr(forecast_type=FORECAST_TYPE_HOURLY, periods=48))
+
+        self.assertEqual(len(few), len(many))
+
+    def test_save_weather_data_without_returned_ids_or_sqlite(self):
+        # Reading ids back is only safe under sqlite's database wide write lock, others save row by row
+        yr = fake_yr(periods=12)
+        with mock.patch.object(connection, 'vendor', 'mysql'):
+            forecast, times = save_weather_data(yr)
+
+        expected = {p.from_: p for p in yr.get_as_object().forecast.tabular.time}
+        self.assertEqual(Time.objects.count(), 12)
+        for time in Time.objects.all():
+            self.assertEqual(time.temperature.value, expected[time.start].temperature.value)
+            self.assertEqual(time.pressure.value, expected[time.start].pressure.value)
+
+
+class TestForecastFreshness(TestCase):
+    def setUp(self):
+        self.search = 'norge/hordaland/bergen/bergen/'
+        self.forecast, _ = save_weather_data(fake_yr(self.search, 'en', FORECAST_TYPE_STANDARD, periods=1))
+
+    def fresh(self):
+        return Forecast.objects.for_search(self.search, 'en', FORECAST_TYPE_STANDARD).fresh()
+
+    def test_saved_forecast_is_fresh(self):
+        self.assertGreater(self.forecast.expires_at, self.forecast.created)
+        self.assertEqual(self.fresh().latest('created'), self.forecast)
+
+    def test_expired_forecast_is_not_fresh(self):
+        Forecast.objects.filter(pk=self.forecast.pk).update(
+            expires_at=datetime.datetime.now() - datetime.timedelta(seconds=1))
+        self.assertRaises(Forecast.DoesNotExist, self.fresh().latest, 'created')
+
+    def test_forecast_expires_at(self):
+        created = datetime.datetime(2017, 1, 2, 12, 0)
+        self.assertEqual(forecast_expires_at(created), datetime.datetime(2017, 1, 2, 12, 10))
+
+
 class TestHelper(TestCase):
 
     def test_is_younger_then(self):
@@ -268,3 +337,45 @@ class TestHelper(TestCase):
         self.assertFalse(time_is_less_then_x_minutes_ago(datetime.datetime.now(), -10))
         self.assertFalse(time_is_less_then_x_minutes_ago(datetime.datetime.now(), None))
         self.assertFalse(time_is_less_then_x_minutes_ago(datetime.datetime.now(), ''))
+
+
+class TestGroupByDay(TestCase):
+    def setUp(self):
+        # A monday
+        self.start = datetime.datetime(2017, 1, 2, 0, 0)
+
+    def test_hourly(self):
+        periods = fake_period_dicts(self.start, 1, 240)
+        days = group_by_day(periods, 'en', FORECAST_TYPE_HOURLY)
+
+        self.assertEqual(len(days), 10)
+        self.assertEqual(days[0]['weekday'], 'Monday')
+        self.assertEqual(days[7]['weekday'], 'Monday')
+        self.assertTrue(all(len(day['forecast']) == 24 for day in days))
+        self.assertEqual(days[0]['forecast'][0], periods[0])
+
+    def test_newest_first(self):
+        periods = fake_period_dicts(self.start, 1, 48)
+        self.assertEqual(group_by_day(list(reversed(periods)), 'nb', FORECAST_TYPE_HOURLY),
+                         group_by_day(periods, 'nb', FORECAST_TYPE_HOURLY))
+
+    def test_standard_leaves_out_next_week(self):
+        periods = fake_period_dicts(self.start + datetime.timedelta(hours=12), 6, 36)
+        # The forecast type is compared by value, not identity
+        days = group_by_day(periods, 'en', ''.join(FORECAST_TYPE_STANDARD))
+
+        self.assertEqual([day['weekday'] for day in days],
+                         ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'])
+        self.assertEqual(len(days[0]['forecast']), 2)
+        self.assertTrue(all(len(day['forecast']) == 4 for day in days[1:]))
+
+    def test_summaries(self):
+        periods = fake_period_dicts(self.start, 6, 4)
+        summary = group_by_day(periods, 'en', FORECAST_TYPE_STANDARD, summaries=True)[0]['summary']
+
+        temperatures = [period['temperature']['value'] for period in periods]
+        self.assertEqual(summary['temperature']['min'], min(temperatures))
+        self.assertEqual(summary['temperature']['max'], max(temperatures))
+        self.assertAlmostEqual(summary['precipitation'], sum(period['precipitation']['value'] for period in periods))
+        self.assertEqual(summary['symbol']['number'], 3)
+        self.assertNotIn('summary', group_by_day(periods, 'en', FORECAST_TYPE_STANDARD)[0])
@@ -0,0 +1,178 @@
+"""
+HTTP transport to yr.no.
+
+Yr.download() opens a new connection for every forecast and waits on it without a timeout.
+Forecasts are fetched here instead, over a pool of keep-alive connections shared by every thread of the process,
+with connect and read timeouts and a few retries. The document is then handed to Yr in source_data,
+where Yr.download() would have put it, so that get_as_object() parses it like before.
+"""
+import random
+import re
+import threading
+import time
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from py_yr.config.settings import FORECAST_TYPE_HOURLY
+
+from api.metrics import UPSTREAM, timed
+
+# yr.no serves the forecasts of every language under its own path
+PLACE_PATHS = {
+    'en': 'place',
+    'nb': 'sted',
+    'nn': 'stad',
+}
+
+# The encoding an XML document declares in its first line
+XML_ENCODING = re.compile(rb'\s*<\?xml[^>]*?\sencoding=["\']([A-Za-z][A-Za-z0-9._-]*)["\']')
+
+FORECAST_FILES = {
+    FORECAST_TYPE_HOURLY: 'forecast_hour_by_hour.xml',
+}
+DEFAULT_FORECAST_FILE = 'forecast.xml'
+
+# Gateway errors are usually gone on the next try, other errors are not
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class UpstreamError(Exception):
+    """
+    Raised when yr.no could not be reached or kept failing
+    """
+    pass
+
+
+def forecast_url(search, language, forecast_type) -> str:
+    """
+    Builds the url of a forecast document
+    Args:
+        search(str): The searched location, with trailing slash
+        language(str): The language of the weather forecast
+        forecast_type(str): The forecast type (hourly/standard)
+
+    Returns(str): The url
+    """
+    return '{0}/{1}/{2}{3}'.format(
+        settings.UPSTREAM_BASE_URL.rstrip('/'),
+        PLACE_PATHS.get(language, PLACE_PATHS['en']),
+        quote(search),
+        FORECAST_FILES.get(forecast_type, DEFAULT_FORECAST_FILE)
+    )
+
+
+class Transport:
+    """
+    Sends GET requests over a shared pool of keep-alive connections, retrying failures with jittered backoff
+    """
+
+    def __init__(self, pool_size: int, connect_timeout: float, read_timeout: float, retries: int,
+                 backoff: float, sleep=time.sleep):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self._session = requests.Session()
+        self._session.mount('http://', self._adapter)
+        self._session.mount('https://', self._adapter)
+
+    def get(self, url: str):
+        """
+        Fetches a url, retrying connection errors, timeouts and gateway errors
+        Args:
+            url(str): The url
+
+        Returns(requests.Response): The response, which may be an error other than a gateway error
+
+        Raises:
+            UpstreamError: If every attempt failed
+        """
+        attempt = 0
+        while True:
+            self._count('requests')
+            try:
+                response = self._session.get(url, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                error = UpstreamError('{0} returned {1}'.format(url, response.status_code))
+            except requests.RequestException as e:
+                error = UpstreamError('{0} failed: {1}'.format(url, e))
+
+            if attempt >= self.retries:
+                self._count('failures')
+                raise error
+            self._count('retried')
+            # Full jitter, so that workers that failed together do not retry together
+            self._sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            attempt += 1
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self) -> dict:
+        """
+        Returns(dict): Requests sent, retries and failed fetches,
+                       connections opened and requests sent on a reused connection
+        """
+        connections = sent = 0
+        for key in list(self._adapter.poolmanager.pools.keys()):
+            pool = self._adapter.poolmanager.pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                sent += pool.num_requests
+        return {
+            'requests': self.requests,
+            'retries': self.retried,
+            'failures': self.failures,
+            'connections': connections,
+            'reused': max(0, sent - connections),
+        }
+
+
+# Connections to yr.no, shared by every thread of the process
+transport = Transport(
+    pool_size=settings.UPSTREAM_POOL_SIZE,
+    connect_timeout=settings.UPSTREAM_CONNECT_TIMEOUT,
+    read_timeout=settings.UPSTREAM_READ_TIMEOUT,
+    retries=settings.UPSTREAM_RETRIES,
+    backoff=settings.UPSTREAM_RETRY_BACKOFF
+)
+
+
+def download(yr) -> None:
+    """
+    Downloads the forecast of a Yr object through the shared transport.
+    Leaves source_data empty if yr.no has no forecast for the location
+    Args:
+        yr(Yr): The Yr object
+
+    Raises:
+        UpstreamError: If yr.no could not be reached or kept failing
+    """
+    with timed(UPSTREAM):
+        response = transport.get(forecast_url(yr.location, yr.language, yr.forecast_type))
+    if response.status_code == 404:
+        yr.source_data = None
+        return
+    if response.status_code != 200:
+        raise UpstreamError('{0} returned {1}'.format(response.url, response.status_code))
+    # yr.no sends text/xml without a charset, which requests decodes as ISO-8859-1 and garbles æ, ø and å
+    if 'charset=' not in response.headers.get('Content-Type', '').lower():
+        response.encoding = xml_encoding(response.content)
+    yr.source_data = response.text
+
+
+def xml_encoding(document: bytes) -> str:
+    """
+    Returns(str): The encoding an XML document declares, UTF-8 when it declares none
+    """
+    match = XML_ENCODING.match(document)
+    return match.group(1).decode('ascii') if match else 'utf-8'
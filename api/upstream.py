@@ -0,0 +1,306 @@
+import logging
+import threading
+import time
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.db import connection
+from py_yr.yr import Yr
+
+from api.cache import cache_key, negative_cache, NegativeCache
+from api.helper import save_weather_data
+from api.labels import render_forecast
+from api.models import Forecast
+from api.storage import read_periods
+from api.transport import download, UpstreamError
+
+logger = logging.getLogger(__name__)
+
+
+class FlightTimeout(Exception):
+    """
+    Raised when waiting on another thread's call took longer than allowed
+    """
+    pass
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key, so that only one of them runs
+    while the others wait for, and then share, its result
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, timeout: float = None):
+        """
+        Runs func, unless a call with the same key is already running, then waits for that one
+        Args:
+            key: Identifies calls that can share a result
+            func(callable): The call
+            timeout(float): Seconds to wait for a running call, None waits forever
+
+        Returns: The result of func
+
+        Raises:
+            FlightTimeout: If the running call did not finish within timeout
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise FlightTimeout(key)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self, key) -> bool:
+        with self._lock:
+            return key in self._calls
+
+
+class CircuitOpen(UpstreamError):
+    """
+    Raised instead of downloading while yr.no is failing
+    """
+    pass
+
+
+class UpstreamBusy(UpstreamError):
+    """
+    Raised instead of downloading when the process already has as many downloads running as it allows
+    """
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing upstream for a while.
+
+    closed:    calls go through. After failure_threshold consecutive failures, or calls slower than slow_seconds,
+               the circuit opens.
+    open:      calls are rejected until reset_seconds have passed, then the circuit is half open.
+    half open: one trial call goes through. If it succeeds the circuit closes, otherwise it opens again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int, slow_seconds: float, reset_seconds: float, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.slow_seconds = slow_seconds
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = None
+        self._calls = 0
+        self._trial = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Returns(int): The number of the call if it may go through, otherwise None.
+                      Every allowed call must be followed by record() with its number
+        """
+        with self._lock:
+            if self.state == self.OPEN and self.clock() >= self._opened_at + self.reset_seconds:
+                self.state = self.HALF_OPEN
+            if self.state == self.CLOSED or (self.state == self.HALF_OPEN and self._trial is None):
+                self._calls += 1
+                if self.state == self.HALF_OPEN:
+                    self._trial = self._calls
+                return self._calls
+            self.rejected += 1
+            return None
+
+    def record(self, call: int, success: bool, seconds: float) -> None:
+        """
+        Records the outcome of an allowed call, calls slower than slow_seconds count as failures.
+        Only the trial call ends the trial, calls allowed before the circuit opened may still be running
+        """
+        failed = not success or seconds > self.slow_seconds
+        with self._lock:
+            trial = call == self._trial
+            if trial:
+                self._trial = None
+            if not failed:
+                self.failures = 0
+                self.state = self.CLOSED
+                return
+
+            self.failures += 1
+            if trial or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opened += 1
+                self.state = self.OPEN
+                self._opened_at = self.clock()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                state=self.state,
+                failures=self.failures,
+                opened=self.opened,
+                rejected=self.rejected
+            )
+
+
+# Downloads from yr.no, one per search at a time in this process
+downloads = SingleFlight()
+
+# Stops downloading from yr.no while it is failing or slow
+breaker = CircuitBreaker(
+    failure_threshold=settings.UPSTREAM_BREAKER_FAILURES,
+    slow_seconds=settings.UPSTREAM_BREAKER_SLOW_SECONDS,
+    reset_seconds=settings.UPSTREAM_BREAKER_RESET_SECONDS
+)
+
+# Downloads beyond UPSTREAM_MAX_IN_FLIGHT are refused at once rather than tying up more workers
+download_slots = threading.BoundedSemaphore(settings.UPSTREAM_MAX_IN_FLIGHT)
+
+
+def refresh_forecast(search, language, forecast_type, force=False) -> Optional[Tuple[Forecast, list]]:
+    """
+    Downloads and saves a forecast. Concurrent refreshes of the same search share one download.
+    Args:
+        search(str): The searched location, with trailing slash
+        language(str): The language of the weather forecast
+        forecast_type(str): The forecast type (hourly/standard)
+        force(bool): Download even if a fresh forecast is stored, or the search failed lately
+
+    Returns(tuple): The forecast and its periods as dicts, or None if yr had no forecast for the search.
+                    A fresh forecast stored in another language is returned when it can be rendered in this one.
+                    Failures are remembered in the negative cache
+
+    Raises:
+        FlightTimeout: If waiting on another request's download took longer than UPSTREAM_COALESCE_SECONDS
+        UpstreamError: If yr.no could not be reached or kept failing,
+                       CircuitOpen while it is failing and UpstreamBusy when too many downloads are running
+    """
+    key = cache_key(search, language, forecast_type)
+    # Searches that failed lately are answered without building a Yr object
+    if not force:
+        failure = negative_cache.get(key)
+        if failure == NegativeCache.NOT_FOUND:
+            return None
+        if failure == NegativeCache.UPSTREAM_ERROR:
+            raise UpstreamError('{0} ({1}, {2}) failed lately'.format(search, language, forecast_type))
+
+    return downloads.do(
+        key,
+        lambda: _download_forecast(search, language, forecast_type, force),
+        timeout=settings.UPSTREAM_COALESCE_SECONDS
+    )
+
+
+def _download_forecast(search, language, forecast_type, force) -> Optional[Tuple[Forecast, list]]:
+    # A download that finished just before this one started, in any language, has already done the work
+    if not force:
+        try:
+            forecast = Forecast.objects \
+                .with_related() \
+                .for_place(search, forecast_type) \
+                .fresh() \
+                .latest('created')
+            periods = read_periods(forecast)
+            if render_forecast(forecast, periods, language) is not None:
+                return forecast, periods
+        except Forecast.DoesNotExist:
+            pass
+
+    key = cache_key(search, language, forecast_type)
+    if not download_slots.acquire(blocking=False):
+        raise UpstreamBusy('{0} downloads are running'.format(settings.UPSTREAM_MAX_IN_FLIGHT))
+    try:
+        call = breaker.allow()
+        if call is None:
+            raise CircuitOpen('yr.no is failing, not downloading {0}'.format(search))
+        started = time.monotonic()
+        try:
+            yr = Yr(search, language, forecast_type)
+            download(yr)
+        except Exception as e:
+            breaker.record(call, False, time.monotonic() - started)
+            if isinstance(e, UpstreamError):
+                negative_cache.add(key, NegativeCache.UPSTREAM_ERROR)
+            raise
+        breaker.record(call, True, time.monotonic() - started)
+    finally:
+        download_slots.release()
+
+    if not yr.source_data:
+        negative_cache.add(key, NegativeCache.NOT_FOUND)
+        return None
+    forecast, times = save_weather_data(yr)
+    return forecast, [t.to_dict() for t in times]
+
+
+def last_stored_forecast(search, language, forecast_type) -> Optional[Tuple[Forecast, list]]:
+    """
+    The newest stored forecast of a search however old it is, in any language, to serve while yr.no is failing
+    Returns(tuple): The forecast and its periods as dicts, or None if the search has never been stored
+    """
+    try:
+        forecast = Forecast.objects \
+            .with_related() \
+            .for_place(search, forecast_type) \
+            .latest('created')
+    except Forecast.DoesNotExist:
+        return None
+    return forecast, read_periods(forecast)
+
+
+def refresh_in_background(search, language, forecast_type) -> bool:
+    """
+    Starts refreshing a forecast in a background thread, unless it is already being refreshed
+    Args:
+        search(str): The searched location, with trailing slash
+        language(str): The language of the weather forecast
+        forecast_type(str): The forecast type (hourly/standard)
+
+    Returns(bool): If a refresh was started, not when one is running or the search failed lately
+    """
+    key = cache_key(search, language, forecast_type)
+    if downloads.in_flight(key) or negative_cache.get(key) is not None:
+        return False
+
+    def refresh():
+        try:
+            refresh_forecast(search, language, forecast_type)
+        except Exception:
+            logger.exception('Background refresh of %s (%s, %s) failed', search, language, forecast_type)
+        finally:
+            connection.close()
+
+    threading.Thread(target=refresh, daemon=True).start()
+    return True
@@ -1,6 +1,9 @@
 from django.conf.urls import url
-from .views import search
+from .views import search, search_batch, analytics, metrics
 
 urlpatterns = [
+    url(r'^search/batch', search_batch, name='search_batch'),
     url(r'^search', search, name='search'),
+    url(r'^analytics', analytics, name='analytics'),
+    url(r'^metrics', metrics, name='metrics'),
 ]
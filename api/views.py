@@ -1,23 +1,50 @@
+import calendar
+import collections
 import datetime
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
 
+from django.conf import settings
+from django.db import connection
+from django.http import Http404
 from django.http import HttpRequest
-from django.http import JsonResponse
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
 from django.utils.translation import activate
+from django.utils.translation import ugettext as _
 from django.views.decorators.csrf import csrf_exempt
-from py_yr.yr import Yr
+from py_yr.config.settings import FORECAST_TYPE_STANDARD
 
-from api.helper import validate_search_request, time_is_less_then_x_minutes_ago, save_weather_data, cleanup_response
-from api.models import Forecast, Time
+from api.analytics import MAX_BUCKET_HOURS, aggregate, buckets_by_forecast, columns_of_periods, concatenate, \
+    load_columns, is_available as is_analytics_available
+from api.cache import response_cache, negative_cache, cache_key, CachedResponse
+from api.derive import derived_expires_at, standard_from_hourly
+from api.encoding import dumps, json_encoder, json_response, available_encodings, compress_all, negotiate_encoding
+from api.helper import validate_search_request, group_by_day, MAX_IDS_PER_STATEMENT
+from api.labels import render_forecast
+from api.metrics import CACHE_HIT, CACHE_STORED, CACHE_STALE, CACHE_MISS, SERIALIZE, record_cache, render, timed
+from api.models import Forecast
+from api.popularity import request_counter
+from api.storage import read_periods, read_periods_of
+from api.transport import UpstreamError
+from api.transport import transport
+from api.upstream import refresh_forecast, refresh_in_background, last_stored_forecast, FlightTimeout, breaker, \
+    downloads
+
+logger = logging.getLogger(__name__)
 
 
 @csrf_exempt
-def search(request: HttpRequest) -> JsonResponse:
+def search(request: HttpRequest) -> HttpResponse:
     """
     Returns weather forecast
     Args:
-        request(HttpRequest):
+        request(HttpRequest): location, language and forecastType, summary=true adds a summary of each day
 
-    Returns(JsonResponse): Json response with success, message and data
+    Returns(HttpResponse): Json response with success, message and data
     """
     response = {
         'success': False,
@@ -32,6 +59,7 @@ def search(request: HttpRequest) -> JsonResponse:
     language = request.GET.get('language', None)
     location = request.GET.get('location', None)
     forecast_type = request.GET.get('forecastType', None)
+    summaries = request.GET.get('summary', '') in ('1', 'true')
 
     # Since we get languages in get parameter we have to activate the language manually
     activate(language)
@@ -39,48 +67,490 @@ def search(request: HttpRequest) -> JsonResponse:
     # Validates the get parameters
     response['success'], response['message'] = validate_search_request(language, location, forecast_type)
     if not response['success']:
-        return JsonResponse(response)
+        return json_response(dumps(response))
 
     # So that the location matches the stored location
     if location[:-1] is not '/':
         location += '/'
 
+    request_counter.record(location, forecast_type)
+    key = cache_key(location, language, forecast_type, summaries)
+    cached = response_cache.get(key)
+    if cached is not None:
+        record_cache(CACHE_HIT)
+        return send_response(request, cached)
+
     # Fetches the data
+    max_stale = None
+    if settings.FORECAST_STALE_WHILE_REVALIDATE:
+        max_stale = datetime.timedelta(minutes=settings.FORECAST_MAX_STALE_MINUTES)
+    forecast = None
     try:
         forecast = Forecast.objects \
-            .filter(search=location, language=language, forecast_type=forecast_type) \
+            .with_related() \
+            .for_place(location, forecast_type) \
+            .fresh(max_stale=max_stale) \
             .latest('created')
-        # Forecasts is cached and cache is NOT too old
-        if time_is_less_then_x_minutes_ago(forecast.created, 10):
-            time_list = Time.objects.filter(forecast=forecast.id)
-            format_response(response, time_list, forecast, language, forecast_type)
-        else:
-            # Forecasts is cached, but the cache IS too old
-            yr = Yr(location, language, forecast_type)
-            yr.download()
 
-            if yr.source_data:
-                forecast, time_list = save_weather_data(yr)
-                format_response(response, time_list, forecast, language, forecast_type)
+        # The client already has this forecast, no need to load its periods
+        encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), available_encodings())
+        etag = variant_etag(forecast_etag(forecast, language, summaries), encoding)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=forecast_last_modified(forecast))
+        if not_modified is not None:
+            if forecast.is_stale():
+                # Clients polling with validators must not keep a stale forecast alive
+                record_cache(CACHE_STALE)
+                refresh_in_background(location, language, forecast_type)
             else:
-                response['success'] = False
-                response['message'] = validate_search_request(language, "", forecast_type)
+                record_cache(CACHE_STORED)
+            return add_validators(not_modified, etag, forecast_last_modified(forecast), forecast.expires_at)
+
+        rendered = render_forecast(forecast, read_periods(forecast), language)
+        if rendered is None:
+            # The forecast has labels that have never been downloaded in this language
+            raise Forecast.DoesNotExist
+        meta, periods = rendered
+        if forecast.is_stale():
+            # Forecasts is cached, but the cache IS too old. Serve it while it is refreshed
+            record_cache(CACHE_STALE)
+            format_response(response, periods, forecast, language, forecast_type, stale=True, meta=meta,
+                            summaries=summaries)
+            refresh_in_background(location, language, forecast_type)
+        else:
+            # Forecasts is cached and cache is NOT too old
+            record_cache(CACHE_STORED)
+            format_response(response, periods, forecast, language, forecast_type, meta=meta, summaries=summaries)
     except Forecast.DoesNotExist:
-        yr = Yr(location, language, forecast_type)
-        yr.download()
-        if yr.source_data:
-            forecast, time_list = save_weather_data(yr)
-            format_response(response, time_list, forecast, language, forecast_type)
+        # Forecasts is not cached, or the cache IS too old to be served
+        record_cache(CACHE_MISS)
+        fetched = fetch_forecast(location, language, forecast_type)
+        if fetched is not None:
+            forecast, meta, periods = fetched
+            format_response(response, periods, forecast, language, forecast_type, stale=forecast.is_stale(),
+                            meta=meta, summaries=summaries)
         else:
+            forecast = None
             response['success'] = False
             response['message'] = validate_search_request(language, "", forecast_type)
 
-    return JsonResponse(response)
+    # Serialized once, cached responses are sent as they are
+    if forecast is None:
+        return json_response(dumps(response))
+
+    if forecast.is_stale():
+        # Sent once, so it is only compressed in the coding it is sent in
+        encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), available_encodings())
+        return send_response(request, serialize_response(response, forecast, language, summaries,
+                                                         encodings=[encoding] if encoding else []))
+
+    cached = serialize_response(response, forecast, language, summaries, encodings=available_encodings())
+    cache_response(key, cached)
+    return send_response(request, cached)
+
+
+@csrf_exempt
+def search_batch(request: HttpRequest) -> HttpResponse:
+    """
+    Returns weather forecasts of many locations. Stored forecasts are read with one query,
+    the others are downloaded concurrently
+    Args:
+        request(HttpRequest): One or more location parameters, with language and forecastType
+
+    Returns(HttpResponse): Json response with success, message and data.results,
+                           the location and its /api/search response for every location
+    """
+    language = request.GET.get('language', None)
+    locations = request.GET.getlist('location')
+    forecast_type = request.GET.get('forecastType', None)
+    summaries = request.GET.get('summary', '') in ('1', 'true')
+
+    activate(language)
+
+    if not locations:
+        success, message = validate_search_request(language, None, forecast_type)
+        return json_response(dumps({'success': False, 'data': None, 'message': message}))
+    if len(locations) > settings.SEARCH_BATCH_MAX_LOCATIONS:
+        message = _('TooManyLocations').format(settings.SEARCH_BATCH_MAX_LOCATIONS)
+        return json_response(dumps({'success': False, 'data': None, 'message': message}))
+
+    # Validated one by one, so one invalid location does not fail the others
+    bodies = {}
+    searches = collections.OrderedDict()
+    for location in locations:
+        success, message = validate_search_request(language, location, forecast_type)
+        if not success:
+            bodies[location] = dumps(search_response(False, message))
+        else:
+            searches[location] = location + '/'
+            request_counter.record(searches[location], forecast_type)
+
+    # Responses cached in memory
+    misses = collections.OrderedDict()
+    for location, search in searches.items():
+        cached = response_cache.get(cache_key(search, language, forecast_type, summaries))
+        if cached is not None:
+            bodies[location] = cached.body
+        else:
+            misses.setdefault(search, []).append(location)
+
+    # Forecasts stored in the database, with one query for the forecasts and one for their periods
+    latest = latest_forecasts(list(misses), forecast_type)
+    periods = read_periods_of(list(latest.values()))
+    rendered = {}
+    for search, forecast in list(latest.items()):
+        rendered[search] = render_forecast(forecast, periods[forecast.id], language)
+        if rendered[search] is None:
+            # The forecast has labels that have never been downloaded in this language
+            del latest[search]
+
+    # The rest are downloaded in parallel, so the batch takes about as long as the slowest download
+    refreshed = download_forecasts([search for search in misses if search not in latest], language, forecast_type)
+
+    for search, batch_locations in misses.items():
+        if search in latest:
+            forecast = latest[search]
+            meta, forecast_periods = rendered[search]
+            stale = forecast.is_stale()
+            response = search_response(True, '')
+            format_response(response, forecast_periods, forecast, language, forecast_type, stale=stale, meta=meta,
+                            summaries=summaries)
+            if stale:
+                refresh_in_background(search, language, forecast_type)
+        elif refreshed[search] is not None:
+            forecast, meta, forecast_periods = refreshed[search]
+            response = search_response(True, '')
+            format_response(response, forecast_periods, forecast, language, forecast_type, stale=forecast.is_stale(),
+                            meta=meta, summaries=summaries)
+        else:
+            forecast = None
+            response = search_response(False, validate_search_request(language, "", forecast_type)[1])
+
+        if forecast is None:
+            body = dumps(response)
+        else:
+            # Only bodies that are cached for /api/search are compressed, the batch sends them as they are
+            if forecast.is_stale():
+                body = dumps(response)
+            else:
+                cached = serialize_response(response, forecast, language, summaries, encodings=available_encodings())
+                cache_response(cache_key(search, language, forecast_type, summaries), cached)
+                body = cached.body
+        for location in batch_locations:
+            bodies[location] = body
+
+    # The bodies are already serialized, so they are joined as they are
+    results = b','.join(b'{"location":' + dumps(location) + b',"response":' + bodies[location] + b'}'
+                        for location in locations)
+    return json_response(b'{"success":true,"message":"","data":{"results":[' + results + b']}}')
+
+
+@csrf_exempt
+def analytics(request: HttpRequest) -> HttpResponse:
+    """
+    Returns aggregates of the forecasts of one or more locations, per day or per bucket of hours
+    Args:
+        request(HttpRequest): One or more location parameters, with language and forecastType.
+                              bucket is the hours in a bucket, 24 by default,
+                              base the base temperature of the degree-hours, ANALYTICS_DEGREE_HOURS_BASE by default
+
+    Returns(HttpResponse): Json response with success, message and data.results,
+                           the location and the buckets of its forecast for every location
+    """
+    language = request.GET.get('language', None)
+    locations = request.GET.getlist('location')
+    forecast_type = request.GET.get('forecastType', None)
+
+    activate(language)
+
+    if not is_analytics_available():
+        return json_response(dumps({'success': False, 'data': None, 'message': _('AnalyticsUnavailable')}))
+    if not locations:
+        success, message = validate_search_request(language, None, forecast_type)
+        return json_response(dumps({'success': False, 'data': None, 'message': message}))
+    if len(locations) > settings.ANALYTICS_MAX_LOCATIONS:
+        message = _('TooManyLocations').format(settings.ANALYTICS_MAX_LOCATIONS)
+        return json_response(dumps({'success': False, 'data': None, 'message': message}))
+    try:
+        bucket_hours = int(request.GET.get('bucket', 24))
+        base = float(request.GET.get('base', settings.ANALYTICS_DEGREE_HOURS_BASE))
+    except ValueError:
+        bucket_hours = base = None
+    if bucket_hours is None or not 1 <= bucket_hours <= MAX_BUCKET_HOURS or not math.isfinite(base):
+        message = _('InvalidAnalyticsParameters').format(MAX_BUCKET_HOURS)
+        return json_response(dumps({'success': False, 'data': None, 'message': message}))
+
+    results = collections.OrderedDict()
+    searches = collections.OrderedDict()
+    for location in locations:
+        success, message = validate_search_request(language, location, forecast_type)
+        results[location] = {'location': location, 'success': success, 'message': message if not success else '',
+                             'data': None}
+        if success:
+            searches.setdefault(location + '/', []).append(location)
+
+    # Stored periods are loaded into columns with one query, the rest are downloaded concurrently.
+    # One request may ask for many more locations than a batch search, so only as many are downloaded
+    latest = latest_forecasts(list(searches), forecast_type)
+    frames = [load_columns(list(latest.values()))]
+    missing = [search for search in searches if search not in latest]
+    refreshed = download_forecasts(missing[:settings.ANALYTICS_MAX_DOWNLOADS], language, forecast_type)
+    for search, fetched in refreshed.items():
+        if fetched is not None:
+            forecast, meta, periods = fetched
+            latest[search] = forecast
+            frames.append(columns_of_periods(forecast.id, periods))
+    buckets = buckets_by_forecast(aggregate(concatenate(frames), bucket_hours, base), base)
+
+    for search, search_locations in searches.items():
+        forecast = latest.get(search)
+        if forecast is not None:
+            stale = forecast.is_stale()
+            if stale and search not in refreshed:
+                refresh_in_background(search, language, forecast_type)
+            data = {
+                'lastModified': '{0}Z'.format(forecast.created),
+                'stale': stale,
+                'bucketHours': bucket_hours,
+                'buckets': buckets.get(forecast.id, [])
+            }
+            message = ''
+        elif search not in refreshed:
+            data = None
+            message = _('NotDownloaded')
+        else:
+            data = None
+            message = validate_search_request(language, "", forecast_type)[1]
+        for location in search_locations:
+            results[location].update(success=forecast is not None, message=message, data=data)
+
+    return json_response(dumps({'success': True, 'message': '', 'data': {'results': list(results.values())}}))
+
+
+def metrics(request: HttpRequest) -> HttpResponse:
+    """
+    Returns the metrics of this process in the Prometheus text format
+    Args:
+        request(HttpRequest): No parameters
+
+    Returns(HttpResponse): Request and phase histograms, search cache outcomes,
+                           and the counters of the upstream transport, the circuit breaker and the caches
+    """
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    counters = {}
+    gauges = {}
+    for name, value in transport.stats().items():
+        counters[('weather_api_upstream_' + name + '_total', ())] = value
+    breaker_stats = breaker.stats()
+    for state in (breaker.CLOSED, breaker.OPEN, breaker.HALF_OPEN):
+        gauges[('weather_api_upstream_breaker_state', (('state', state),))] = int(breaker_stats['state'] == state)
+    gauges[('weather_api_upstream_breaker_failures', ())] = breaker_stats['failures']
+    counters[('weather_api_upstream_breaker_opened_total', ())] = breaker_stats['opened']
+    counters[('weather_api_upstream_breaker_rejected_total', ())] = breaker_stats['rejected']
+    counters[('weather_api_upstream_coalesced_total', ())] = downloads.coalesced
+    for cache, stats in (('response', response_cache.stats()), ('negative', negative_cache.stats())):
+        for name, value in stats.items():
+            if name in ('entries', 'max_entries'):
+                gauges[('weather_api_cache_' + name, (('cache', cache),))] = value
+            else:
+                counters[('weather_api_cache_' + name + '_total', (('cache', cache),))] = value
+    return HttpResponse(render(counters, gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def latest_forecasts(searches, forecast_type) -> dict:
+    """
+    The newest stored forecast of many searches, read with one query per MAX_IDS_PER_STATEMENT searches.
+    Forecasts that expired are left out, unless they can be served stale
+    Args:
+        searches(list): The searched locations, with trailing slash
+        forecast_type(str): The forecast type (hourly/standard)
+
+    Returns(dict): The forecast of each search that has one, by search
+    """
+    max_stale = None
+    if settings.FORECAST_STALE_WHILE_REVALIDATE:
+        max_stale = datetime.timedelta(minutes=settings.FORECAST_MAX_STALE_MINUTES)
+    latest = {}
+    for start in range(0, len(searches), MAX_IDS_PER_STATEMENT):
+        stored = Forecast.objects \
+            .with_related() \
+            .filter(search__in=searches[start:start + MAX_IDS_PER_STATEMENT], forecast_type=forecast_type) \
+            .fresh(max_stale=max_stale) \
+            .order_by('search', '-created')
+        for forecast in stored:
+            latest.setdefault(forecast.search, forecast)
+    return latest
+
+
+def download_forecasts(searches, language, forecast_type) -> dict:
+    """
+    Fetches forecasts in parallel, so that it takes about as long as the slowest download
+    Returns(dict): The result of fetch_forecast() for each search
+    """
+    if not searches:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(settings.SEARCH_BATCH_WORKERS, len(searches))) as executor:
+        results = executor.map(lambda search: download_forecast(search, language, forecast_type), searches)
+        return dict(zip(searches, results))
+
+
+def search_response(success, message) -> dict:
+    return {
+        'success': success,
+        'data': {
+            'meta': None,
+            'forecasts': None
+        },
+        'message': message
+    }
+
+
+def fetch_forecast(search, language, forecast_type):
+    """
+    Gets a forecast that is not stored, derived from the stored hourly forecast or downloaded.
+    The last stored forecast is used if yr.no is failing
+    Returns(tuple): The forecast, its meta in the language and its periods, or None if there is no forecast
+    """
+    if forecast_type == FORECAST_TYPE_STANDARD:
+        derived = standard_from_hourly(search, language)
+        if derived is not None:
+            return derived
+
+    try:
+        refreshed = refresh_forecast(search, language, forecast_type)
+    except (FlightTimeout, UpstreamError):
+        # yr.no is failing or busy, an old forecast is better than none
+        refreshed = last_stored_forecast(search, language, forecast_type)
+    if refreshed is None:
+        return None
+    forecast, periods = refreshed
+    # The forecast may be stored in another language
+    rendered = render_forecast(forecast, periods, language)
+    if rendered is None:
+        return None
+    meta, periods = rendered
+    return forecast, meta, periods
+
+
+def download_forecast(search, language, forecast_type):
+    """
+    Fetches a forecast of a batch search on a worker thread
+    Returns(tuple): The forecast, its meta in the language and its periods, or None if there is no forecast
+    """
+    try:
+        return fetch_forecast(search, language, forecast_type)
+    except Exception:
+        logger.exception('Download of %s (%s, %s) failed', search, language, forecast_type)
+        return None
+    finally:
+        connection.close()
+
+
+def format_response(response, periods, forecast, language, forecast_type, stale=False, meta=None, summaries=False):
+    # format response, meta is the forecast translated to the language if it was stored in another one
+    response['data']['meta'] = meta if meta is not None else forecast.to_dict()
+    response['data']['meta']['stale'] = stale
+    response['data']['forecasts'] = group_by_day(periods, language, forecast_type, summaries)
+    response['data']['lastModified'] = '{0}Z'.format(forecast.created)
+
 
+@timed(SERIALIZE)
+def serialize_response(response, forecast, language, summaries=False, encodings=()) -> CachedResponse:
+    """
+    Serializes a forecast response once, together with its validators. Compressing at a high level costs
+    milliseconds, so only cached responses are compressed with every coding, the others with the one they are sent in
+    """
+    body = dumps(response)
+    # A standard forecast derived from an hourly forecast is another representation than the hourly forecast
+    derived_until = response['data']['meta'].get('derived_until')
+    return CachedResponse(
+        body=body,
+        encoded=compress_all(body, encodings),
+        etag=forecast_etag(forecast, language, summaries, derived_until),
+        last_modified=forecast_last_modified(forecast),
+        expires_at=forecast.expires_at if derived_until is None else derived_expires_at(forecast, derived_until)
+    )
+
+
+def forecast_etag(forecast, language, summaries=False, derived_until=None) -> str:
+    """
+    Strong validator of a forecast response, changes whenever a new forecast is saved.
+    Forecasts are rendered in every language, with or without day summaries, so both are part of it,
+    and so is expiry, which flips meta.stale in the body. orjson and json.dumps write different bytes for the same
+    response, so the serializer is part of it too. Standard forecasts derived from an hourly forecast
+    have the type and the end of the derived periods in it, so they never share a validator with the hourly forecast
+    """
+    etag = '{0}-{1}-{2}-{3}'.format(forecast.id, forecast_last_modified(forecast), language, json_encoder())
+    if derived_until is not None:
+        etag += '-{0}-{1:%Y%m%dT%H%M}'.format(FORECAST_TYPE_STANDARD, derived_until)
+    if summaries:
+        etag += '-summaries'
+    if forecast.is_stale():
+        etag += '-stale'
+    return etag
 
-def format_response(response, time_list, forecast, language, forecast_type):
-    # format response
-    forecasts = [time_data.to_dict() for time_data in time_list]
-    response['data']['meta'] = forecast.to_dict()
-    response['data']['forecasts'] = cleanup_response(forecasts, language, forecast_type)
-    response['data']['lastModified'] = '{0}Z'.format(datetime.datetime.now(), '01')
+
+def forecast_last_modified(forecast) -> int:
+    """
+    When the forecast was downloaded, in seconds since the epoch
+    """
+    created = forecast.created
+    if timezone.is_naive(created):
+        created = timezone.make_aware(created, timezone.get_default_timezone())
+    return calendar.timegm(created.utctimetuple())
+
+
+def send_response(request, cached) -> HttpResponse:
+    """
+    Sends a serialized response in the best content coding the client accepts,
+    or 304 Not Modified if the client's copy is still current
+    Args:
+        request(HttpRequest): The request, with its conditional headers
+        cached(CachedResponse): The serialized response, its compressed variants and validators
+
+    Returns(HttpResponse): The response
+    """
+    encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), list(cached.encoded))
+    etag = variant_etag(cached.etag, encoding)
+    response = get_conditional_response(request, etag=etag, last_modified=cached.last_modified)
+    if response is None:
+        if encoding is None:
+            response = json_response(cached.body)
+        else:
+            response = json_response(cached.encoded[encoding])
+            response['Content-Encoding'] = encoding
+    return add_validators(response, etag, cached.last_modified, cached.expires_at)
+
+
+def variant_etag(etag, encoding) -> str:
+    """
+    Each content coding is a different representation, so it gets its own ETag
+    """
+    if encoding is None:
+        return etag
+    return '{0}-{1}'.format(etag, encoding)
+
+
+def add_validators(response, etag, last_modified, expires_at) -> HttpResponse:
+    """
+    Adds ETag and Last-Modified, and lets caches keep the response until the forecast expires
+    """
+    response['ETag'] = quote_etag(etag)
+    response['Last-Modified'] = http_date(last_modified)
+    max_age = 0
+    if expires_at is not None:
+        max_age = max(0, int((expires_at - timezone.now()).total_seconds()))
+    patch_cache_control(response, public=True, max_age=max_age)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def cache_response(key, cached):
+    """
+    Caches a serialized response until its forecast expires
+    Args:
+        key(tuple): The cache key of the search
+        cached(CachedResponse): The serialized response and its validators
+    """
+    if cached.expires_at is not None:
+        response_cache.set(key, cached, (cached.expires_at - timezone.now()).total_seconds())
@@ -0,0 +1,96 @@
+"""
+Measures daily aggregates of many hourly forecasts:
+a naive loop over the Time.to_dict() periods of every forecast (before),
+and the NumPy columns of api.analytics (after), for both storage layouts.
+
+    python -m benchmarks.bench_analytics --locations 1000
+"""
+import argparse
+import collections
+
+from benchmarks.common import setup_django, test_database, measure, print_table
+
+setup_django()
+
+from django.test.utils import override_settings  # noqa: E402
+from py_yr.config.settings import FORECAST_TYPE_HOURLY  # noqa: E402
+
+from api.analytics import load_columns, aggregate, buckets_by_forecast  # noqa: E402
+from api.helper import save_weather_data  # noqa: E402
+from api.models import Forecast  # noqa: E402
+from api.storage import STORAGE_RELATIONAL, STORAGE_COMPACT, read_periods_of  # noqa: E402
+from api.tests.fixtures import fake_yr  # noqa: E402
+
+BASE = 18.0
+
+
+def naive_daily(forecasts) -> dict:
+    """
+    The same daily aggregates as api.analytics, one period at a time
+    """
+    result = {}
+    for forecast_id, periods in read_periods_of(forecasts).items():
+        days = collections.OrderedDict()
+        for period in sorted(periods, key=lambda p: p['start']):
+            days.setdefault(period['start'].date(), []).append(period)
+        result[forecast_id] = []
+        for date, day in days.items():
+            hours = [(p['end'] - p['start']).total_seconds() / 3600 for p in day]
+            temperatures = [p['temperature']['value'] for p in day]
+            precipitation = [float(p['precipitation']['value']) for p in day]
+            result[forecast_id].append({
+                'start': date,
+                'periods': len(day),
+                'temperature': {
+                    'min': min(temperatures),
+                    'max': max(temperatures),
+                    'mean': sum(t * h for t, h in zip(temperatures, hours)) / sum(hours),
+                },
+                'precipitation': {
+                    'total': sum(precipitation),
+                    'min': sum(float(p['precipitation']['min_value']) for p in day),
+                    'max': sum(float(p['precipitation']['max_value']) for p in day),
+                    'probability': sum(h for v, h in zip(precipitation, hours) if v > 0) / sum(hours),
+                },
+                'wind_speed': {
+                    'max': max(float(p['wind_speed']['mps']) for p in day),
+                },
+                'degree_hours': {
+                    'base': BASE,
+                    'heating': sum(max(BASE - t, 0) * h for t, h in zip(temperatures, hours)),
+                    'cooling': sum(max(t - BASE, 0) * h for t, h in zip(temperatures, hours)),
+                },
+            })
+    return result
+
+
+def vectorized_daily(forecasts) -> dict:
+    return buckets_by_forecast(aggregate(load_columns(forecasts), 24, BASE), BASE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--locations', type=int, default=1000, help='Hourly forecasts saved per layout')
+    args = parser.parse_args()
+
+    rows = []
+    with test_database():
+        for storage in (STORAGE_RELATIONAL, STORAGE_COMPACT):
+            with override_settings(FORECAST_STORAGE=storage):
+                ids = []
+                for i in range(args.locations):
+                    yr = fake_yr('norge/sted/{0}/{0}/'.format(i), forecast_type=FORECAST_TYPE_HOURLY)
+                    ids.append(save_weather_data(yr)[0].id)
+
+            def forecasts():
+                return list(Forecast.objects.filter(pk__in=ids))
+
+            for case, func in (('naive per row (before)', naive_daily), ('numpy columns (after)', vectorized_daily)):
+                result = measure(lambda: func(forecasts()), repeat=5)
+                result.update(storage=storage, case=case, locations=args.locations)
+                rows.append(result)
+    print_table(rows, ['storage', 'case', 'locations', 'best_ms', 'mean_ms', 'queries'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Measures the cost of compressing search responses per request (what the proxy does today)
+against sending a variant compressed once when the response was cached, and the bytes on the wire.
+
+    python -m benchmarks.bench_compression
+"""
+from benchmarks.common import setup_django, test_database, measure, print_table
+
+setup_django()
+
+from django.test import RequestFactory  # noqa: E402
+from py_yr.config.settings import FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY  # noqa: E402
+
+from api.cache import response_cache  # noqa: E402
+from api.encoding import available_encodings, compress  # noqa: E402
+from api.helper import save_weather_data  # noqa: E402
+from api.tests.fixtures import fake_yr  # noqa: E402
+from api.views import search  # noqa: E402
+
+
+def main():
+    rows = []
+    factory = RequestFactory()
+    with test_database():
+        for forecast_type in (FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY):
+            yr = fake_yr(forecast_type=forecast_type)
+            save_weather_data(yr)
+            params = {'location': yr.location[:-1], 'language': 'en', 'forecastType': forecast_type}
+            response_cache.clear()
+            body = search(factory.get('/api/search/', params)).content
+
+            result = measure(lambda: search(factory.get('/api/search/', params)), repeat=200)
+            result.update(forecast_type=forecast_type, case='identity', bytes=len(body))
+            rows.append(result)
+
+            for encoding in available_encodings():
+                compressed = compress(body, encoding)
+                result = measure(lambda: compress(body, encoding), repeat=50)
+                result.update(forecast_type=forecast_type, case='{0} per request (before)'.format(encoding),
+                              bytes=len(compressed))
+                rows.append(result)
+
+                request = factory.get('/api/search/', params, HTTP_ACCEPT_ENCODING=encoding)
+                result = measure(lambda: search(request), repeat=200)
+                result.update(forecast_type=forecast_type, case='{0} cached variant (after)'.format(encoding),
+                              bytes=len(search(request).content))
+                rows.append(result)
+    print_table(rows, ['forecast_type', 'case', 'bytes', 'best_ms', 'mean_ms'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Measures grouping the periods of a forecast by day over a synthetic 10 day hourly series:
+the old cleanup_response (before), and group_by_day with and without day summaries (after).
+
+    python -m benchmarks.bench_grouping
+"""
+import datetime
+
+from benchmarks.common import setup_django, measure, print_table
+
+setup_django()
+
+from py_yr.config.settings import FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY  # noqa: E402
+
+from api.helper import DAYS, group_by_day  # noqa: E402
+from api.tests.fixtures import fake_period_dicts  # noqa: E402
+
+
+def cleanup_response(forecasts, language, forecast_type) -> list:
+    """
+    cleanup_response as it was before group_by_day, kept as the baseline
+    """
+    weekdays = {}
+    for forecast in forecasts:
+        weekday = DAYS[language][forecast.get('start', '').weekday()]
+        try:
+            test_if_key_exists = weekdays[weekday]
+        except KeyError:
+            weekdays[weekday] = {
+                'weekday': weekday,
+                'forecast': []
+            }
+
+    for forecast in forecasts:
+        weekday = DAYS[language][forecast.get('start', '').weekday()]
+        try:
+            weekdays[weekday]['forecast'].append(forecast)
+        except KeyError:
+            pass
+
+    if forecast_type is FORECAST_TYPE_STANDARD:
+        for i, key in enumerate(weekdays):
+            list_of_forecasts = weekdays[key]['forecast']
+            if len(list_of_forecasts) > 4:
+                lowest_date = datetime.datetime(2100, 12, 12).date()
+                for elm in list_of_forecasts:
+                    if elm.get('start', lowest_date).date() < lowest_date:
+                        lowest_date = elm.get('start', lowest_date).date()
+                weekdays[key]['forecast'] = [elm for elm in list_of_forecasts
+                                             if elm.get('start', lowest_date).date() == lowest_date]
+
+    return [weekdays[key] for key in weekdays]
+
+
+def main():
+    start = datetime.datetime(2017, 1, 2, 13, 0)
+    series = {
+        FORECAST_TYPE_HOURLY: fake_period_dicts(start, 1, 240),
+        FORECAST_TYPE_STANDARD: fake_period_dicts(start.replace(hour=12), 6, 40),
+    }
+    rows = []
+    for forecast_type, periods in series.items():
+        # read_periods() returns the newest period first
+        periods = list(reversed(periods))
+        cases = [
+            ('cleanup_response (before)', lambda: cleanup_response(periods, 'en', forecast_type)),
+            ('group_by_day (after)', lambda: group_by_day(periods, 'en', forecast_type)),
+            ('group_by_day with summaries', lambda: group_by_day(periods, 'en', forecast_type, summaries=True)),
+        ]
+        for case, func in cases:
+            result = measure(func, repeat=500)
+            result.update(forecast_type=forecast_type, case=case, periods=len(periods))
+            rows.append(result)
+    print_table(rows, ['forecast_type', 'case', 'periods', 'best_ms', 'mean_ms'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Measures the "latest fresh forecast" lookup on a Forecast table seeded with millions of rows,
+with and without the indexes added in migration 0002.
+
+    python -m benchmarks.bench_latest_lookup --rows 2000000 --keys 20000
+"""
+import argparse
+import datetime
+import random
+
+from benchmarks.common import setup_django, test_database, measure, print_table
+
+setup_django()
+
+from django.db import connection, models, transaction  # noqa: E402
+from django.db.models import F  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from py_yr.config.settings import FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY  # noqa: E402
+
+from api.models import Forecast, Location, TimeZone, Sun, Credit  # noqa: E402
+
+LANGUAGES = ('en', 'nb', 'nn')
+FORECAST_TYPES = (FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY)
+
+
+def seed(rows: int, keys: int, batch_size: int = 5000) -> list:
+    """
+    Inserts rows forecasts spread over keys searches, oldest first, like refreshes over time would
+    Returns(list): The (search, language, forecast_type) keys used
+    """
+    timezone_row = TimeZone.objects.create(zone='Europe/Oslo', utcoffsetMinutes=60)
+    location = Location.objects.create(name='Bergen', type='City', country='Norway', timezone=timezone_row)
+    sun = Sun.objects.create(rise=timezone.now(), set=timezone.now())
+    credit = Credit.objects.create(url='http://www.yr.no', text='yr')
+
+    search_keys = [('country/region/place-{0}/'.format(i), random.choice(LANGUAGES), random.choice(FORECAST_TYPES))
+                   for i in range(keys)]
+    now = timezone.now()
+    started = now - datetime.timedelta(minutes=10 * rows // keys)
+    for offset in range(0, rows, batch_size):
+        batch = []
+        for i in range(offset, min(offset + batch_size, rows)):
+            search, language, forecast_type = search_keys[i % keys]
+            created = started + datetime.timedelta(minutes=10 * (i // keys))
+            batch.append(Forecast(search=search, language=language, forecast_type=forecast_type, location=location,
+                                  credit=credit, sun=sun, created=created,
+                                  expires_at=created + datetime.timedelta(minutes=10)))
+        with transaction.atomic():
+            Forecast.objects.bulk_create(batch)
+    # auto_now_add overrides created on insert, spread it out again
+    Forecast.objects.update(created=F('expires_at') - datetime.timedelta(minutes=10))
+    if connection.vendor in ('sqlite', 'postgresql'):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+    return search_keys
+
+
+def drop_lookup_indexes() -> None:
+    """
+    Drops the indexes from migration 0002, leaving the table as it was before
+    """
+    unindexed = models.DateTimeField(null=True)
+    unindexed.set_attributes_from_name('expires_at')
+    with connection.schema_editor() as editor:
+        editor.alter_index_together(Forecast, Forecast._meta.index_together, [])
+        editor.alter_field(Forecast, Forecast._meta.get_field('expires_at'), unindexed)
+
+
+def lookup(keys: list):
+    def run():
+        search, language, forecast_type = random.choice(keys)
+        try:
+            Forecast.objects.for_search(search, language, forecast_type).fresh().latest('created')
+        except Forecast.DoesNotExist:
+            pass
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--keys', type=int, default=20000)
+    parser.add_argument('--lookups', type=int, default=200)
+    args = parser.parse_args()
+
+    rows = []
+    with test_database():
+        keys = seed(args.rows, args.keys)
+        result = measure(lookup(keys), repeat=args.lookups)
+        result.update(indexes='composite + expires_at', rows=args.rows)
+        rows.append(result)
+
+        drop_lookup_indexes()
+        result = measure(lookup(keys), repeat=args.lookups)
+        result.update(indexes='none', rows=args.rows)
+        rows.append(result)
+    print_table(rows, ['rows', 'indexes', 'best_ms', 'mean_ms'])
+
+
+if __name__ == '__main__':
+    main()
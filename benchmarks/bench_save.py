@@ -0,0 +1,63 @@
+"""
+Compares save_weather_data with the old row by row implementation,
+for a standard (36 periods) and an hourly (48 periods) forecast.
+
+    python -m benchmarks.bench_save
+"""
+from benchmarks.common import setup_django, test_database, measure, print_table
+
+setup_django()
+
+from py_yr.config.settings import FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY  # noqa: E402
+
+from api.helper import save_weather_data, build_period_children  # noqa: E402
+from api.models import Credit, Time, Forecast, Location, TimeZone, Sun  # noqa: E402
+from api.tests.fixtures import fake_yr  # noqa: E402
+
+
+def save_row_by_row(yr_object):
+    """
+    The implementation before bulk inserts: every row saved on its own, in autocommit mode
+    """
+    data = yr_object.get_as_object()
+    timezone = TimeZone(utcoffsetMinutes=data.location.timezone.utcoffsetMinutes, zone=data.location.timezone.id)
+    timezone.save()
+    location = Location(timezone=timezone, name=data.location.name, country=data.location.country,
+                        type=data.location.type)
+    location.save()
+    sun = Sun(rise=data.sun.rise, set=data.sun.set)
+    sun.save()
+    credit = Credit(url=data.credit.url, text=data.credit.text)
+    credit.save()
+    forecast = Forecast(sun=sun, credit=credit, location=location, search=yr_object.location,
+                        forecast_type=yr_object.forecast_type, language=yr_object.language)
+    forecast.save()
+
+    times = []
+    for t in data.forecast.tabular.time:
+        children = build_period_children(t)
+        for child in children:
+            child.save()
+        rain, pressure, symbol, temp, direction, speed = children
+        time = Time(start=t.from_, end=t.to, period=t.period, forecast=forecast, precipitation=rain, symbol=symbol,
+                    wind_direction=direction, wind_speed=speed, temperature=temp, pressure=pressure)
+        time.save()
+        times.append(time)
+    return forecast, times
+
+
+def main():
+    rows = []
+    with test_database():
+        for forecast_type in (FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY):
+            yr = fake_yr(forecast_type=forecast_type)
+            periods = len(yr.get_as_object().forecast.tabular.time)
+            for name, func in (('row by row', save_row_by_row), ('bulk', save_weather_data)):
+                result = measure(lambda: func(yr), repeat=20)
+                result.update(implementation=name, forecast_type=forecast_type, periods=periods)
+                rows.append(result)
+    print_table(rows, ['forecast_type', 'periods', 'implementation', 'queries', 'best_ms', 'mean_ms'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Measures the serialization cost of a search response per request:
+formatting and encoding on every request (before), sending the cached body (after),
+and the available JSON encoders.
+
+    python -m benchmarks.bench_serialization
+"""
+from benchmarks.common import setup_django, test_database, measure, print_table
+
+setup_django()
+
+from django.http import JsonResponse  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from py_yr.config.settings import FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY  # noqa: E402
+
+from api import encoding  # noqa: E402
+from api.encoding import dumps, json_response  # noqa: E402
+from api.helper import save_weather_data  # noqa: E402
+from api.models import Forecast  # noqa: E402
+from api.storage import read_periods  # noqa: E402
+from api.tests.fixtures import fake_yr  # noqa: E402
+from api.views import format_response  # noqa: E402
+
+
+def empty_response() -> dict:
+    return {'success': True, 'data': {'meta': None, 'forecasts': None}, 'message': ''}
+
+
+def main():
+    rows = []
+    with test_database():
+        for forecast_type in (FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY):
+            saved, _ = save_weather_data(fake_yr(forecast_type=forecast_type))
+            forecast = Forecast.objects.with_related().get(pk=saved.pk)
+            periods = read_periods(forecast)
+
+            def format_and_encode():
+                response = empty_response()
+                format_response(response, periods, forecast, 'en', forecast_type)
+                return JsonResponse(response)
+
+            response = empty_response()
+            format_response(response, periods, forecast, 'en', forecast_type)
+            encoders = ['django'] + (['orjson'] if encoding.orjson is not None else [])
+            for name in encoders:
+                with override_settings(RESPONSE_JSON_ENCODER='django' if name == 'django' else 'auto'):
+                    result = measure(lambda: dumps(response), repeat=200)
+                    size = len(dumps(response))
+                result.update(forecast_type=forecast_type, case='encode only ({0})'.format(name), bytes=size)
+                rows.append(result)
+
+            body = dumps(response)
+            result = measure(format_and_encode, repeat=200)
+            result.update(forecast_type=forecast_type, case='format + JsonResponse per request (before)',
+                          bytes=len(format_and_encode().content))
+            rows.append(result)
+
+            result = measure(lambda: json_response(body), repeat=200)
+            result.update(forecast_type=forecast_type, case='cached body (after)', bytes=len(body))
+            rows.append(result)
+    print_table(rows, ['forecast_type', 'case', 'bytes', 'best_ms', 'mean_ms'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Measures cached searches with the response cache of each process against the response cache shared through
+a Django cache: a hit, a raw read of the cached response, and the first search of a worker process
+that has not answered it before. With a shared cache another worker has already cached it, without one the worker
+formats the response from the database again.
+
+The shared caches measured are Django's local memory cache, the overhead of the cache API and pickling alone,
+and the file based cache any process on the host can read. Pass --memcached host:port to measure memcached as well.
+
+    python -m benchmarks.bench_shared_cache
+"""
+import argparse
+import shutil
+import tempfile
+from unittest import mock
+
+from benchmarks.common import setup_django, test_database, measure, print_table
+
+setup_django()
+
+from django.test import RequestFactory  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from py_yr.config.settings import FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY  # noqa: E402
+
+from api import views  # noqa: E402
+from api.cache import ResponseCache, SharedResponseCache, cache_key  # noqa: E402
+from api.helper import save_weather_data  # noqa: E402
+from api.tests.fixtures import fake_yr  # noqa: E402
+
+
+def caches(directory: str, memcached: str = None) -> dict:
+    """
+    Returns(dict): CACHES with a cache of every kind measured
+    """
+    configured = {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench'},
+        'file': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory},
+    }
+    if memcached:
+        configured['memcached'] = {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': memcached,
+        }
+    return configured
+
+
+def measure_cache(name, new_cache, request, key) -> list:
+    """
+    Measures one kind of response cache
+    Args:
+        name(str): The name in the results
+        new_cache(callable): Returns the response cache of a new worker process
+        request(HttpRequest): The search
+        key(tuple): Its cache key
+
+    Returns(list): The results
+    """
+    rows = []
+    cache = new_cache()
+    cache.clear()
+    with mock.patch('api.views.response_cache', cache), mock.patch('api.helper.response_cache', cache):
+        views.search(request)
+        cached = cache.get(key)
+        rows.append(dict(measure(lambda: views.search(request), repeat=500), cache=name, case='search hit',
+                         bytes=len(cached.body)))
+        rows.append(dict(measure(lambda: cache.get(key), repeat=500), cache=name, case='get'))
+
+    # A worker process that starts with its own, empty, cache object
+    patches = []
+
+    def new_worker():
+        worker = new_cache()
+        patches[:] = [mock.patch('api.views.response_cache', worker), mock.patch('api.helper.response_cache', worker)]
+        for patch in patches:
+            patch.start()
+
+    def first_search():
+        try:
+            views.search(request)
+        finally:
+            for patch in patches:
+                patch.stop()
+
+    rows.append(dict(measure(first_search, repeat=50, setup=new_worker), cache=name, case='first search of a worker'))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--memcached', help='host:port of a memcached to measure as well')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    kinds = [('process', lambda: ResponseCache(1000))]
+    for alias in ('locmem', 'file') + (('memcached',) if args.memcached else ()):
+        kinds.append((alias, lambda alias=alias: SharedResponseCache(alias)))
+
+    rows = []
+    factory = RequestFactory()
+    try:
+        with test_database(), override_settings(CACHES=caches(directory, args.memcached)):
+            for forecast_type in (FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY):
+                yr = fake_yr(forecast_type=forecast_type)
+                save_weather_data(yr)
+                params = {'location': yr.location[:-1], 'language': 'en', 'forecastType': forecast_type}
+                request = factory.get('/api/search/', params, HTTP_ACCEPT_ENCODING='gzip')
+                key = cache_key(yr.location, 'en', forecast_type)
+                for name, new_cache in kinds:
+                    for row in measure_cache(name, new_cache, request, key):
+                        row.update(forecast_type=forecast_type)
+                        rows.append(row)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    print_table(rows, ['forecast_type', 'cache', 'case', 'bytes', 'best_ms', 'mean_ms', 'p95_ms', 'queries'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Compares the relational and the compact storage layout of forecast periods:
+database size, save latency and read latency, for standard and hourly forecasts.
+
+    python -m benchmarks.bench_storage --forecasts 200
+"""
+import argparse
+
+from benchmarks.common import setup_django, test_database, measure, print_table
+
+setup_django()
+
+from django.db import connection  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from py_yr.config.settings import FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY  # noqa: E402
+
+from api.helper import save_weather_data  # noqa: E402
+from api.models import Forecast  # noqa: E402
+from api.storage import STORAGE_RELATIONAL, STORAGE_COMPACT, read_periods  # noqa: E402
+from api.tests.fixtures import fake_yr  # noqa: E402
+
+
+def database_bytes() -> int:
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('PRAGMA page_count')
+            pages = cursor.fetchone()[0]
+            cursor.execute('PRAGMA freelist_count')
+            pages -= cursor.fetchone()[0]
+            cursor.execute('PRAGMA page_size')
+            return pages * cursor.fetchone()[0]
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT pg_database_size(current_database())')
+            return cursor.fetchone()[0]
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--forecasts', type=int, default=200, help='Forecasts saved per layout and type')
+    args = parser.parse_args()
+
+    rows = []
+    with test_database():
+        for storage in (STORAGE_RELATIONAL, STORAGE_COMPACT):
+            for forecast_type in (FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY):
+                yr = fake_yr(forecast_type=forecast_type)
+                with override_settings(FORECAST_STORAGE=storage):
+                    size_before = database_bytes()
+                    save = measure(lambda: save_weather_data(yr), repeat=args.forecasts)
+                    size = database_bytes() - size_before
+
+                forecast = Forecast.objects.with_related().filter(forecast_type=forecast_type).latest('created')
+                read = measure(lambda: read_periods(Forecast.objects.get(pk=forecast.pk)), repeat=50)
+                rows.append(dict(
+                    storage=storage,
+                    forecast_type=forecast_type,
+                    bytes_per_forecast=size // args.forecasts,
+                    save_ms=save['mean_ms'],
+                    save_queries=save['queries'],
+                    read_ms=read['mean_ms'],
+                    read_queries=read['queries'],
+                ))
+    print_table(rows, ['storage', 'forecast_type', 'bytes_per_forecast', 'save_ms', 'save_queries', 'read_ms',
+                       'read_queries'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Run a benchmark from the repository root, e.g.::
+
+    python -m benchmarks.bench_save
+
+Every benchmark runs against a freshly created test database, so the development database is never touched.
+"""
+import contextlib
+import os
+import statistics
+import time
+
+
+def setup_django(settings_module: str = 'weather_api.settings.local') -> None:
+    """
+    Configures django for a stand alone script
+    Args:
+        settings_module(str): The settings module to use
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+@contextlib.contextmanager
+def test_database():
+    """
+    Creates a throwaway database for the duration of the block
+    """
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def measure(func, repeat: int = 5, setup=None) -> dict:
+    """
+    Runs func a number of times and records wall clock time and database queries
+    Args:
+        func(callable): The code to measure
+        repeat(int): Number of runs
+        setup(callable): Called before every run, not included in the timing
+
+    Returns(dict): Best, mean and 95th percentile wall clock time in milliseconds,
+                   and the number of queries of the last run
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        # A full query log stops growing, and the queries of the run could not be counted
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        queries = len(captured)
+    ordered = sorted(timings)
+    return {
+        'best_ms': round(ordered[0], 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        'queries': queries,
+    }
+
+
+def print_table(rows: list, columns: list) -> None:
+    """
+    Prints a list of dicts as an aligned table
+    Args:
+        rows(list): The rows to print
+        columns(list): The keys to print, in order
+    """
+    widths = [max(len(str(column)), *(len(str(row.get(column, ''))) for row in rows)) for column in columns]
+    print('  '.join(str(column).ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(str(row.get(column, '')).ljust(width) for column, width in zip(columns, widths)))
@@ -0,0 +1,135 @@
+"""
+A local stand-in for yr.no, so that downloads can be benchmarked without the network.
+
+It answers every forecast url with a recorded document from benchmarks/data, forecast.xml for standard forecasts
+and forecast_hour_by_hour.xml for hourly ones, whatever the location and language. Point the service at it with
+UPSTREAM_BASE_URL::
+
+    with FakeYr(latency=0.05, error_rate=0.1) as upstream, override_settings(UPSTREAM_BASE_URL=upstream.url):
+        ...
+"""
+import os
+import random
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+DOCUMENTS = ('forecast.xml', 'forecast_hour_by_hour.xml')
+
+
+def recorded(name: str) -> bytes:
+    """
+    A recorded yr.no document
+    Args:
+        name(str): forecast.xml or forecast_hour_by_hour.xml
+
+    Returns(bytes): The document
+    """
+    with open(os.path.join(DATA_DIR, name), 'rb') as f:
+        return f.read()
+
+
+class FakeYrHandler(BaseHTTPRequestHandler):
+    # Keeps connections open between requests, like yr.no does
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        upstream = self.server.upstream
+        status, body = upstream.answer(self.path)
+        if upstream.latency or upstream.jitter:
+            time.sleep(upstream.latency + random.uniform(0, upstream.jitter))
+        self.send_response(status)
+        self.send_header('Content-Type', upstream.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeYrServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeYr:
+    """
+    Serves recorded forecasts on a local port, with injected latency and errors
+    """
+
+    def __init__(self, latency: float = 0, jitter: float = 0, error_rate: float = 0, not_found_rate: float = 0,
+                 seed: int = None, port: int = 0, documents: dict = None,
+                 content_type: str = 'text/xml; charset=utf-8'):
+        """
+        Args:
+            latency(float): Seconds every response is delayed
+            jitter(float): Up to this many seconds more, at random
+            error_rate(float): Share of requests answered with 503 Service Unavailable
+            not_found_rate(float): Share of requests answered with 404 Not Found
+            seed(int): Seeds the errors, so that runs can be repeated
+            port(int): The port to listen on, any free port by default
+            documents(dict): Bodies to answer with by file name, the recorded documents by default
+            content_type(str): The Content-Type of every response
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.not_found_rate = not_found_rate
+        self.port = port
+        self.content_type = content_type
+        # Statuses to answer the next requests with, before any injected error
+        self.statuses = []
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._documents = documents if documents is not None else {name: recorded(name) for name in DOCUMENTS}
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:{0}'.format(self._server.server_port)
+
+    def answer(self, path):
+        """
+        Decides the response to a request
+        Returns(tuple): The status and the body
+        """
+        with self._lock:
+            self.requests += 1
+            if self.statuses:
+                status = self.statuses.pop(0)
+            else:
+                roll = self._random.random()
+                status = 200
+                if roll < self.error_rate:
+                    status = 503
+                elif roll < self.error_rate + self.not_found_rate:
+                    status = 404
+            if status >= 500:
+                self.errors += 1
+        name = os.path.basename(path.split('?')[0])
+        if status == 200 and name not in self._documents:
+            status = 404
+        if status != 200:
+            return status, HTTPStatus(status).phrase.encode('ascii')
+        return 200, self._documents[name]
+
+    def start(self) -> 'FakeYr':
+        self._server = FakeYrServer(('127.0.0.1', self.port), FakeYrHandler)
+        self._server.upstream = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
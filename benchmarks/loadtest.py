@@ -0,0 +1,265 @@
+"""
+Load test of /api/search: many concurrent clients searching a Zipf distributed mix of locations,
+languages and forecast types, with downloads going to the local yr.no stand-in in benchmarks.fake_yr.
+
+Every scenario starts with no stored forecasts and reports throughput, latency percentiles, server errors,
+"database is locked" errors, downloads from yr.no and duplicate forecasts, forecasts of the same location and type
+that were downloaded more than once.
+
+By default the WSGI application in weather_api.wsgi is called in-process, on a throwaway database of the settings
+module. SQLite test databases are put in a file, so that clients contend for its locks like in production.
+To compare with a server database, pass --settings a settings module that uses one::
+
+    python -m benchmarks.loadtest --clients 10 100 300 --requests 20
+
+With --url the clients send real HTTP requests to a running server instead. Start that server with UPSTREAM_BASE_URL
+set to the stand-in, which listens on --upstream-port. Forecasts are not counted then, the database is the server's.
+"""
+import argparse
+import bisect
+import io
+import itertools
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+from benchmarks.common import setup_django, test_database, print_table
+from benchmarks.fake_yr import FakeYr
+
+LANGUAGES = ('en', 'nb', 'nn')
+
+
+class Zipf:
+    """
+    Draws items with weights 1 / rank ^ exponent, so the first items are drawn far more often than the rest
+    """
+
+    def __init__(self, items, exponent: float, rng: random.Random):
+        self.items = list(items)
+        self.cumulative = list(itertools.accumulate(1 / (rank ** exponent) for rank in range(1, len(self.items) + 1)))
+        self.rng = rng
+
+    def draw(self):
+        return self.items[bisect.bisect(self.cumulative, self.rng.random() * self.cumulative[-1])]
+
+
+class ErrorCounter(logging.Handler):
+    """
+    Counts the errors Django and the api log while handling requests
+    """
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.errors = 0
+        self.locked = 0
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        locked = record.exc_info is not None and 'database is locked' in str(record.exc_info[1])
+        with self._lock:
+            self.errors += 1
+            self.locked += locked
+
+
+def percentile(ordered: list, share: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))] if ordered else 0
+
+
+def in_process_client():
+    """
+    Sends requests straight to the WSGI application
+    Returns(callable): Takes the query parameters, returns the status code
+    """
+    from weather_api.wsgi import application
+
+    def send(params):
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': '/api/search',
+            'QUERY_STRING': urlencode(params),
+            'SERVER_NAME': '127.0.0.1',
+            'SERVER_PORT': '80',
+            'HTTP_HOST': '127.0.0.1',
+            'HTTP_ACCEPT_ENCODING': 'gzip',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        status = []
+        body = application(environ, lambda s, headers, exc_info=None: status.append(s))
+        try:
+            for _ in body:
+                pass
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        return int(status[0].split(' ', 1)[0])
+
+    return send
+
+
+def http_client(url: str):
+    """
+    Sends requests to a running server, over one keep-alive connection per client thread
+    Returns(callable): Takes the query parameters, returns the status code
+    """
+    import requests
+    sessions = threading.local()
+
+    def send(params):
+        if not hasattr(sessions, 'session'):
+            sessions.session = requests.Session()
+        return sessions.session.get(url.rstrip('/') + '/api/search', params=params).status_code
+
+    return send
+
+
+def run_scenario(send, clients: int, requests: int, draw) -> dict:
+    """
+    Runs clients threads that each send requests searches, all starting at the same time
+    Returns(dict): Throughput, latency percentiles and the number of server errors
+    """
+    latencies = []
+    errors = []
+    barrier = threading.Barrier(clients)
+
+    def client():
+        from django.db import connection
+        try:
+            barrier.wait()
+            for params in [draw() for _ in range(requests)]:
+                started = time.perf_counter()
+                status = send(params)
+                latencies.append((time.perf_counter() - started) * 1000)
+                if status >= 500:
+                    errors.append(status)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    return {
+        'clients': clients,
+        'requests': len(latencies),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(ordered, 0.50), 1),
+        'p95_ms': round(percentile(ordered, 0.95), 1),
+        'p99_ms': round(percentile(ordered, 0.99), 1),
+        'mean_ms': round(statistics.mean(ordered), 1) if ordered else 0,
+        'server_errors': len(errors),
+    }
+
+
+def reset():
+    """
+    Forgets every stored forecast and everything cached about them
+    """
+    from api.cache import response_cache, negative_cache
+    from api.models import Forecast
+
+    Forecast.objects.all().delete()
+    response_cache.clear()
+    negative_cache.clear()
+
+
+def duplicate_forecasts() -> int:
+    """
+    Forecasts stored more than once for the same location and type
+    """
+    from django.db.models import Count
+    from api.models import Forecast
+
+    stored = Forecast.objects.values('search', 'forecast_type').annotate(count=Count('id'))
+    return sum(row['count'] - 1 for row in stored)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, nargs='+', default=[10, 100, 300],
+                        help='Concurrent clients of each scenario')
+    parser.add_argument('--requests', type=int, default=20, help='Searches each client sends')
+    parser.add_argument('--locations', type=int, default=200, help='Distinct locations searched')
+    parser.add_argument('--exponent', type=float, default=1.1, help='Zipf exponent of the location mix')
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds the yr.no stand-in takes to answer')
+    parser.add_argument('--jitter', type=float, default=0.1, help='Up to this many seconds more, at random')
+    parser.add_argument('--error-rate', type=float, default=0, help='Share of downloads answered with 503')
+    parser.add_argument('--seed', type=int, default=0, help='Seeds the search mix and the injected errors')
+    parser.add_argument('--settings', default='weather_api.settings.local', help='Django settings module')
+    parser.add_argument('--url', help='Load test a running server instead of the in-process application')
+    parser.add_argument('--upstream-port', type=int, default=0, help='Port of the yr.no stand-in')
+    args = parser.parse_args()
+
+    setup_django(args.settings)
+    from django.db import connection
+    from django.test.utils import override_settings
+    from py_yr.config.settings import FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY
+    from api.models import Forecast
+
+    rng = random.Random(args.seed)
+    locations = Zipf(['norway/place-{0}/place-{0}/place-{0}'.format(i) for i in range(args.locations)],
+                     args.exponent, rng)
+    languages = Zipf(LANGUAGES, 1, rng)
+    forecast_types = Zipf((FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY), 1, rng)
+    draw_lock = threading.Lock()
+
+    def draw():
+        with draw_lock:
+            return {'location': locations.draw(), 'language': languages.draw(), 'forecastType': forecast_types.draw()}
+
+    upstream = FakeYr(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, seed=args.seed,
+                      port=args.upstream_port)
+    rows = []
+    with upstream:
+        if args.url:
+            print('yr.no stand-in listening on {0}'.format(upstream.url))
+            send = http_client(args.url)
+            for clients in args.clients:
+                requests = upstream.requests
+                row = run_scenario(send, clients, args.requests, draw)
+                row.update(upstream_requests=upstream.requests - requests)
+                rows.append(row)
+        else:
+            if connection.vendor == 'sqlite':
+                connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'loadtest.sqlite3')
+            errors = ErrorCounter()
+            for name in ('django.request', 'api'):
+                logging.getLogger(name).addHandler(errors)
+            send = in_process_client()
+            with test_database(), override_settings(UPSTREAM_BASE_URL=upstream.url, ALLOWED_HOSTS=['*'], DEBUG=False):
+                for clients in args.clients:
+                    reset()
+                    requests, logged, locked = upstream.requests, errors.errors, errors.locked
+                    row = run_scenario(send, clients, args.requests, draw)
+                    row.update(
+                        upstream_requests=upstream.requests - requests,
+                        forecasts=Forecast.objects.count(),
+                        duplicates=duplicate_forecasts(),
+                        logged_errors=errors.errors - logged,
+                        locked=errors.locked - locked,
+                    )
+                    rows.append(row)
+
+    print('{0}, database: {1}'.format(args.url or 'in-process', 'the server\'s' if args.url else connection.vendor))
+    print_table(rows, ['clients', 'requests', 'rps', 'p50_ms', 'p95_ms', 'p99_ms', 'mean_ms', 'server_errors',
+                       'upstream_requests', 'forecasts', 'duplicates', 'logged_errors', 'locked'])
+
+
+if __name__ == '__main__':
+    main()
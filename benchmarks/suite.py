@@ -0,0 +1,179 @@
+"""
+The benchmark suite: saving, grouping and formatting forecasts, and /api/search when its response is cached (warm),
+when the forecast is stored but its response is not (stored), when the forecast has to be downloaded (cold)
+and when an expired forecast is served while it is refreshed (stale).
+
+Downloads go to the local yr.no stand-in in benchmarks.fake_yr, with the latency and errors given on the command line.
+Results can be written as JSON and compared with the results of another commit::
+
+    python -m benchmarks.suite --json before.json
+    git checkout other-branch
+    python -m benchmarks.suite --compare before.json
+"""
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import time
+
+from benchmarks.common import setup_django, test_database, measure, print_table
+from benchmarks.fake_yr import FakeYr, recorded
+
+setup_django()
+
+import django  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from py_yr.config.settings import FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY  # noqa: E402
+from py_yr.yr import Yr  # noqa: E402
+
+from api import views  # noqa: E402
+from api.cache import response_cache, negative_cache, cache_key  # noqa: E402
+from api.helper import save_weather_data, group_by_day  # noqa: E402
+from api.models import Forecast  # noqa: E402
+from api.storage import read_periods  # noqa: E402
+from api.upstream import downloads  # noqa: E402
+
+LOCATION = 'norway/hordaland/bergen/bergen'
+SEARCH = LOCATION + '/'
+LANGUAGE = 'en'
+DOCUMENTS = {
+    FORECAST_TYPE_STANDARD: 'forecast.xml',
+    FORECAST_TYPE_HOURLY: 'forecast_hour_by_hour.xml',
+}
+
+
+def recorded_yr(forecast_type) -> Yr:
+    """
+    A Yr object holding a recorded forecast, as if it was just downloaded
+    """
+    yr = Yr(SEARCH, LANGUAGE, forecast_type)
+    yr.source_data = recorded(DOCUMENTS[forecast_type]).decode('utf-8')
+    return yr
+
+
+def empty_response() -> dict:
+    return {'success': True, 'data': {'meta': None, 'forecasts': None}, 'message': ''}
+
+
+def wait_for_refreshes(forecast_type, timeout: float = 30) -> None:
+    """
+    Waits until a background refresh of the search has finished, so it does not spill into the next run
+    """
+    key = cache_key(SEARCH, LANGUAGE, forecast_type)
+    deadline = time.monotonic() + timeout
+    while downloads.in_flight(key) and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+def scenarios(forecast_type, factory):
+    """
+    The benchmarks of one forecast type
+    Returns(list): (name, function, setup, repeat) of each benchmark
+    """
+    request = factory.get('/api/search', {'location': LOCATION, 'language': LANGUAGE, 'forecastType': forecast_type})
+    yr = recorded_yr(forecast_type)
+    save_weather_data(yr)
+    forecast = Forecast.objects.with_related().filter(search=SEARCH, forecast_type=forecast_type).latest('created')
+    periods = read_periods(forecast)
+
+    def format_only():
+        views.format_response(empty_response(), periods, forecast, LANGUAGE, forecast_type)
+
+    def cold():
+        Forecast.objects.filter(search=SEARCH, forecast_type=forecast_type).delete()
+        response_cache.clear()
+        negative_cache.clear()
+
+    def stored():
+        response_cache.clear()
+
+    def stale():
+        wait_for_refreshes(forecast_type)
+        Forecast.objects.filter(search=SEARCH).update(expires_at=timezone.now() - datetime.timedelta(minutes=1))
+        response_cache.clear()
+
+    return [
+        ('save_weather_data', lambda: save_weather_data(yr), None, 50),
+        ('group_by_day', lambda: group_by_day(periods, LANGUAGE, forecast_type), None, 200),
+        ('format_response', format_only, None, 200),
+        ('search stored', lambda: views.search(request), stored, 50),
+        # The last stored search cached its response
+        ('search warm', lambda: views.search(request), None, 200),
+        ('search cold', lambda: views.search(request), cold, 20),
+        ('search stale', lambda: views.search(request), stale, 20),
+    ]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL) \
+            .decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(rows: list, path: str) -> None:
+    """
+    Prints the mean of every benchmark next to the mean in an earlier result file
+    """
+    with open(path) as f:
+        before = {result['name']: result for result in json.load(f)['results']}
+    table = []
+    for row in rows:
+        old = before.get(row['name'])
+        if old is None:
+            continue
+        change = (row['mean_ms'] - old['mean_ms']) / old['mean_ms'] * 100 if old['mean_ms'] else 0
+        table.append(dict(name=row['name'], before_ms=old['mean_ms'], after_ms=row['mean_ms'],
+                          change='{0:+.1f}%'.format(change)))
+    print()
+    print_table(table, ['name', 'before_ms', 'after_ms', 'change'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds the yr.no stand-in takes to answer')
+    parser.add_argument('--jitter', type=float, default=0, help='Up to this many seconds more, at random')
+    parser.add_argument('--error-rate', type=float, default=0, help='Share of downloads answered with 503')
+    parser.add_argument('--not-found-rate', type=float, default=0, help='Share of downloads answered with 404')
+    parser.add_argument('--seed', type=int, default=0, help='Seeds the injected errors')
+    parser.add_argument('--json', help='Writes the results to this file')
+    parser.add_argument('--compare', help='Compares the results with an earlier --json file')
+    args = parser.parse_args()
+
+    upstream = FakeYr(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                      not_found_rate=args.not_found_rate, seed=args.seed)
+    rows = []
+    with test_database(), upstream:
+        with override_settings(UPSTREAM_BASE_URL=upstream.url, FORECAST_STALE_WHILE_REVALIDATE=True):
+            factory = RequestFactory()
+            for forecast_type in (FORECAST_TYPE_STANDARD, FORECAST_TYPE_HOURLY):
+                for name, func, setup, repeat in scenarios(forecast_type, factory):
+                    requests = upstream.requests
+                    result = measure(func, repeat=repeat, setup=setup)
+                    result.update(
+                        name='{0} ({1})'.format(name, forecast_type),
+                        upstream_requests=round((upstream.requests - requests) / repeat, 2)
+                    )
+                    rows.append(result)
+                wait_for_refreshes(forecast_type)
+    print_table(rows, ['name', 'best_ms', 'mean_ms', 'p95_ms', 'queries', 'upstream_requests'])
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'options': vars(args),
+                'results': rows,
+            }, f, indent=2)
+    if args.compare:
+        compare(rows, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,11 +11,16 @@ https://docs.djangoproject.com/en/1.10/ref/settings/
 """
 
 import os
+
 from django.utils.translation import ugettext_lazy as _
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# Files the api writes at runtime, next to the source tree by default. Only the user running the api may use it,
+# it is created with mode 0700 when the api starts, and starting fails if it belongs to someone else
+VAR_DIR = os.environ.get('WEATHER_API_VAR_DIR', os.path.join(os.path.dirname(BASE_DIR), 'var'))
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/1.10/howto/deployment/checklist/
@@ -34,6 +39,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
+    'api.middleware.ProfilingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -113,4 +120,139 @@ LOCALE_PATHS = (
 
 STATIC_URL = '/static/'
 
-CORS_ORIGIN_ALLOW_ALL = True
\ No newline at end of file
+CORS_ORIGIN_ALLOW_ALL = True
+
+# Forecasts
+# Number of minutes a downloaded forecast is served before it is downloaded again
+
+FORECAST_CACHE_MINUTES = 10
+
+# How the periods of new forecasts are stored, see api.storage.
+# 'relational' uses a Time row per period, 'compact' packs them into the forecast row
+
+FORECAST_STORAGE = 'relational'
+
+# Serve an expired forecast, flagged as stale, while a newer one is downloaded in the background.
+# Forecasts that expired more than FORECAST_MAX_STALE_MINUTES ago are downloaded before responding.
+
+FORECAST_STALE_WHILE_REVALIDATE = False
+FORECAST_MAX_STALE_MINUTES = 60
+
+# Answer standard searches from the stored hourly forecast, when it covers the next FORECAST_DERIVE_STANDARD_HOURS.
+# The hourly forecast reaches about two days, the days after it come from the stored standard forecast
+# if it expired less than FORECAST_DERIVE_STANDARD_TAIL_HOURS ago. Otherwise the standard forecast is downloaded
+
+FORECAST_DERIVE_STANDARD = False
+FORECAST_DERIVE_STANDARD_HOURS = 36
+FORECAST_DERIVE_STANDARD_TAIL_HOURS = 6
+
+# Number of formatted search responses each process keeps in memory, 0 disables the cache
+
+RESPONSE_CACHE_MAX_ENTRIES = 1000
+
+# The Django cache formatted search responses are kept in instead, so that every worker process of the host
+# shares them and a new forecast is served by all of them at once. Empty keeps the responses in each process.
+# 'responses' is a file based cache in VAR_DIR every process of the user can read, memcached is faster
+
+RESPONSE_SHARED_CACHE = ''
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(VAR_DIR, 'response_cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+}
+
+# 'auto' serializes responses with orjson when it is installed, 'django' always uses DjangoJSONEncoder
+
+RESPONSE_JSON_ENCODER = 'auto'
+
+# Content codings cached search responses are compressed with, in order of preference. 'br' needs brotli
+
+RESPONSE_ENCODINGS = ['br', 'gzip']
+
+# Most locations one /api/search/batch request can ask for, and threads it downloads missing forecasts with
+
+SEARCH_BATCH_MAX_LOCATIONS = 50
+SEARCH_BATCH_WORKERS = 8
+
+# Most locations one /api/analytics request can ask for, and the default base temperature of its degree-hours.
+# Stored forecasts are aggregated for all of them, but at most ANALYTICS_MAX_DOWNLOADS missing ones are downloaded,
+# the rest are reported as not downloaded
+
+ANALYTICS_MAX_LOCATIONS = 1000
+ANALYTICS_MAX_DOWNLOADS = 50
+ANALYTICS_DEGREE_HOURS_BASE = 18.0
+
+# Time requests, count their queries and add a Server-Timing header, and show the metrics at /api/metrics.
+# Histogram buckets are in seconds
+
+METRICS_ENABLED = True
+METRICS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# Profile a PROFILING_SAMPLE_RATE share of the requests to PROFILING_VIEWS with cProfile,
+# and every request with an X-Profile header holding PROFILING_SECRET. An empty secret turns the header off.
+# The newest PROFILING_MAX_PROFILES profiles are kept in PROFILING_DIRECTORY, see manage.py summarize_profiles
+
+PROFILING_ENABLED = False
+PROFILING_SAMPLE_RATE = 0.01
+PROFILING_VIEWS = ['search']
+PROFILING_SECRET = ''
+PROFILING_DIRECTORY = os.path.join(VAR_DIR, 'profiles')
+PROFILING_MAX_PROFILES = 200
+
+# Upstream (yr.no)
+# Seconds a request waits on another request's download of the same forecast before giving up
+
+UPSTREAM_COALESCE_SECONDS = 15
+
+# Forecasts are fetched over a pool of keep-alive connections. Timeouts are in seconds,
+# failed fetches are retried after a random wait of up to UPSTREAM_RETRY_BACKOFF * 2 ^ attempt seconds
+
+UPSTREAM_BASE_URL = 'https://www.yr.no'
+UPSTREAM_POOL_SIZE = 10
+UPSTREAM_CONNECT_TIMEOUT = 3.05
+UPSTREAM_READ_TIMEOUT = 10
+UPSTREAM_RETRIES = 2
+UPSTREAM_RETRY_BACKOFF = 0.25
+
+# Downloads stop for UPSTREAM_BREAKER_RESET_SECONDS after UPSTREAM_BREAKER_FAILURES failed downloads in a row,
+# downloads slower than UPSTREAM_BREAKER_SLOW_SECONDS count as failed. The last stored forecast is served meanwhile.
+# Each process runs at most UPSTREAM_MAX_IN_FLIGHT downloads at a time, the rest are refused at once
+
+UPSTREAM_BREAKER_FAILURES = 5
+UPSTREAM_BREAKER_SLOW_SECONDS = 5
+UPSTREAM_BREAKER_RESET_SECONDS = 30
+UPSTREAM_MAX_IN_FLIGHT = 8
+
+# Searches yr.no failed to answer are not downloaded again for this many seconds.
+# Locations yr.no does not know are remembered longer than upstream errors
+
+NEGATIVE_CACHE_MAX_ENTRIES = 10000
+NEGATIVE_CACHE_NOT_FOUND_SECONDS = 300
+NEGATIVE_CACHE_UPSTREAM_ERROR_SECONDS = 30
+
+# Seconds each process counts searches in memory before adding them to the database, see api.popularity
+
+POPULARITY_FLUSH_SECONDS = 60
+
+# Defaults of the prefetch_forecasts command, which keeps the most popular forecasts fresh
+
+PREFETCH_TOP = 100
+PREFETCH_HISTORY_HOURS = 24
+PREFETCH_LEAD_SECONDS = 60
+PREFETCH_WORKERS = 4
+PREFETCH_BUDGET_PER_MINUTE = 60
+PREFETCH_INTERVAL_SECONDS = 30
+
+# Defaults of the prune_forecasts command, which deletes forecasts that will never be served again
+
+PRUNE_KEEP_FORECASTS = 1
+PRUNE_KEEP_HOURS = 24
+PRUNE_BATCH_SIZE = 20